@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Điểm vào chung: python -m vietnamgiapha <lệnh> [tham số...]
+
+Chỉ module của lệnh được chọn mới được nạp (chạy như "python -m <module>"), nên các lệnh nhẹ
+và --help không phải trả giá nạp bs4/lxml/aiohttp/requests. Không dùng argparse ở đây: mọi tham số
+sau tên lệnh được chuyển nguyên cho module đó.
+"""
+import sys
+import runpy
+
+# lệnh -> (module, mô tả)
+COMMANDS = {
+    "run": ("vietnamgiapha.pipelines.main_pipeline", "Chạy toàn bộ pipeline (thu thập, trích xuất, nhập liệu API)"),
+    "crawl": ("vietnamgiapha.pipelines.crawl_pipeline", "Thu thập HTML của gia đình"),
+    "extract": ("vietnamgiapha.pipelines.extract_pipeline_rulebase", "Trích xuất dữ liệu dựa trên quy tắc"),
+    "extract-llm": ("vietnamgiapha.pipelines.extract_pipeline", "Trích xuất bằng LLM (Ollama) hoặc hybrid"),
+    "ingest": ("vietnamgiapha.pipelines.api_ingestion_pipeline", "Tạo thành viên và cập nhật mối quan hệ qua API"),
+    "export": ("vietnamgiapha.export.export_columnar", "Xuất dữ liệu dạng cột (Parquet / Arrow IPC)"),
+    "store": ("vietnamgiapha.data_store", "Nạp dữ liệu đã trích xuất vào kho SQLite"),
+}
+
+# python -m vietnamgiapha bench <tên> [tham số...]
+BENCHMARKS = {
+    "extractors": ("vietnamgiapha.benchmarks.bench_extractors", "Benchmark các bộ trích xuất theo luật"),
+    "llm": ("vietnamgiapha.benchmarks.bench_llm_pipeline", "Benchmark pipeline LLM với Ollama giả lập"),
+    "import": ("vietnamgiapha.benchmarks.bench_import_time", "Kiểm tra thời gian khởi động (import) của từng lệnh"),
+    "mock-ollama": ("vietnamgiapha.benchmarks.mock_ollama", "Chạy máy chủ Ollama giả lập"),
+    "synthetic": ("vietnamgiapha.benchmarks.synthetic_html", "Sinh dữ liệu HTML tổng hợp"),
+}
+
+
+def _usage(title: str, table: dict) -> str:
+    width = max(len(name) for name in table)
+    lines = [title, ""]
+    lines.extend(f"  {name:<{width}}  {description}" for name, (_, description) in table.items())
+    return "\n".join(lines)
+
+
+def usage() -> str:
+    return (_usage("Cách dùng: python -m vietnamgiapha <lệnh> [tham số...]   (<lệnh> --help để xem tham số)", COMMANDS)
+            + "\n  " + f"{'bench':<{max(len(name) for name in COMMANDS)}}  Các benchmark: python -m vietnamgiapha bench <tên> ...")
+
+
+def resolve(argv: list) -> tuple:
+    """
+    Trả về (module, tham số còn lại) cho dòng lệnh `argv`. Khi không chạy lệnh nào: (None, (thông báo, mã thoát)).
+    """
+    if not argv or argv[0] in ("-h", "--help"):
+        return None, (usage(), 0)
+    command, rest = argv[0], argv[1:]
+    if command == "bench":
+        if not rest or rest[0] in ("-h", "--help"):
+            return None, (_usage("Cách dùng: python -m vietnamgiapha bench <tên> [tham số...]", BENCHMARKS), 0)
+        if rest[0] not in BENCHMARKS:
+            return None, (f"Không có benchmark '{rest[0]}'.\n\n" + _usage("Các benchmark:", BENCHMARKS), 2)
+        return BENCHMARKS[rest[0]][0], rest[1:]
+    if command not in COMMANDS:
+        return None, (f"Không có lệnh '{command}'.\n\n" + usage(), 2)
+    return COMMANDS[command][0], rest
+
+
+def main(argv: list = None) -> int:
+    module, rest = resolve(sys.argv[1:] if argv is None else argv)
+    if module is None:
+        message, exit_code = rest
+        print(message)
+        return exit_code
+    # alter_sys: the module becomes __main__ and sys.argv[0] its path, exactly as with "python -m <module>",
+    # so argparse and process-pool workers (which unpickle functions from __main__) behave the same.
+    sys.argv = [module] + rest
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,268 @@
 # -*- coding: utf-8 -*-
 import os
 import json
+import time
+import threading
 import requests
 import logging
 from typing import Optional
-import dotenv
 
-# Load environment variables from .env file
-dotenv.load_dotenv(override=True)
+from vietnamgiapha.utils import profiling
+from vietnamgiapha.utils import budget
+from vietnamgiapha.utils import tracing
+from vietnamgiapha.utils import run_status
+from vietnamgiapha.utils.log_setup import LazyJson
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
 
-# Cấu hình API
-BASE_URL = os.getenv("BASE_URL", "http://localhost:8080/api") # Lấy từ biến môi trường, mặc định là localhost
-AUTH_TOKEN = os.getenv("AUTH_TOKEN", "") # Lấy từ biến môi trường, mặc định là chuỗi rỗng
+# Cấu hình API (BASE_URL, AUTH_TOKEN) được đọc ở request đầu tiên chứ không phải lúc import module,
+# để các lệnh không gọi API (hoặc chỉ xem --help) không phải nạp python-dotenv và tìm file .env.
+_api_settings = None
 
-HEADERS = {
-    "Content-Type": "application/json",
-    "Authorization": f"Bearer {AUTH_TOKEN}"
-}
+# Tham số kết nối mặc định; ghi đè bằng biến môi trường (hoặc file .env) cùng tên.
+DEFAULT_API_TIMEOUT = 60.0 # giây chờ phản hồi (thời gian chờ kết nối: API_CONNECT_TIMEOUT, mặc định 5)
+DEFAULT_API_CONNECT_TIMEOUT = 5.0
+DEFAULT_API_POOL_SIZE = 16 # số kết nối keep-alive giữ lại tới backend
+DEFAULT_API_MAX_RETRIES = 3
+DEFAULT_API_RETRY_BACKOFF = 0.5 # giây; thử lại lần đầu ngay, lần thứ n (n >= 2) chờ backoff * 2^(n-1)
+# Chỉ các request idempotent được thử lại (không có POST: tạo thành viên hai lần sẽ sinh bản ghi trùng).
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+def get_api_settings() -> tuple:
+    """
+    Trả về (base_url, headers). Lần gọi đầu tiên nạp file .env (ghi đè biến môi trường, như trước đây)
+    rồi đọc BASE_URL (mặc định localhost) và AUTH_TOKEN (mặc định chuỗi rỗng).
+    """
+    global _api_settings
+    if _api_settings is None:
+        import dotenv
+        dotenv.load_dotenv(override=True)
+        base_url = os.getenv("BASE_URL", "http://localhost:8080/api")
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {os.getenv('AUTH_TOKEN', '')}"
+        }
+        _api_settings = (base_url, headers)
+    return _api_settings
+
+class ApiClient:
+    """
+    Kết nối tới backend, dùng chung cho mọi hàm trong module: một requests.Session với HTTPAdapter giữ tối đa
+    `pool_size` kết nối keep-alive (một gia đình 5.000 thành viên cần hơn 15.000 request; mở lại kết nối TCP cho
+    mỗi request tốn nhiều hơn chính request đó), timeout mặc định và thử lại có backoff cho các request idempotent
+    (lỗi kết nối, 429 và 502/503/504; tôn trọng Retry-After). Sau lần thử cuối, phản hồi lỗi được trả về như cũ để
+    hàm gọi xử lý. Session an toàn khi dùng từ nhiều luồng (các stage của main_pipeline chạy song song).
+    """
+
+    def __init__(self, base_url: str, headers: dict, timeout: float = DEFAULT_API_TIMEOUT,
+                 connect_timeout: float = DEFAULT_API_CONNECT_TIMEOUT, pool_size: int = DEFAULT_API_POOL_SIZE,
+                 max_retries: int = DEFAULT_API_MAX_RETRIES, retry_backoff: float = DEFAULT_API_RETRY_BACKOFF):
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self.base_url = base_url
+        self.timeout = (connect_timeout, timeout)
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                      backoff_factor=retry_backoff, status_forcelist=RETRY_STATUS_CODES,
+                      allowed_methods=RETRY_METHODS, raise_on_status=False, respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_env(cls) -> "ApiClient":
+        """Client theo cấu hình API (get_api_settings) và các biến API_TIMEOUT, API_CONNECT_TIMEOUT, API_POOL_SIZE,
+        API_MAX_RETRIES, API_RETRY_BACKOFF."""
+        base_url, headers = get_api_settings()
+        return cls(base_url, headers,
+                   timeout=float(os.getenv("API_TIMEOUT") or DEFAULT_API_TIMEOUT),
+                   connect_timeout=float(os.getenv("API_CONNECT_TIMEOUT") or DEFAULT_API_CONNECT_TIMEOUT),
+                   pool_size=int(os.getenv("API_POOL_SIZE") or DEFAULT_API_POOL_SIZE),
+                   max_retries=int(os.getenv("API_MAX_RETRIES") or DEFAULT_API_MAX_RETRIES),
+                   retry_backoff=float(os.getenv("API_RETRY_BACKOFF") or DEFAULT_API_RETRY_BACKOFF))
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def get_client() -> ApiClient:
+    """
+    Client dùng chung của tiến trình, tạo ở request đầu tiên. Tiến trình con tạo bằng fork (worker của process pool)
+    tạo client riêng: kết nối của tiến trình cha không được dùng chung qua fork.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = ApiClient.from_env()
+                _client_pid = os.getpid()
+    return _client
+
+def _request(method: str, path: str, **kwargs) -> requests.Response:
+    """
+    Gửi một request HTTP tới backend (`path` tính từ BASE_URL) qua client dùng chung và ghi lại độ trễ vào profiler
+    (stage "api", gồm cả các lần thử lại). Mỗi request được tính vào ngân sách của gia đình đang nhập liệu (nếu có)
+    và vào trạng thái lần chạy (lỗi kết nối và mã 5xx được đếm là lỗi; 404 là câu trả lời "chưa tồn tại" bình thường).
+    """
+    budget.charge_request()
+    client = get_client()
+    start = time.perf_counter()
+    run_status.count("api_calls")
+    try:
+        with tracing.span(f"API {method}", "http", path=path) as span:
+            response = client.request(method, path, **kwargs)
+            span["status"] = response.status_code
+        if response.status_code >= 500:
+            run_status.count("errors")
+        return response
+    except requests.exceptions.RequestException:
+        run_status.count("errors")
+        raise
+    finally:
+        profiling.get_profiler().record("api", time.perf_counter() - start)
+
+class ApiResponse:
+    """Phản hồi của AsyncApiClient, với các thuộc tính mà hàm xử lý phản hồi dùng (như requests.Response)."""
+
+    def __init__(self, status_code: int, text: str, url: str):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+class AsyncApiClient:
+    """
+    Phiên bản asyncio (aiohttp) của ApiClient, cho chế độ tạo thành viên song song: tối đa `concurrency` request
+    cùng lúc trên các kết nối keep-alive, cùng timeout và cùng cách thử lại như ApiClient (chỉ request idempotent).
+    Lỗi kết nối / timeout được đổi thành requests.exceptions.ConnectionError / Timeout, nên các hàm xử lý phản hồi
+    dùng chung được với chế độ tuần tự.
+
+        async with api_services.AsyncApiClient.from_env(concurrency=16) as client:
+            member_id = await api_services.get_member_by_code_async(client, family_id, member_code)
+    """
+
+    def __init__(self, base_url: str, headers: dict, concurrency: int, timeout: float = DEFAULT_API_TIMEOUT,
+                 connect_timeout: float = DEFAULT_API_CONNECT_TIMEOUT, max_retries: int = DEFAULT_API_MAX_RETRIES,
+                 retry_backoff: float = DEFAULT_API_RETRY_BACKOFF):
+        self.base_url = base_url
+        self.headers = headers
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._session = None
+        self._semaphore = None
+
+    @classmethod
+    def from_env(cls, concurrency: int) -> "AsyncApiClient":
+        """Client theo cấu hình API và các biến môi trường như ApiClient.from_env (trừ API_POOL_SIZE: dùng `concurrency`)."""
+        base_url, headers = get_api_settings()
+        return cls(base_url, headers, concurrency,
+                   timeout=float(os.getenv("API_TIMEOUT") or DEFAULT_API_TIMEOUT),
+                   connect_timeout=float(os.getenv("API_CONNECT_TIMEOUT") or DEFAULT_API_CONNECT_TIMEOUT),
+                   max_retries=int(os.getenv("API_MAX_RETRIES") or DEFAULT_API_MAX_RETRIES),
+                   retry_backoff=float(os.getenv("API_RETRY_BACKOFF") or DEFAULT_API_RETRY_BACKOFF))
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        import asyncio
+        import aiohttp
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.timeout),
+                headers=self.headers,
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _backoff(self, retry: int, response_headers=None) -> float:
+        """Thời gian chờ trước lần thử lại thứ `retry` (như urllib3: lần đầu ngay, sau đó backoff * 2^(n-1))."""
+        retry_after = (response_headers or {}).get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return 0.0 if retry <= 1 else self.retry_backoff * (2 ** (retry - 1))
+
+    async def request(self, method: str, path: str, **kwargs) -> ApiResponse:
+        import asyncio
+        import aiohttp
+        url = f"{self.base_url}{path}"
+        retries = self.max_retries if method in RETRY_METHODS else 0
+        retry = 0
+        while True:
+            try:
+                async with self._semaphore, self._session.request(method, url, **kwargs) as response:
+                    text = await response.text()
+                    if response.status not in RETRY_STATUS_CODES or retry >= retries:
+                        return ApiResponse(response.status, text, url)
+                    delay_headers = response.headers
+            except asyncio.TimeoutError as e:
+                if retry >= retries:
+                    raise requests.exceptions.Timeout(f"{method} {url}: timeout") from e
+                delay_headers = None
+            except aiohttp.ClientError as e:
+                if retry >= retries:
+                    raise requests.exceptions.ConnectionError(f"{method} {url}: {e}") from e
+                delay_headers = None
+            retry += 1
+            await asyncio.sleep(self._backoff(retry, delay_headers)) # Chờ ngoài semaphore: không giữ chỗ của request khác
+
+async def _request_async(client: AsyncApiClient, method: str, path: str, **kwargs) -> ApiResponse:
+    """Như _request, qua một AsyncApiClient (ngân sách, trạng thái lần chạy, trace span và profiler như nhau)."""
+    budget.charge_request()
+    start = time.perf_counter()
+    run_status.count("api_calls")
+    try:
+        with tracing.span(f"API {method}", "http", path=path) as span:
+            response = await client.request(method, path, **kwargs)
+            span["status"] = response.status_code
+        if response.status_code >= 500:
+            run_status.count("errors")
+        return response
+    except requests.exceptions.RequestException:
+        run_status.count("errors")
+        raise
+    finally:
+        profiling.get_profiler().record("api", time.perf_counter() - start)
 
 def get_family_by_code(family_code: str) -> Optional[str]:
     """
     Kiểm tra xem gia đình có tồn tại không và trả về Family ID nếu có.
     """
     try:
-        response = requests.get(f"{BASE_URL}/family/by-code/{family_code}", headers=HEADERS)
+        response = _request("GET", f"/family/by-code/{family_code}")
         if response.status_code == 200:
             try:
                 result = response.json()
-                logger.debug(f"Phản hồi JSON API cho gia đình '{family_code}': {json.dumps(result, indent=2)}")
+                logger.debug("Phản hồi JSON API cho gia đình '%s': %s", family_code, LazyJson(result))
                 if result.get("id"):
                     logger.info(f"Gia đình với mã '{family_code}' đã tồn tại, ID: {result['id']}")
                     return result["id"]
@@ -60,10 +292,10 @@ def create_family_api_call(family_payload: dict) -> Optional[str]:
     logger.info(f"Đang gọi API tạo gia đình với mã: {family_code}")
 
     try:
-        response = requests.post(f"{BASE_URL}/family", headers=HEADERS, json=family_payload)
+        response = _request("POST", f"/family", json=family_payload)
         response.raise_for_status() # Ném lỗi cho các mã trạng thái HTTP xấu (4xx hoặc 5xx)
         
-        logger.debug(f"DEBUG: Checking API response for GUID. Status Code: {response.status_code}, Response Text (raw): '{response.text}', Length: {len(response.text)}")
+        logger.debug("Checking API response for GUID. Status Code: %s, Response Text (raw): '%s', Length: %d", response.status_code, response.text, len(response.text))
         
         # Strip surrounding quotes from the response text if present, as some APIs might return GUIDs as '"guid"'
         cleaned_response_text = response.text.strip('"')
@@ -77,7 +309,7 @@ def create_family_api_call(family_payload: dict) -> Optional[str]:
         try:
             # Then, try to parse as JSON
             result = response.json()
-            logger.debug(f"Phản hồi JSON API khi tạo gia đình '{family_name}': {json.dumps(result, indent=2)}")
+            logger.debug("Phản hồi JSON API khi tạo gia đình '%s': %s", family_name, LazyJson(result))
             if isinstance(result, dict) and result.get("succeeded"):
                 family_id = result.get("value")
                 logger.info(f"Tạo gia đình '{family_name}' ({family_code}) thành công với ID: {family_id}")
@@ -110,7 +342,7 @@ def update_family_api_call(family_id: str, family_payload: dict) -> bool:
     logger.info(f"Đang gọi API cập nhật gia đình '{family_name}' (ID: {family_id}, mã: {family_code})")
 
     try:
-        response = requests.put(f"{BASE_URL}/family/{family_id}", headers=HEADERS, json=family_payload)
+        response = _request("PUT", f"/family/{family_id}", json=family_payload)
         response.raise_for_status()
 
         if response.status_code == 204: # 204 No Content thường được trả về cho PUT/PATCH thành công
@@ -149,7 +381,7 @@ def fix_family_relationships_api_call(family_id: str) -> bool:
     """
     logger.info(f"Đang gọi API sửa lỗi quan hệ cho gia đình ID: {family_id}")
     try:
-        response = requests.post(f"{BASE_URL}/family/{family_id}/fix-relationships", headers=HEADERS)
+        response = _request("POST", f"/family/{family_id}/fix-relationships")
         response.raise_for_status() # Ném lỗi cho các mã trạng thái HTTP xấu (4xx hoặc 5xx)
 
         if response.status_code == 204:
@@ -175,7 +407,7 @@ def recalculate_family_stats_api_call(family_id: str) -> bool:
     """
     logger.info(f"Đang gọi API tính toán lại thống kê cho gia đình ID: {family_id}")
     try:
-        response = requests.post(f"{BASE_URL}/family/{family_id}/recalculate-stats", headers=HEADERS)
+        response = _request("POST", f"/family/{family_id}/recalculate-stats")
         response.raise_for_status() # Ném lỗi cho các mã trạng thái HTTP xấu (4xx hoặc 5xx)
 
         if response.status_code == 200: # Expected 200 OK for success
@@ -198,29 +430,38 @@ def get_member_by_code(family_id: str, member_code: str) -> Optional[str]:
     Kiểm tra xem thành viên có tồn tại không và trả về Member ID nếu có.
     """
     try:
-        response = requests.get(f"{BASE_URL}/member/by-family/{family_id}/by-code/{member_code}", headers=HEADERS)
-        if response.status_code == 200:
-            try:
-                result = response.json()
-                logger.debug(f"Phản hồi JSON API cho thành viên '{member_code}' trong gia đình '{family_id}': {json.dumps(result, indent=2)}")
-                if result.get("id"):
-                    logger.info(f"Thành viên với mã '{member_code}' trong gia đình '{family_id}' đã tồn tại, ID: {result['id']}")
-                    return result["id"]
-            except json.JSONDecodeError:
-                logger.error(f"Phản hồi API không phải JSON hợp lệ khi kiểm tra thành viên '{member_code}' trong gia đình '{family_id}': {response.text}")
-                return None
-        elif response.status_code == 404 or (response.status_code == 400 and "not found" in response.text.lower()):
-            logger.info(f"Thành viên với mã '{member_code}' trong gia đình '{family_id}' chưa tồn tại.")
-            return None
-        else:
-            logger.error(f"Lỗi khi kiểm tra thành viên '{member_code}' trong gia đình '{family_id}': {response.status_code} - {response.text}")
-            return None
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"Lỗi HTTP khi kiểm tra thành viên '{member_code}' trong gia đình '{family_id}': {http_err}. Phản hồi: {response.text}")
+        response = _request("GET", f"/member/by-family/{family_id}/by-code/{member_code}")
+    except requests.exceptions.RequestException as req_err:
+        logger.error(f"Lỗi kết nối khi gọi API kiểm tra thành viên '{member_code}' trong gia đình '{family_id}': {req_err}")
         return None
+    return _member_id_from_lookup(response, family_id, member_code)
+
+async def get_member_by_code_async(client: AsyncApiClient, family_id: str, member_code: str) -> Optional[str]:
+    """Như get_member_by_code, qua một AsyncApiClient."""
+    try:
+        response = await _request_async(client, "GET", f"/member/by-family/{family_id}/by-code/{member_code}")
     except requests.exceptions.RequestException as req_err:
         logger.error(f"Lỗi kết nối khi gọi API kiểm tra thành viên '{member_code}' trong gia đình '{family_id}': {req_err}")
         return None
+    return _member_id_from_lookup(response, family_id, member_code)
+
+def _member_id_from_lookup(response, family_id: str, member_code: str) -> Optional[str]:
+    if response.status_code == 200:
+        try:
+            result = response.json()
+            logger.debug("Phản hồi JSON API cho thành viên '%s' trong gia đình '%s': %s", member_code, family_id, LazyJson(result))
+            if result.get("id"):
+                logger.debug("Thành viên với mã '%s' trong gia đình '%s' đã tồn tại, ID: %s", member_code, family_id, result['id'])
+                return result["id"]
+        except json.JSONDecodeError:
+            logger.error(f"Phản hồi API không phải JSON hợp lệ khi kiểm tra thành viên '{member_code}' trong gia đình '{family_id}': {response.text}")
+            return None
+    elif response.status_code == 404 or (response.status_code == 400 and "not found" in response.text.lower()):
+        logger.debug("Thành viên với mã '%s' trong gia đình '%s' chưa tồn tại.", member_code, family_id)
+        return None
+    else:
+        logger.error(f"Lỗi khi kiểm tra thành viên '{member_code}' trong gia đình '{family_id}': {response.status_code} - {response.text}")
+        return None
 
 def create_member_api_call(family_id: str, member_payload: dict) -> Optional[str]:
     """
@@ -229,37 +470,53 @@ def create_member_api_call(family_id: str, member_payload: dict) -> Optional[str
     """
     member_code = member_payload.get("code")
     member_name = f"{member_payload.get('firstName')} {member_payload.get('lastName')}"
-    logger.info(f"Đang gọi API tạo thành viên '{member_name}' với mã: {member_code} cho gia đình ID: {family_id}")
+    logger.debug("Đang gọi API tạo thành viên '%s' với mã: %s cho gia đình ID: %s", member_name, member_code, family_id)
 
     try:
-        response = requests.post(f"{BASE_URL}/member", headers=HEADERS, json=member_payload)
+        response = _request("POST", f"/member", json=member_payload)
         response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Lỗi khi gọi API tạo thành viên '{member_name}' ({member_code}): {e}")
+        return None
+    return _member_id_from_create(response, member_name, member_code)
 
-        # Check for direct GUID string for 201 Created responses
-        if response.status_code == 201:
-            cleaned_response_text = response.text.strip('"')
-            if len(cleaned_response_text) == 36 and all(c in "0123456789abcdef-" for c in cleaned_response_text.lower()):
-                member_id = cleaned_response_text
-                logger.info(f"Tạo thành viên '{member_name}' ({member_code}) thành công với ID: {member_id} (từ GUID trực tiếp).")
-                return member_id
-        
-        # If not a direct GUID, try to parse as JSON or handle other 2xx responses
-        try:
-            result = response.json()
-            logger.debug(f"Phản hồi JSON API khi tạo thành viên '{member_name}': {json.dumps(result, indent=2)}")
-            if result.get("succeeded"):
-                member_id = result.get("value")
-                logger.info(f"Tạo thành viên '{member_name}' ({member_code}) thành công với ID: {member_id}")
-                return member_id
-            else:
-                logger.error(f"Tạo thành viên '{member_name}' ({member_code}) thất bại: {result.get('errors')}. Phản hồi thô: {response.text}")
-        except json.JSONDecodeError as json_err:
-            logger.error(f"Lỗi khi xử lý phản hồi API tạo thành viên '{member_name}' ({member_code}): {json_err}. Phản hồi thô: {response.text}")
-        except Exception as e:
-            logger.error(f"Lỗi không xác định khi xử lý phản hồi API tạo thành viên '{member_name}' ({member_code}): {e}. Phản hồi thô: {response.text}")
+async def create_member_api_call_async(client: AsyncApiClient, family_id: str, member_payload: dict) -> Optional[str]:
+    """Như create_member_api_call, qua một AsyncApiClient (POST: không bao giờ được thử lại)."""
+    member_code = member_payload.get("code")
+    member_name = f"{member_payload.get('firstName')} {member_payload.get('lastName')}"
+    logger.debug("Đang gọi API tạo thành viên '%s' với mã: %s cho gia đình ID: %s", member_name, member_code, family_id)
+
+    try:
+        response = await _request_async(client, "POST", f"/member", json=member_payload)
+        response.raise_for_status()
     except requests.exceptions.RequestException as e:
         logger.error(f"Lỗi khi gọi API tạo thành viên '{member_name}' ({member_code}): {e}")
-    
+        return None
+    return _member_id_from_create(response, member_name, member_code)
+
+def _member_id_from_create(response, member_name: str, member_code: str) -> Optional[str]:
+    # Check for direct GUID string for 201 Created responses
+    if response.status_code == 201:
+        cleaned_response_text = response.text.strip('"')
+        if len(cleaned_response_text) == 36 and all(c in "0123456789abcdef-" for c in cleaned_response_text.lower()):
+            member_id = cleaned_response_text
+            logger.debug("Tạo thành viên '%s' (%s) thành công với ID: %s (từ GUID trực tiếp).", member_name, member_code, member_id)
+            return member_id
+
+    # If not a direct GUID, try to parse as JSON or handle other 2xx responses
+    try:
+        result = response.json()
+        logger.debug("Phản hồi JSON API khi tạo thành viên '%s': %s", member_name, LazyJson(result))
+        if result.get("succeeded"):
+            member_id = result.get("value")
+            logger.debug("Tạo thành viên '%s' (%s) thành công với ID: %s", member_name, member_code, member_id)
+            return member_id
+        else:
+            logger.error(f"Tạo thành viên '{member_name}' ({member_code}) thất bại: {result.get('errors')}. Phản hồi thô: {response.text}")
+    except json.JSONDecodeError as json_err:
+        logger.error(f"Lỗi khi xử lý phản hồi API tạo thành viên '{member_name}' ({member_code}): {json_err}. Phản hồi thô: {response.text}")
+    except Exception as e:
+        logger.error(f"Lỗi không xác định khi xử lý phản hồi API tạo thành viên '{member_name}' ({member_code}): {e}. Phản hồi thô: {response.text}")
     return None
 
 def get_members_by_family_id(family_id: str) -> Optional[list]:
@@ -268,7 +525,7 @@ def get_members_by_family_id(family_id: str) -> Optional[list]:
     Trả về một list các dict thành viên nếu thành công, ngược lại trả về None.
     """
     try:
-        response = requests.get(f"{BASE_URL}/member/by-family/{family_id}", headers=HEADERS)
+        response = _request("GET", f"/member/by-family/{family_id}")
         if response.status_code == 200:
             try:
                 members = response.json()
@@ -295,18 +552,18 @@ def update_member_relationships(member_id: str, family_id: str, update_payload:
             "familyId": family_id,
             **update_payload
         }
-        logger.debug(f"Đang gửi request_body cập nhật mối quan hệ cho thành viên '{member_id}': {json.dumps(request_body, indent=2)}")
-        response = requests.put(f"{BASE_URL}/member/{member_id}/relationships", headers=HEADERS, json=request_body)
+        logger.debug("Đang gửi request_body cập nhật mối quan hệ cho thành viên '%s': %s", member_id, LazyJson(request_body))
+        response = _request("PUT", f"/member/{member_id}/relationships", json=request_body)
         response.raise_for_status()
 
         if response.status_code == 204:
-            logger.info(f"Cập nhật mối quan hệ cho thành viên '{member_id}' thành công (204 No Content).")
+            logger.debug("Cập nhật mối quan hệ cho thành viên '%s' thành công (204 No Content).", member_id)
             return True
         else:
             try:
                 result = response.json()
                 if result.get("succeeded"):
-                    logger.info(f"Cập nhật mối quan hệ cho thành viên '{member_id}' thành công.")
+                    logger.debug("Cập nhật mối quan hệ cho thành viên '%s' thành công.", member_id)
                     return True
                 else:
                     logger.error(f"Cập nhật mối quan hệ cho thành viên '{member_id}' thất bại: {result.get('errors')}. Phản hồi thô: {response.text}")
@@ -1,31 +1,247 @@
 import os
+import sys
+import asyncio
 import logging
 from typing import Optional
-import dotenv
 import argparse
 
 from vietnamgiapha.api_integration import api_services
 from vietnamgiapha import data_loader
+from vietnamgiapha.utils import profiling
+from vietnamgiapha.utils import tracing
+from vietnamgiapha.utils import log_setup
 
-# Load environment variables
-dotenv.load_dotenv()
+# File .env được api_services nạp ở request API đầu tiên.
 
-# Cấu hình logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging được cấu hình ở điểm vào (log_setup.setup_logging); chi tiết từng thành viên ở mức DEBUG.
 logger = logging.getLogger(__name__)
 
 OUTPUT_DIR = "output"
 INVALID_FAMILY_NAMES = ["TỘC -", "GIA PHẢ TỘC -"]
+# Số request tạo thành viên chạy cùng lúc (0: tuần tự, từng request một); --concurrency ghi đè.
+MEMBER_CONCURRENCY_ENV = "API_MEMBER_CONCURRENCY"
 
-def main(target_folder: Optional[str] = None, member_limit: int = 0):
-    logger.info("Bắt đầu quá trình tạo gia đình và thành viên.")
-    
-    gender_map = {
-        "Nam": "Male",
-        "Nữ": "Female",
+GENDER_MAP = {
+    "Nam": "Male",
+    "Nữ": "Female",
+}
+
+def _clean_name(value):
+    return None if value == ".." else value
+
+def _spouse_payload(spouse_data: dict, family_id: str) -> Optional[dict]:
+    """Payload tạo vợ/chồng, hoặc None nếu thiếu họ hoặc tên (khi đó chỉ tìm trong API chứ không tạo)."""
+    s_fn = _clean_name(spouse_data.get("firstName"))
+    s_ln = _clean_name(spouse_data.get("lastName"))
+    if not s_fn or not s_ln:
+        return None
+    return {
+        "lastName": s_ln,
+        "firstName": s_fn,
+        "code": spouse_data.get("code"),
+        "gender": GENDER_MAP.get(spouse_data.get("gender"), "Other"),
+        "familyId": family_id,
+        "isRoot": False
     }
 
+def _member_payload(member_data: dict, family_id: str) -> Optional[dict]:
+    """Payload tạo thành viên chính, hoặc None nếu thiếu mã, họ hoặc tên."""
+    member_code = member_data.get("code")
+    first_name = _clean_name(member_data.get("firstName"))
+    last_name = _clean_name(member_data.get("lastName"))
+    if not member_code or not first_name or not last_name:
+        return None
+    return {
+        "lastName": last_name,
+        "firstName": first_name,
+        "code": member_code,
+        "nickname": member_data.get("nickname"),
+        "gender": GENDER_MAP.get(member_data.get("gender"), "Other"),
+        "familyId": family_id,
+        "isRoot": member_code.endswith("-1"),
+        "isDeceased": member_data.get("isDeceased", False),
+        "biography": member_data.get("biography"),
+        "fatherId": None, "motherId": None, "husbandId": None, "wifeId": None # Lượt 1 để None
+    }
+
+def _create_members_sequentially(family_id: str, family_code: str, members_folder_path: str, member_files: list,
+                                 member_limit: int, member_code_to_id_map: dict):
+    """Tạo vợ/chồng rồi thành viên chính, từng request một, theo thứ tự tên file. Trả về số thành viên tạo thất bại."""
+    member_count = 0
+    failed_count = 0
+    progress = log_setup.ProgressLog(logger, f"Gia đình '{family_code}': tạo thành viên",
+                                     total=min(len(member_files), member_limit) if member_limit > 0 else len(member_files))
+    for member_json_filename in sorted(os.listdir(members_folder_path)):
+        if not member_json_filename.endswith(".json"):
+            continue
+
+        if member_limit > 0 and member_count >= member_limit:
+            break
+        
+        member_json_file_path = os.path.join(members_folder_path, member_json_filename)
+        member_data = data_loader.load_member_data(member_json_file_path)
+        
+        if not member_data:
+            progress.add("invalid")
+            continue
+
+        member_payload = _member_payload(member_data, family_id)
+        if member_payload is None:
+            progress.add("invalid")
+            progress.warning("Thành viên %s thiếu thông tin bắt buộc. Bỏ qua.", member_json_filename)
+            continue
+        member_code = member_payload["code"]
+
+        # --- 1. Xử lý Vợ/Chồng trước ---
+        spouses_data = member_data.get("spouses", [])
+        for spouse_data in spouses_data:
+            s_code = spouse_data.get("code")
+            if not s_code: continue
+
+            if s_code not in member_code_to_id_map:
+                # Kiểm tra API nếu map cục bộ chưa có
+                existing_s_id = api_services.get_member_by_code(family_id, s_code)
+                if existing_s_id:
+                    member_code_to_id_map[s_code] = existing_s_id
+                else:
+                    # Tạo vợ/chồng mới
+                    s_payload = _spouse_payload(spouse_data, family_id)
+                    if s_payload:
+                        new_s_id = api_services.create_member_api_call(family_id, s_payload)
+                        if new_s_id:
+                            member_code_to_id_map[s_code] = new_s_id
+                        else:
+                            failed_count += 1
+
+        # --- 2. Xử lý thành viên chính ---
+        if member_code in member_code_to_id_map:
+            logger.debug("Thành viên '%s' đã tồn tại.", member_code)
+            progress.add("existing")
+            member_count += 1
+            continue
+
+        existing_id = api_services.get_member_by_code(family_id, member_code)
+        if existing_id:
+            member_code_to_id_map[member_code] = existing_id
+            progress.add("existing")
+            member_count += 1
+            continue
+
+        created_id = api_services.create_member_api_call(family_id, member_payload)
+        if created_id:
+            member_code_to_id_map[member_code] = created_id
+            progress.add("created")
+            member_count += 1
+        else:
+            progress.add("failed")
+            failed_count += 1
+    progress.finish()
+    return failed_count
+
+async def _create_members_concurrently(family_id: str, family_code: str, members_folder_path: str, member_files: list,
+                                       member_limit: int, member_code_to_id_map: dict, concurrency: int):
+    """
+    Chế độ song song: thành viên chính và vợ/chồng của họ được tạo đồng thời, tối đa `concurrency` request cùng lúc.
+    Mỗi mã chỉ có một task "tìm hoặc tạo" (các thành viên cùng tham chiếu một vợ/chồng chờ chung task đó), nên mỗi mã
+    được tạo nhiều nhất một lần và chỉ được ghi vào member_code_to_id_map một lần. Khi một vợ/chồng cũng là thành viên
+    chính của gia đình, payload đầy đủ của thành viên chính được dùng, bất kể file nào được xử lý trước.
+    Với --member_limit, `member_limit` thành viên hợp lệ đầu tiên (theo tên file) được xử lý.
+    Trả về số mã (thành viên chính hoặc vợ/chồng) tạo thất bại.
+    """
+    progress = log_setup.ProgressLog(logger, f"Gia đình '{family_code}': tạo thành viên (song song {concurrency})",
+                                     total=min(len(member_files), member_limit) if member_limit > 0 else len(member_files))
+    # Đọc trước mọi file: cần biết thành viên chính nào có mặt trước khi tạo vợ/chồng.
+    members = [] # (mã, payload, danh sách vợ/chồng)
+    main_payloads = {}
+    for member_json_filename in sorted(os.listdir(members_folder_path)):
+        if not member_json_filename.endswith(".json"):
+            continue
+        if member_limit > 0 and len(members) >= member_limit:
+            break
+        member_data = data_loader.load_member_data(os.path.join(members_folder_path, member_json_filename))
+        if not member_data:
+            progress.add("invalid")
+            continue
+        member_payload = _member_payload(member_data, family_id)
+        if member_payload is None:
+            progress.add("invalid")
+            progress.warning("Thành viên %s thiếu thông tin bắt buộc. Bỏ qua.", member_json_filename)
+            continue
+        members.append((member_payload["code"], member_payload, member_data.get("spouses", [])))
+        main_payloads.setdefault(member_payload["code"], member_payload)
+
+    pending = {} # mã -> task tìm hoặc tạo thành viên đó
+    async with api_services.AsyncApiClient.from_env(concurrency) as client:
+
+        async def find_or_create(code: str, payload: Optional[dict]) -> str:
+            member_id = await api_services.get_member_by_code_async(client, family_id, code)
+            if member_id:
+                outcome = "existing"
+            elif payload is None:
+                return "missing"
+            else:
+                member_id = await api_services.create_member_api_call_async(client, family_id, payload)
+                outcome = "created" if member_id else "failed"
+            if member_id:
+                member_code_to_id_map[code] = member_id
+            return outcome
+
+        def ensure(code: str, payload: Optional[dict]):
+            # Không có await giữa kiểm tra và ghi `pending`: hai thành viên không thể cùng tạo một mã.
+            task = pending.get(code)
+            if task is None:
+                task = pending[code] = asyncio.ensure_future(find_or_create(code, payload))
+            return task
+
+        async def process(member_code: str, member_payload: dict, spouses: list, first: bool):
+            spouse_tasks = []
+            for spouse_data in spouses:
+                s_code = spouse_data.get("code")
+                if s_code and s_code not in member_code_to_id_map:
+                    spouse_tasks.append(ensure(s_code, main_payloads.get(s_code) or _spouse_payload(spouse_data, family_id)))
+            if not first or (member_code in member_code_to_id_map and member_code not in pending):
+                outcome = "existing" # File trùng mã, hoặc đã có từ thư mục trước
+            else:
+                outcome = await ensure(member_code, member_payload)
+            await asyncio.gather(*spouse_tasks)
+            progress.add(outcome)
+
+        seen = set()
+        work = []
+        for member_code, member_payload, spouses in members:
+            work.append((member_code, member_payload, spouses, member_code not in seen))
+            seen.add(member_code)
+        work = iter(work)
+
+        async def worker():
+            # `concurrency` worker lấy lần lượt từ cùng một iterator: chỉ ngần ấy thành viên được xử lý cùng lúc.
+            for item in work:
+                await process(*item)
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Ví dụ vượt ngân sách: dừng các request còn lại trước khi đóng phiên.
+            for task in tasks + list(pending.values()):
+                task.cancel()
+            await asyncio.gather(*tasks, *pending.values(), return_exceptions=True)
+            raise
+    progress.finish()
+    return sum(1 for task in pending.values() if task.result() == "failed")
+
+def main(target_folder: Optional[str] = None, member_limit: int = 0, concurrency: Optional[int] = None):
+    """
+    Tạo (hoặc cập nhật) gia đình và tạo thành viên cho `target_folder` (hoặc mọi thư mục trong output/).
+    `concurrency` > 0 tạo thành viên song song (asyncio, tối đa `concurrency` request cùng lúc); None lấy từ
+    API_MEMBER_CONCURRENCY (mặc định 0: tuần tự như trước). Trả về False nếu một gia đình không tạo hoặc cập nhật
+    được, hoặc có request tạo thành viên, sửa quan hệ, tính lại thống kê thất bại (ví dụ API không truy cập được),
+    để pipeline không ghi nhận bước nhập liệu là thành công.
+    """
+    logger.info("Bắt đầu quá trình tạo gia đình và thành viên.")
+
     member_code_to_id_map = {}
+    failed_folders = []
 
     folders_to_process = []
     if target_folder:
@@ -36,7 +252,7 @@ def main(target_folder: Optional[str] = None, member_limit: int = 0):
             folders_to_process = [entry for entry in entries if os.path.isdir(os.path.join(OUTPUT_DIR, entry))]
         except FileNotFoundError:
             logger.error(f"Thư mục đầu ra '{OUTPUT_DIR}' không tồn tại.")
-            return
+            return False
 
     for folder_name in folders_to_process:
         folder_path = os.path.join(OUTPUT_DIR, folder_name)
@@ -87,12 +303,14 @@ def main(target_folder: Optional[str] = None, member_limit: int = 0):
             family_payload["id"] = family_id # Add the ID to the payload for update
             if not api_services.update_family_api_call(family_id, family_payload):
                 logger.error(f"Không thể cập nhật thông tin cho gia đình '{family_code}'. Bỏ qua.")
+                failed_folders.append(folder_name)
                 continue
         else:
             family_id = api_services.create_family_api_call(family_payload)
         
         if not family_id:
             logger.error(f"Không thể tạo hoặc cập nhật gia đình '{family_code}'. Bỏ qua.")
+            failed_folders.append(folder_name)
             continue
 
         # --- Xử lý thành viên ---
@@ -101,92 +319,17 @@ def main(target_folder: Optional[str] = None, member_limit: int = 0):
             logger.warning(f"Thư mục 'members' không tồn tại trong {folder_path}")
             continue
 
-        member_count = 0
-        for member_json_filename in sorted(os.listdir(members_folder_path)):
-            if not member_json_filename.endswith(".json"):
-                continue
-
-            if member_limit > 0 and member_count >= member_limit:
-                break
-            
-            member_json_file_path = os.path.join(members_folder_path, member_json_filename)
-            member_data = data_loader.load_member_data(member_json_file_path)
-            
-            if not member_data: continue
-
-            member_code = member_data.get("code")
-            first_name = member_data.get("firstName")
-            last_name = member_data.get("lastName")
-
-            # Làm sạch dữ liệu tên
-            if first_name == "..": first_name = None
-            if last_name == "..": last_name = None
-
-            if not member_code or not first_name or not last_name:
-                logger.error(f"Thành viên {member_json_filename} thiếu thông tin bắt buộc. Bỏ qua.")
-                continue
-
-            # --- 1. Xử lý Vợ/Chồng trước ---
-            spouses_data = member_data.get("spouses", [])
-            for spouse_data in spouses_data:
-                s_code = spouse_data.get("code")
-                if not s_code: continue
-
-                if s_code not in member_code_to_id_map:
-                    # Kiểm tra API nếu map cục bộ chưa có
-                    existing_s_id = api_services.get_member_by_code(family_id, s_code)
-                    if existing_s_id:
-                        member_code_to_id_map[s_code] = existing_s_id
-                    else:
-                        # Tạo vợ/chồng mới
-                        s_fn = spouse_data.get("firstName")
-                        s_ln = spouse_data.get("lastName")
-                        if s_fn == "..": s_fn = None
-                        if s_ln == "..": s_ln = None
-                        
-                        if s_fn and s_ln:
-                            s_payload = {
-                                "lastName": s_ln,
-                                "firstName": s_fn,
-                                "code": s_code,
-                                "gender": gender_map.get(spouse_data.get("gender"), "Other"),
-                                "familyId": family_id,
-                                "isRoot": False
-                            }
-                            new_s_id = api_services.create_member_api_call(family_id, s_payload)
-                            if new_s_id:
-                                member_code_to_id_map[s_code] = new_s_id
-
-            # --- 2. Xử lý thành viên chính ---
-            if member_code in member_code_to_id_map:
-                logger.info(f"Thành viên '{member_code}' đã tồn tại.")
-                member_count += 1
-                continue
-
-            existing_id = api_services.get_member_by_code(family_id, member_code)
-            if existing_id:
-                member_code_to_id_map[member_code] = existing_id
-                member_count += 1
-                continue
-
-            # Tạo Payload thành viên chính
-            member_payload = {
-                "lastName": last_name,
-                "firstName": first_name,
-                "code": member_code,
-                "nickname": member_data.get("nickname"),
-                "gender": gender_map.get(member_data.get("gender"), "Other"),
-                "familyId": family_id,
-                "isRoot": member_code.endswith("-1"),
-                "isDeceased": member_data.get("isDeceased", False),
-                "biography": member_data.get("biography"),
-                "fatherId": None, "motherId": None, "husbandId": None, "wifeId": None # Lượt 1 để None
-            }
-
-            created_id = api_services.create_member_api_call(family_id, member_payload)
-            if created_id:
-                member_code_to_id_map[member_code] = created_id
-                member_count += 1
+        if concurrency is None:
+            concurrency = int(os.getenv(MEMBER_CONCURRENCY_ENV) or 0) # .env đã được nạp ở request đầu tiên
+        if concurrency > 0:
+            failed_count = asyncio.run(_create_members_concurrently(family_id, family_code, members_folder_path, member_files,
+                                                     member_limit, member_code_to_id_map, concurrency))
+        else:
+            failed_count = _create_members_sequentially(family_id, family_code, members_folder_path, member_files,
+                                                        member_limit, member_code_to_id_map)
+        folder_ok = failed_count == 0
+        if failed_count:
+            logger.error(f"Không tạo được {failed_count} thành viên cho gia đình '{family_code}'.")
         
         # Sau khi xử lý tất cả thành viên, gọi API sửa lỗi quan hệ và tính toán lại thống kê
         logger.info(f"Hoàn tất xử lý thành viên cho gia đình '{family_code}'. Đang gọi API sửa lỗi quan hệ và tính toán lại thống kê.")
@@ -195,17 +338,31 @@ def main(target_folder: Optional[str] = None, member_limit: int = 0):
             logger.info(f"API sửa lỗi quan hệ cho gia đình '{family_code}' đã gọi thành công.")
         else:
             logger.error(f"API sửa lỗi quan hệ cho gia đình '{family_code}' thất bại.")
+            folder_ok = False
 
         if api_services.recalculate_family_stats_api_call(family_id):
             logger.info(f"API tính toán lại thống kê cho gia đình '{family_code}' đã gọi thành công.")
         else:
             logger.error(f"API tính toán lại thống kê cho gia đình '{family_code}' thất bại.")
+            folder_ok = False
+        if not folder_ok:
+            failed_folders.append(folder_name)
 
+    if failed_folders:
+        logger.error(f"Tạo gia đình/thành viên thất bại cho {len(failed_folders)} thư mục: {', '.join(failed_folders)}")
+        return False
     logger.info("Hoàn tất quá trình.")
+    return True
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--folder", type=str)
     parser.add_argument("--member_limit", type=int, default=0)
+    parser.add_argument("--concurrency", type=int,
+                        help=f"Số request tạo thành viên cùng lúc (mặc định: {MEMBER_CONCURRENCY_ENV} hoặc 0 = tuần tự).")
     args = parser.parse_args()
-    main(target_folder=args.folder, member_limit=args.member_limit)
\ No newline at end of file
+    log_setup.setup_logging()
+    profiling.configure_from_env()
+    tracing.configure_from_env()
+    if not main(target_folder=args.folder, member_limit=args.member_limit, concurrency=args.concurrency):
+        sys.exit(1) # Để --isolation subprocess cũng thấy bước thất bại
\ No newline at end of file
@@ -1,17 +1,18 @@
 import os
+import sys
 import json
 import logging
 from typing import Optional
-import dotenv
 
 from vietnamgiapha.api_integration import api_services
 from vietnamgiapha import data_loader
+from vietnamgiapha.utils import profiling
+from vietnamgiapha.utils import tracing
+from vietnamgiapha.utils import log_setup
 
-# Load environment variables from .env file
-dotenv.load_dotenv()
+# File .env được api_services nạp ở request API đầu tiên.
 
-# Cấu hình logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Logging được cấu hình ở điểm vào (log_setup.setup_logging); chi tiết từng thành viên ở mức DEBUG.
 logger = logging.getLogger(__name__)
 
 OUTPUT_DIR = "output"
@@ -19,8 +20,13 @@ OUTPUT_DIR = "output"
 
 
 
-def main(target_folder: Optional[str] = None):
+def main(target_folder: Optional[str] = None, limit: int = 0):
+    """
+    Cập nhật mối quan hệ; với `limit` > 0 chỉ `limit` thành viên đầu tiên (theo tên file) của mỗi gia đình được xử lý.
+    Trả về False nếu không lấy được gia đình hoặc danh sách thành viên từ API, hoặc có cập nhật mối quan hệ thất bại.
+    """
     logger.info("Bắt đầu quá trình cập nhật mối quan hệ thành viên.")
+    failed_folders = []
     
     folders_to_process = []
     if target_folder:
@@ -31,7 +37,7 @@ def main(target_folder: Optional[str] = None):
             folders_to_process = [entry for entry in entries if os.path.isdir(os.path.join(OUTPUT_DIR, entry))]
         except FileNotFoundError:
             logger.error(f"Thư mục đầu ra '{OUTPUT_DIR}' không tồn tại.")
-            return
+            return False
 
     for folder_name in folders_to_process:
         folder_path = os.path.join(OUTPUT_DIR, folder_name)
@@ -42,13 +48,19 @@ def main(target_folder: Optional[str] = None):
             current_family_api_id = api_services.get_family_by_code(family_code)
             if not current_family_api_id:
                 logger.error(f"Không thể lấy Family ID cho thư mục '{folder_name}'. Bỏ qua cập nhật mối quan hệ.")
+                failed_folders.append(folder_name)
                 continue
 
             pending_reverse_updates = [] # Initialize the list to store reverse relationship updates
+            folder_failed = False # Có cập nhật mối quan hệ (xuôi hoặc ngược) thất bại
 
 
             # Fetch all existing members for this family from the API
             all_fetched_members = api_services.get_members_by_family_id(current_family_api_id)
+            if all_fetched_members is None:
+                logger.error(f"Không thể lấy danh sách thành viên của gia đình ID '{current_family_api_id}'. Bỏ qua cập nhật mối quan hệ.")
+                failed_folders.append(folder_name)
+                continue
             if not all_fetched_members:
                 logger.warning(f"Không tìm thấy thành viên nào cho gia đình ID '{current_family_api_id}'. Bỏ qua cập nhật mối quan hệ.")
                 continue
@@ -75,23 +87,30 @@ def main(target_folder: Optional[str] = None):
 
             if os.path.isdir(members_source_path):
                 logger.info(f"Bắt đầu cập nhật mối quan hệ cho các thành viên trong thư mục {folder_name}.")
-                for member_json_filename in sorted(os.listdir(members_source_path)):
+                member_json_filenames = sorted(name for name in os.listdir(members_source_path) if name.endswith(".json"))
+                if limit > 0:
+                    member_json_filenames = member_json_filenames[:limit]
+                progress = log_setup.ProgressLog(logger, f"Gia đình '{family_code}': cập nhật mối quan hệ", total=len(member_json_filenames))
+                for member_json_filename in member_json_filenames:
                     if member_json_filename.endswith(".json"):
                         member_json_file_path = os.path.join(members_source_path, member_json_filename)
                         
                         original_member_data = data_loader.load_member_data(member_json_file_path)
                         if not original_member_data:
-                            logger.error(f"Không thể tải member.json từ '{member_json_file_path}'. Bỏ qua thành viên này.")
+                            progress.add("invalid")
+                            progress.warning("Không thể tải member.json từ '%s'. Bỏ qua thành viên này.", member_json_file_path)
                             continue
 
                         member_code = original_member_data.get("code")
                         if not member_code:
-                            logger.error(f"Thành viên từ file '{member_json_filename}' thiếu 'code'. Bỏ qua.")
+                            progress.add("invalid")
+                            progress.warning("Thành viên từ file '%s' thiếu 'code'. Bỏ qua.", member_json_filename)
                             continue
 
                         member_api_id = get_member_id_by_code(member_code)
                         if not member_api_id:
-                            logger.warning(f"Không tìm thấy thành viên với mã '{member_code}' trong API. Bỏ qua cập nhật mối quan hệ.")
+                            progress.add("not found")
+                            progress.warning("Không tìm thấy thành viên với mã '%s' trong API. Bỏ qua cập nhật mối quan hệ.", member_code)
                             continue
                         
                         is_root_member = original_member_data.get("isRoot", False)
@@ -107,13 +126,13 @@ def main(target_folder: Optional[str] = None):
                             father_api_id = get_member_id_by_code(father_code)
                             if father_api_id:
                                 if father_api_id == member_api_id:
-                                    logger.warning(f"Cha của thành viên '{member_code}' có ID trùng với chính thành viên đó. Đặt fatherId là None.")
+                                    progress.warning("Cha của thành viên '%s' có ID trùng với chính thành viên đó. Đặt fatherId là None.", member_code)
                                     update_payload["fatherId"] = None
                                 else:
                                     update_payload["fatherId"] = father_api_id
                                     processed_member_data["fatherId"] = father_api_id # Store in processed data
                             else:
-                                logger.warning(f"Không tìm thấy API ID cho cha có mã '{father_code}' của thành viên '{member_code}'.")
+                                progress.warning("Không tìm thấy API ID cho cha có mã '%s' của thành viên '%s'.", father_code, member_code)
                         
                         # Resolve motherId
                         mother_code = (original_member_data.get("mother") or {}).get("code")
@@ -134,19 +153,19 @@ def main(target_folder: Optional[str] = None):
                             
                             if inferred_mother_api_id and inferred_mother_gender == "Female":
                                 mother_code = inferred_mother_code
-                                logger.info(f"Đã suy luận mẹ chính '{inferred_mother_code}' cho thành viên '{member_code}' dựa trên vợ của cha '{father_code}'.")
+                                logger.debug("Đã suy luận mẹ chính '%s' cho thành viên '%s' dựa trên vợ của cha '%s'.", inferred_mother_code, member_code, father_code)
 
                         if mother_code and mother_code.strip() != "" and mother_code != "null":
                             mother_api_id = get_member_id_by_code(mother_code)
                             if mother_api_id:
                                 if mother_api_id == member_api_id:
-                                    logger.warning(f"Mẹ của thành viên '{member_code}' có ID trùng với chính thành viên đó. Đặt motherId là None.")
+                                    progress.warning("Mẹ của thành viên '%s' có ID trùng với chính thành viên đó. Đặt motherId là None.", member_code)
                                     update_payload["motherId"] = None
                                 else:
                                     update_payload["motherId"] = mother_api_id
                                     processed_member_data["motherId"] = mother_api_id # Store in processed data
                             else:
-                                logger.warning(f"Không tìm thấy API ID cho mẹ có mã '{mother_code}' của thành viên '{member_code}'.")
+                                progress.warning("Không tìm thấy API ID cho mẹ có mã '%s' của thành viên '%s'.", mother_code, member_code)
 
                         # Resolve husbandId / wifeId (spouses)
                         # The original data might have 'spouse' (single) or 'spouses' (list)
@@ -170,7 +189,7 @@ def main(target_folder: Optional[str] = None):
                             
                             if inferred_spouse_member_api_id and inferred_spouse_gender == "Female":
                                 spouses_to_resolve.append({"code": inferred_spouse_code, "id": inferred_spouse_member_api_id, "gender": inferred_spouse_gender})
-                                logger.info(f"Đã suy luận vợ chính '{inferred_spouse_code}' cho thành viên '{member_code}' dựa trên quy ước đặt tên.")
+                                logger.debug("Đã suy luận vợ chính '%s' cho thành viên '%s' dựa trên quy ước đặt tên.", inferred_spouse_code, member_code)
                         
                         if original_member_data.get("spouse"):
                             spouses_to_resolve.append(original_member_data.get("spouse"))
@@ -195,9 +214,9 @@ def main(target_folder: Optional[str] = None):
                                         elif processed_member_gender == "Female" and not resolved_husband_api_id:
                                             resolved_husband_api_id = current_spouse_api_id
                                         else:
-                                            logger.warning(f"Thành viên '{member_code}' có nhiều vợ/chồng được định nghĩa. Chỉ vợ/chồng đầu tiên ('{spouse_code}' được tìm thấy) được gán làm vợ/chồng chính.")
+                                            progress.warning("Thành viên '%s' có nhiều vợ/chồng được định nghĩa. Chỉ vợ/chồng đầu tiên ('%s' được tìm thấy) được gán làm vợ/chồng chính.", member_code, spouse_code)
                                     else:
-                                        logger.warning(f"Không tìm thấy API ID cho vợ/chồng có mã '{spouse_code}' của thành viên '{member_code}'.")
+                                        progress.warning("Không tìm thấy API ID cho vợ/chồng có mã '%s' của thành viên '%s'.", spouse_code, member_code)
 
 
                         
@@ -206,7 +225,7 @@ def main(target_folder: Optional[str] = None):
                         # Apply resolved IDs to update_payload
                         if resolved_wife_api_id:
                             if resolved_wife_api_id == member_api_id:
-                                logger.warning(f"Vợ của thành viên '{member_code}' có ID trùng với chính thành viên đó. Đặt wifeId là None.")
+                                progress.warning("Vợ của thành viên '%s' có ID trùng với chính thành viên đó. Đặt wifeId là None.", member_code)
                                 update_payload["wifeId"] = None
                             else:
                                 update_payload["wifeId"] = resolved_wife_api_id
@@ -220,7 +239,7 @@ def main(target_folder: Optional[str] = None):
                         
                         if resolved_husband_api_id:
                             if resolved_husband_api_id == member_api_id:
-                                logger.warning(f"Chồng của thành viên '{member_code}' có ID trùng với chính thành viên đó. Đặt husbandId là None.")
+                                progress.warning("Chồng của thành viên '%s' có ID trùng với chính thành viên đó. Đặt husbandId là None.", member_code)
                                 update_payload["husbandId"] = None
                             else:
                                 update_payload["husbandId"] = resolved_husband_api_id
@@ -234,45 +253,67 @@ def main(target_folder: Optional[str] = None):
                         
                         if update_payload:
                             if api_services.update_member_relationships(member_api_id, current_family_api_id, update_payload):
-                                logger.info(f"Cập nhật mối quan hệ cho thành viên '{member_code}' thành công.")
+                                logger.debug("Cập nhật mối quan hệ cho thành viên '%s' thành công.", member_code)
+                                progress.add("updated")
                             else:
                                 logger.error(f"Cập nhật mối quan hệ cho thành viên '{member_code}' thất bại.")
+                                progress.add("failed")
+                                folder_failed = True
                         else:
-                            logger.info(f"Không có mối quan hệ nào để cập nhật cho thành viên '{member_code}'.")
+                            logger.debug("Không có mối quan hệ nào để cập nhật cho thành viên '%s'.", member_code)
+                            progress.add("unchanged")
                         
                         # Save processed member data to members_processed folder
                         processed_member_output_path = os.path.join(members_processed_output_path, member_json_filename)
                         try:
                             with open(processed_member_output_path, 'w', encoding='utf-8') as f:
                                 json.dump(processed_member_data, f, ensure_ascii=False, indent=2)
-                            logger.info(f"Đã lưu dữ liệu thành viên đã xử lý cho '{member_code}' vào '{processed_member_output_path}'.")
+                            logger.debug("Đã lưu dữ liệu thành viên đã xử lý cho '%s' vào '%s'.", member_code, processed_member_output_path)
                         except Exception as e:
                             logger.error(f"Lỗi khi lưu dữ liệu thành viên đã xử lý cho '{member_code}': {e}")
+                progress.finish()
             else:
                 logger.warning(f"Thư mục 'members' không tồn tại trong {data_folder_path}. Bỏ qua xử lý các file thành viên.")
 
             # Process pending reverse relationship updates
             if pending_reverse_updates:
                 logger.info(f"Đang xử lý {len(pending_reverse_updates)} cập nhật mối quan hệ ngược lại cho thư mục {folder_name}.")
+                reverse_progress = log_setup.ProgressLog(logger, f"Gia đình '{family_code}': cập nhật mối quan hệ ngược lại",
+                                                         total=len(pending_reverse_updates))
                 for reverse_update_data in pending_reverse_updates:
                     member_api_id_to_update = reverse_update_data["member_api_id"]
                     family_api_id_for_update = reverse_update_data["family_api_id"]
                     update_payload_for_reverse = reverse_update_data["update_payload"]
 
                     if api_services.update_member_relationships(member_api_id_to_update, family_api_id_for_update, update_payload_for_reverse):
-                        logger.info(f"Cập nhật mối quan hệ ngược lại cho thành viên '{member_api_id_to_update}' thành công với payload: {update_payload_for_reverse}.")
+                        logger.debug("Cập nhật mối quan hệ ngược lại cho thành viên '%s' thành công với payload: %s.", member_api_id_to_update, update_payload_for_reverse)
+                        reverse_progress.add("updated")
                     else:
                         logger.error(f"Cập nhật mối quan hệ ngược lại cho thành viên '{member_api_id_to_update}' thất bại với payload: {update_payload_for_reverse}.")
+                        reverse_progress.add("failed")
+                        folder_failed = True
+                reverse_progress.finish()
             else:
                 logger.info(f"Không có cập nhật mối quan hệ ngược lại nào để xử lý cho thư mục {folder_name}.")
+            if folder_failed:
+                failed_folders.append(folder_name)
         else:
             logger.debug(f"Bỏ qua '{folder_name}' vì nó không phải là thư mục.")
 
+    if failed_folders:
+        logger.error(f"Cập nhật mối quan hệ thất bại cho {len(failed_folders)} thư mục: {', '.join(failed_folders)}")
+        return False
     logger.info("Hoàn tất quá trình cập nhật mối quan hệ thành viên.")
+    return True
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Cập nhật mối quan hệ thành viên từ dữ liệu trung gian đã lưu.")
     parser.add_argument("--folder", type=str, help="Chỉ định thư mục gia đình cần xử lý (ví dụ: '1'). Nếu không, tất cả các thư mục sẽ được xử lý.")
+    parser.add_argument("--limit", type=int, default=0, help="Chỉ cập nhật mối quan hệ cho N thành viên đầu tiên của mỗi gia đình (debug/test).")
     args = parser.parse_args()
-    main(target_folder=args.folder)
\ No newline at end of file
+    log_setup.setup_logging()
+    profiling.configure_from_env()
+    tracing.configure_from_env()
+    if not main(target_folder=args.folder, limit=args.limit):
+        sys.exit(1) # Để --isolation subprocess cũng thấy bước thất bại
\ No newline at end of file
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark harness for the crawl cleaners and rule-based extractors.
+
+Pages are produced by the deterministic generator in synthetic_html.py, so two
+runs with the same --members/--generations/--seed time exactly the same input.
+Each benchmark reports throughput (best of --repeat runs) and peak traced memory,
+and can be compared against a stored baseline JSON to flag regressions.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from vietnamgiapha.benchmarks.synthetic_html import SyntheticFamily
+from vietnamgiapha.crawling.crawl_giapha import _clean_giapha_html
+from vietnamgiapha.crawling.crawl_member_details import _clean_member_html
+from vietnamgiapha.extraction.rule_based import extract_family
+from vietnamgiapha.extraction.rule_based import extract_family_tree
+from vietnamgiapha.extraction.rule_based import extract_member
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_TOLERANCE = 0.25
+
+
+class Benchmark:
+    """One timed workload: `run()` processes `items` units (pages or members) once."""
+
+    def __init__(self, name: str, run, items: int, unit: str):
+        self.name = name
+        self.run = run
+        self.items = items
+        self.unit = unit
+
+
+def build_benchmarks(num_members: int, num_generations: int, num_families: int, seed: int, work_dir: str) -> list:
+    """Generates the synthetic corpus and returns the benchmarks to run over it."""
+    families = [SyntheticFamily(str(family_id), num_members, num_generations, seed)
+                for family_id in range(1, num_families + 1)]
+
+    raw_member_pages = [family.member_page(member) for family in families for member in family.members]
+    cleaned_member_pages = [(family.family_id, f"{member['id']}.html", _clean_member_html(family.member_page(member)))
+                            for family in families for member in family.members]
+    raw_giapha_pages = [family.giapha_page() for family in families]
+    cleaned_giapha_pages = [_clean_giapha_html(page) for page in raw_giapha_pages]
+
+    pha_he_paths = []
+    for family in families:
+        pha_he_path = os.path.join(work_dir, f"pha_he_{family.family_id}.html")
+        with open(pha_he_path, "w", encoding="utf-8") as f:
+            f.write(family.pha_he_page())
+        pha_he_paths.append(pha_he_path)
+    total_tree_members = sum(len(family.members) for family in families)
+
+    def run_clean_member():
+        for page in raw_member_pages:
+            _clean_member_html(page)
+
+    def run_parse_member():
+        for family_id, member_filename, page in cleaned_member_pages:
+            extract_member.parse_family_html(page, family_id=family_id, member_filename=member_filename)
+
+    def run_clean_giapha():
+        for page in raw_giapha_pages:
+            _clean_giapha_html(page)
+
+    def run_extract_overview():
+        for page in cleaned_giapha_pages:
+            extract_family.extract_overview(page)
+
+    def run_extract_tree():
+        for pha_he_path in pha_he_paths:
+            extract_family_tree.extract_data(pha_he_path)
+
+    return [
+        Benchmark("crawl._clean_member_html", run_clean_member, len(raw_member_pages), "pages"),
+        Benchmark("extract_member.parse_family_html", run_parse_member, len(cleaned_member_pages), "members"),
+        Benchmark("crawl._clean_giapha_html", run_clean_giapha, len(raw_giapha_pages), "pages"),
+        Benchmark("extract_family.extract_overview", run_extract_overview, len(cleaned_giapha_pages), "pages"),
+        Benchmark("extract_family_tree.extract_data", run_extract_tree, total_tree_members, "members"),
+    ]
+
+
+def measure(benchmark: Benchmark, repeat: int) -> dict:
+    """Best-of-`repeat` wall time, then one extra traced run for peak memory."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        benchmark.run()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+
+    tracemalloc.start()
+    benchmark.run()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "items": benchmark.items,
+        "unit": benchmark.unit,
+        "best_seconds": best,
+        "throughput": benchmark.items / best if best > 0 else float("inf"),
+        "peak_memory_mb": peak_bytes / (1024 * 1024),
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns human-readable regression messages (empty when nothing regressed)."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if not reference:
+            continue
+        if result["throughput"] < reference["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']:.1f} < baseline {reference['throughput']:.1f} {result['unit']}/s")
+        if result["peak_memory_mb"] > reference["peak_memory_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak memory {result['peak_memory_mb']:.1f} MB > baseline {reference['peak_memory_mb']:.1f} MB")
+    return regressions
+
+
+def print_report(results: dict, baseline: dict = None):
+    header = f"{'benchmark':<36} {'items':>7} {'best (s)':>9} {'throughput':>16} {'peak MB':>8} {'vs baseline':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        reference = (baseline or {}).get("results", {}).get(name)
+        delta = f"{(result['throughput'] / reference['throughput'] - 1) * 100:+.1f}%" if reference else "n/a"
+        throughput = f"{result['throughput']:.1f} {result['unit']}/s"
+        print(f"{name:<36} {result['items']:>7} {result['best_seconds']:>9.3f} {throughput:>16} {result['peak_memory_mb']:>8.1f} {delta:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các bộ làm sạch HTML và extractor rule-based trên dữ liệu tổng hợp.")
+    parser.add_argument("--members", type=int, default=300, help="Số thành viên mỗi gia đình tổng hợp.")
+    parser.add_argument("--generations", type=int, default=8, help="Số đời mỗi gia đình tổng hợp.")
+    parser.add_argument("--families", type=int, default=2, help="Số gia đình tổng hợp.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed cho bộ sinh dữ liệu.")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi benchmark (lấy thời gian tốt nhất).")
+    parser.add_argument("--only", type=str, help="Chỉ chạy các benchmark có tên chứa chuỗi này.")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE_PATH, help="File JSON baseline để so sánh.")
+    parser.add_argument("--save_baseline", action="store_true", help="Ghi kết quả lần chạy này làm baseline mới.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Mức suy giảm cho phép so với baseline (0.25 = 25%%) trước khi báo regression.")
+    parser.add_argument("--json", type=str, help="Ghi kết quả chi tiết ra file JSON.")
+    args = parser.parse_args()
+
+    config = {"members": args.members, "generations": args.generations, "families": args.families, "seed": args.seed}
+    print(f"Sinh dữ liệu tổng hợp: {config}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmarks = build_benchmarks(args.members, args.generations, args.families, args.seed, work_dir)
+        if args.only:
+            benchmarks = [benchmark for benchmark in benchmarks if args.only in benchmark.name]
+        results = {benchmark.name: measure(benchmark, args.repeat) for benchmark in benchmarks}
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"Cảnh báo: baseline được tạo với cấu hình khác {baseline.get('config')}; kết quả so sánh có thể không chính xác.")
+
+    print_report(results, baseline)
+
+    report = {"config": config, "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Đã lưu baseline vào '{args.baseline}'.")
+        return
+
+    if baseline:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("\nPhát hiện regression so với baseline:")
+            for message in regressions:
+                print(f"  - {message}")
+            sys.exit(1)
+        print("\nKhông có regression so với baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Startup (import) time check for the unified CLI.
+
+Each command is started as `python -X importtime -m vietnamgiapha <command> --help` in a fresh
+interpreter. The importtime report on stderr gives the cumulative time of every top-level import,
+so the startup cost of a command is the sum over the modules it pulled in. `--help` must stay light:
+heavy third-party modules (bs4, lxml, aiohttp, requests, ...) are only imported when a command does
+real work, never while just parsing arguments.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Không được nạp khi chỉ in --help.
+HEAVY_MODULES = ["bs4", "lxml", "aiohttp", "requests", "dotenv", "pyarrow", "pandas", "ollama"]
+COMMANDS = ["", "run", "crawl", "extract", "extract-llm", "ingest", "export", "store"]
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_importtime(stderr: str) -> list:
+    """Rows (self_us, cumulative_us, module, depth) from a -X importtime report, in import order."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((int(self_us), int(cumulative_us), name.strip(), depth))
+    return rows
+
+
+def measure(command: str) -> dict:
+    argv = [sys.executable, "-X", "importtime", "-m", "vietnamgiapha"] + ([command] if command else []) + ["--help"]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_ROOT, os.environ.get("PYTHONPATH")])))
+    completed = subprocess.run(argv, capture_output=True, text=True, env=env, cwd=PROJECT_ROOT)
+    rows = parse_importtime(completed.stderr)
+    # Dòng có depth 0 (thụt lề 1) là import cấp cao nhất; thời gian cộng dồn của chúng không chồng lên nhau.
+    top_level = [row for row in rows if row[3] == 0]
+    heaviest = sorted(top_level, key=lambda row: -row[1])[:5]
+    heavy = sorted({row[2].split(".")[0] for row in rows} & set(HEAVY_MODULES))
+    return {
+        "command": command or "(help)",
+        "exit_code": completed.returncode,
+        "import_ms": sum(row[1] for row in top_level) / 1000,
+        "modules": len(rows),
+        "heavy_modules": heavy,
+        "heaviest": [(name, cumulative_us / 1000) for _, cumulative_us, name, _ in heaviest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian import khi khởi động của từng lệnh 'python -m vietnamgiapha <lệnh> --help'.")
+    parser.add_argument("--commands", nargs="+", choices=COMMANDS[1:], help="Chỉ đo các lệnh này (mặc định: tất cả, kể cả --help chung).")
+    parser.add_argument("--budget_ms", type=float, default=150.0, help="Thời gian import tối đa (ms) cho mỗi lệnh.")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần đo mỗi lệnh; lấy lần nhanh nhất.")
+    parser.add_argument("--json", type=str, help="Ghi kết quả ra file JSON.")
+    args = parser.parse_args()
+
+    commands = args.commands or COMMANDS
+    results, violations = [], []
+    print(f"\n=== Import time (python -X importtime -m vietnamgiapha <lệnh> --help), budget {args.budget_ms:g} ms ===")
+    for command in commands:
+        result = min((measure(command) for _ in range(max(args.repeat, 1))), key=lambda r: r["import_ms"])
+        results.append(result)
+        problems = []
+        if result["exit_code"] != 0:
+            problems.append(f"exit code {result['exit_code']}")
+        if result["import_ms"] > args.budget_ms:
+            problems.append(f"{result['import_ms']:.1f} ms > {args.budget_ms:g} ms")
+        if result["heavy_modules"]:
+            problems.append("nạp " + ", ".join(result["heavy_modules"]))
+        heaviest = ", ".join(f"{name} {ms:.1f}" for name, ms in result["heaviest"][:3])
+        print(f"{result['command']:<12} {result['import_ms']:7.1f} ms  {result['modules']:4d} modules  "
+              f"{'FAIL: ' + '; '.join(problems) if problems else 'ok'}   [{heaviest}]")
+        if problems:
+            violations.append(result["command"])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": {"budget_ms": args.budget_ms, "repeat": args.repeat}, "results": results}, f, indent=2)
+    if violations:
+        print(f"Vượt ngân sách khởi động: {', '.join(violations)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the LLM extraction pipeline against the mock Ollama server.
+
+A synthetic family (synthetic_html.py) is written to a temporary output/ tree, the
+mock server (mock_ollama.py) is started in a child process, and extract_pipeline runs
+in this process exactly as it does from the command line. Because the mock reports
+how long it spent "generating", the run splits into model time and the time the
+pipeline's request slots sat idle (prompt building, compaction, HTTP, JSON parsing,
+file writes, but also warm-up and the tail where fewer requests than slots are left).
+Retry backoff sleeps are left out of that window.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import requests
+
+from vietnamgiapha.benchmarks.synthetic_html import write_synthetic_family
+from vietnamgiapha.benchmarks.mock_ollama import add_mock_arguments
+
+MOCK_MODULE = "vietnamgiapha.benchmarks.mock_ollama"
+FAMILY_ID = "1"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(port: int, mock_args: list) -> subprocess.Popen:
+    """Starts the mock server and waits until /api/tags answers."""
+    process = subprocess.Popen([sys.executable, "-m", MOCK_MODULE, "--port", str(port)] + mock_args,
+                               stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f"Mock Ollama thoát với mã {process.returncode}.")
+        try:
+            if requests.get(f"{base_url}/api/tags", timeout=1).ok:
+                return process
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Mock Ollama không khởi động được.")
+
+
+def mock_cli_args(args) -> list:
+    return ["--latency", str(args.latency), "--tokens_per_sec", str(args.tokens_per_sec), "--parallel", str(args.parallel),
+            "--failure_rate", str(args.failure_rate), "--failure_modes", args.failure_modes,
+            "--hang_seconds", str(args.hang_seconds), "--failure_seed", str(args.failure_seed),
+            "--load_seconds", str(args.load_seconds)]
+
+
+def run_benchmark(args, work_dir: str) -> dict:
+    write_synthetic_family(os.path.join(work_dir, "output"), FAMILY_ID, args.members, args.generations, args.seed)
+    if not args.with_family:
+        # Skip the family-info step (a separate interpreter per family) so only member extraction is timed.
+        data_dir = os.path.join(work_dir, "output", FAMILY_ID, "data")
+        os.makedirs(data_dir, exist_ok=True)
+        with open(os.path.join(data_dir, f"giapha_info_{FAMILY_ID}.json"), "w", encoding="utf-8") as f:
+            json.dump({"name": "benchmark"}, f)
+
+    port = args.port or _free_port()
+    api_url = f"http://127.0.0.1:{port}/api/generate"
+    # Read at import time by the LLM modules, so they are imported only after this.
+    os.environ["OLLAMA_API_URL"] = api_url
+    os.environ["OLLAMA_API_URLS"] = ""
+    os.environ["LLM_CACHE_DISABLED"] = "1"
+    from vietnamgiapha.pipelines.extract_pipeline import extract_pipeline, retry_stats
+
+    mock = start_mock(port, mock_cli_args(args))
+    previous_dir = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        retry_wait_start = retry_stats["wait_seconds"]
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        succeeded = asyncio.run(extract_pipeline(FAMILY_ID, None, args.concurrency, args.mode, args.batch_size, args.retries))
+        wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        retry_wait_seconds = retry_stats["wait_seconds"] - retry_wait_start
+        mock_stats = requests.get(f"http://127.0.0.1:{port}/mock/stats", timeout=5).json()
+    finally:
+        os.chdir(previous_dir)
+        mock.terminate()
+        mock.wait()
+
+    members_dir = os.path.join(work_dir, "output", FAMILY_ID, "data", "members")
+    written = len([name for name in os.listdir(members_dir) if name.endswith(".json")]) if os.path.isdir(members_dir) else 0
+    calls = mock_stats["requests"]
+    # Slots the pipeline could keep busy. A slot not generating is idle: orchestration, but also warm-up and
+    # the tail of the run. Retry backoff sleeps idle every slot on purpose, so they are not counted.
+    slots = min(args.concurrency, args.parallel) if args.parallel > 0 else args.concurrency
+    idle_slot_seconds = max(0.0, (wall_seconds - retry_wait_seconds) * slots - mock_stats["model_seconds"])
+    return {
+        "succeeded": succeeded,
+        "members": args.members,
+        "members_written": written,
+        "wall_seconds": wall_seconds,
+        "members_per_sec": written / wall_seconds if wall_seconds > 0 else 0.0,
+        "cpu_ms_per_member": cpu_seconds * 1000 / max(written, 1),
+        "calls": calls,
+        "failures": mock_stats["failures"],
+        "disconnects": mock_stats["disconnects"],
+        "model_loads": mock_stats["loads"],
+        "num_ctx": mock_stats["num_ctx"],
+        "peak_in_flight": mock_stats["peak_in_flight"],
+        "model_seconds": mock_stats["model_seconds"],
+        "model_ms_per_call": mock_stats["model_seconds"] * 1000 / calls if calls else None,
+        "retry_wait_seconds": retry_wait_seconds,
+        "idle_slot_seconds": idle_slot_seconds,
+        "idle_slot_ms_per_call": idle_slot_seconds * 1000 / calls if calls else None,
+    }
+
+
+def print_report(config: dict, result: dict):
+    print("\n=== LLM pipeline benchmark ===")
+    print(f"config: {config}")
+    print(f"{'members written':<28} {result['members_written']}/{result['members']}"
+          + ("" if result["succeeded"] else "  (pipeline reported failures)"))
+    print(f"{'wall time':<28} {result['wall_seconds']:.2f} s")
+    print(f"{'throughput':<28} {result['members_per_sec']:.1f} members/s")
+    print(f"{'orchestration CPU':<28} {result['cpu_ms_per_member']:.2f} ms/member")
+    print(f"{'Ollama calls':<28} {result['calls']} (peak in flight {result['peak_in_flight']}, "
+          f"failures {result['failures'] or 'none'}, disconnects {result['disconnects']})")
+    print(f"{'model loads':<28} {result['model_loads']} (num_ctx used: {result['num_ctx']})")
+    def per_call(value):
+        return "n/a" if value is None else f"{value:.1f} ms/call"
+
+    print(f"{'model time':<28} {result['model_seconds']:.2f} s total, {per_call(result['model_ms_per_call'])}")
+    print(f"{'retry backoff':<28} {result['retry_wait_seconds']:.2f} s (not counted as idle)")
+    print(f"{'idle slot time':<28} {result['idle_slot_seconds']:.2f} s total, {per_call(result['idle_slot_ms_per_call'])}"
+          " (orchestration, warm-up and tail)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline trích xuất LLM (extract_pipeline) với máy chủ Ollama giả lập.")
+    parser.add_argument("--members", type=int, default=200, help="Số thành viên của gia đình tổng hợp.")
+    parser.add_argument("--generations", type=int, default=8, help="Số đời của gia đình tổng hợp.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed cho bộ sinh dữ liệu.")
+    parser.add_argument("--mode", choices=["hybrid", "llm"], default="llm", help="Chế độ trích xuất của extract_pipeline.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số request Ollama đồng thời của pipeline.")
+    parser.add_argument("--batch_size", type=int, default=1, help="Số thành viên mỗi request (chỉ với --mode llm).")
+    parser.add_argument("--retries", type=int, default=2, help="Số vòng thử lại các thành viên lỗi.")
+    parser.add_argument("--with_family", action="store_true", help="Chạy cả bước trích xuất thông tin gia phả (tiến trình con).")
+    parser.add_argument("--port", type=int, default=0, help="Cổng cho mock Ollama (mặc định: cổng trống bất kỳ).")
+    parser.add_argument("--json", type=str, help="Ghi kết quả ra file JSON.")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in ("members", "generations", "mode", "concurrency", "batch_size",
+                                                  "latency", "tokens_per_sec", "parallel", "failure_rate", "failure_modes")}
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = run_benchmark(args, work_dir)
+    print_report(config, result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": result}, f, indent=2)
+    if not result["succeeded"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Ollama /api/generate endpoint.
+
+Answers are schema-conforming JSON derived from the prompt itself: member prompts
+(single, batched and reduced-field) are answered from the "label: value" page
+content, family prompts with a minimal family object. Latency, token rate,
+server-side parallelism and failure modes are configurable, so the LLM pipeline
+can be benchmarked and its retry/abort paths exercised without a model. Like
+Ollama, the mock "reloads" the model (--load_seconds) whenever num_ctx changes,
+and an empty prompt only loads it.
+
+    python -m vietnamgiapha.benchmarks.mock_ollama --port 11500 --latency 0.2 --tokens_per_sec 80 \
+        --failure_rate 0.05 --failure_modes http_500,invalid_json,runaway
+
+GET /mock/stats returns request counts and the simulated model time; POST /mock/reset clears them.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+
+from aiohttp import web
+
+from vietnamgiapha.extraction.rule_based import extract_member
+
+FAILURE_MODES = ["http_500", "invalid_json", "truncated", "runaway", "hang"]
+# Rough characters per token, used to pace streamed output at --tokens_per_sec.
+CHARS_PER_TOKEN = 4
+RUNAWAY_MAX_SECONDS = 120.0
+
+_MEMBER_HEADER = re.compile(r"^=== MEMBER (\S+) ===$", re.MULTILINE)
+_CODE_PATTERN = re.compile(r'"code" field, format it as "(GPVN-M-[^"]+)"')
+_FIELD_LINE = re.compile(r'^  "(\w+)": ', re.MULTILINE)
+_NAME_GENDER = re.compile(r"^(.*?)\s*\((Nam|Nữ)\)\s*$")
+
+
+def _page_content(prompt: str) -> str:
+    """The text between the first pair of "---" lines (the compacted page)."""
+    parts = prompt.split("\n---\n")
+    return parts[1] if len(parts) >= 3 else prompt
+
+
+def _iso_date(value: str):
+    date = extract_member.normalize_date(value) if value else None
+    return f"{date}T00:00:00Z" if date else None
+
+
+def member_from_content(content: str, code: str = None) -> dict:
+    """Builds a member object from the "Người trong gia đình" section of a compacted page."""
+    labels = {}
+    in_person = False
+    for line in content.split("\n"):
+        if line == "Người trong gia đình":
+            in_person = True
+            continue
+        if in_person and ":" not in line and labels:
+            break # Next section header.
+        if in_person and ":" in line:
+            label, _, value = line.partition(":")
+            labels.setdefault(label.strip(), value.strip())
+
+    full_name, gender = labels.get("Tên", ""), "Không rõ"
+    match = _NAME_GENDER.match(full_name)
+    if match:
+        full_name, gender = match.group(1), match.group(2)
+    last_name, _, first_name = full_name.partition(" ")
+    death = labels.get("Ngày mất", "")
+
+    def as_int(value):
+        return int(value) if value and value.isdigit() else None
+
+    return {
+        "lastName": last_name or None,
+        "firstName": first_name or None,
+        "code": code,
+        "nickname": labels.get("Tên thường"),
+        "dateOfBirth": _iso_date(labels.get("Ngày sinh")),
+        "dateOfDeath": _iso_date(death),
+        "dateOfDeathLunar": death if "âm lịch" in death.lower() else None,
+        "placeOfBirth": labels.get("Nơi sinh"),
+        "placeOfDeath": labels.get("Nơi an táng"),
+        "gender": gender,
+        "generation": as_int(labels.get("Đời thứ")),
+        "order": as_int(labels.get("Là con thứ")) or 0,
+        "biography": None,
+        "isDeceased": bool(death),
+    }
+
+
+def answer_for_prompt(prompt: str) -> dict:
+    """The JSON a well-behaved model would return for one of the pipeline's prompts."""
+    if "=== MEMBER " in prompt:
+        content = _page_content(prompt)
+        headers = list(_MEMBER_HEADER.finditer(content))
+        answer = {}
+        for index, header in enumerate(headers):
+            end = headers[index + 1].start() if index + 1 < len(headers) else len(content)
+            answer[header.group(1)] = member_from_content(content[header.end():end].strip(), header.group(1))
+        return answer
+    if "Extract ONLY the following fields" in prompt:
+        member = member_from_content(_page_content(prompt))
+        return {field: member.get(field) for field in _FIELD_LINE.findall(prompt.split("\n---\n")[0])}
+    match = _CODE_PATTERN.search(prompt)
+    if match:
+        return member_from_content(_page_content(prompt), match.group(1))
+    # Family information prompt.
+    return {"name": "Gia phả (mock)", "code": None, "description": None, "address": None, "genealogyRecord": None,
+            "progenitorName": None, "familyCovenant": None, "contactInfo": None, "avatarBase64": None,
+            "visibility": "Private", "managerIds": [], "viewerIds": [], "locationId": ""}
+
+
+class MockOllama:
+    """Request handlers plus the counters reported by /mock/stats."""
+
+    def __init__(self, latency: float = 0.05, tokens_per_sec: float = 0.0, parallel: int = 0,
+                 failure_rate: float = 0.0, failure_modes: list = None, hang_seconds: float = 30.0, seed: int = 0,
+                 load_seconds: float = 0.0):
+        self.latency = latency
+        self.load_seconds = load_seconds
+        self._loaded_num_ctx = None
+        self._load_lock = asyncio.Lock()
+        self.tokens_per_sec = tokens_per_sec
+        self.failure_rate = failure_rate
+        self.failure_modes = failure_modes or ["http_500"]
+        self.hang_seconds = hang_seconds
+        self.seed = seed
+        # Like OLLAMA_NUM_PARALLEL: requests beyond this many wait in a queue (0 = unlimited).
+        self._slots = asyncio.Semaphore(parallel) if parallel > 0 else None
+        self._attempts = {}
+        self.reset()
+
+    def reset(self):
+        self.stats = {"requests": 0, "completed": 0, "failures": {}, "disconnects": 0, "in_flight": 0,
+                      "peak_in_flight": 0, "model_seconds": 0.0, "service_seconds": 0.0, "output_chars": 0,
+                      "loads": 0, "num_ctx": {}}
+        self._attempts.clear()
+
+    def _pick_failure(self, prompt: str):
+        """Deterministic per (prompt, attempt number), so a retried prompt can succeed."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        attempt = self._attempts.get(digest, 0)
+        self._attempts[digest] = attempt + 1
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+        if rng.random() >= self.failure_rate:
+            return None
+        return rng.choice(self.failure_modes)
+
+    async def handle_tags(self, request):
+        return web.json_response({"models": [{"name": "mock"}]})
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats)
+
+    async def handle_reset(self, request):
+        self.reset()
+        return web.json_response({"ok": True})
+
+    async def handle_generate(self, request):
+        body = await request.json()
+        self.stats["requests"] += 1
+        start = time.perf_counter()
+        if self._slots is None:
+            return await self._generate(request, body, start)
+        async with self._slots:
+            return await self._generate(request, body, start)
+
+    async def _generate(self, request, body: dict, start: float):
+        stats = self.stats
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        model_start = time.perf_counter()
+        try:
+            await self._ensure_loaded((body.get("options") or {}).get("num_ctx"))
+            prompt = body.get("prompt", "")
+            if not prompt:
+                return web.json_response({"model": body.get("model"), "response": "", "done": True, "done_reason": "load"})
+            failure = self._pick_failure(prompt)
+            if failure:
+                stats["failures"][failure] = stats["failures"].get(failure, 0) + 1
+            await asyncio.sleep(self.latency)
+            if failure == "http_500":
+                return web.json_response({"error": "mock: internal error"}, status=500)
+            if failure == "hang":
+                await asyncio.sleep(self.hang_seconds)
+
+            text = json.dumps(answer_for_prompt(prompt), ensure_ascii=False)
+            if failure == "invalid_json":
+                text = "Xin lỗi, tôi không thể trích xuất thông tin này."
+            elif failure == "truncated":
+                text = text[:len(text) // 2]
+            runaway = failure == "runaway"
+
+            if body.get("stream", True):
+                response = await self._stream(request, text, runaway)
+            else:
+                if runaway:
+                    text = '{"lastName": "' + "ha " * 20000
+                await self._pace(len(text))
+                response = web.json_response({"model": body.get("model"), "response": text, "done": True})
+            stats["output_chars"] += len(text)
+            stats["completed"] += 1
+            return response
+        except asyncio.CancelledError:
+            stats["disconnects"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+            stats["model_seconds"] += time.perf_counter() - model_start
+            stats["service_seconds"] += time.perf_counter() - start
+
+    async def _ensure_loaded(self, num_ctx):
+        key = str(num_ctx or "default")
+        self.stats["num_ctx"][key] = self.stats["num_ctx"].get(key, 0) + 1
+        async with self._load_lock:
+            if self._loaded_num_ctx != key:
+                self._loaded_num_ctx = key
+                self.stats["loads"] += 1
+                await asyncio.sleep(self.load_seconds)
+
+    async def _pace(self, chars: int):
+        if self.tokens_per_sec > 0:
+            await asyncio.sleep(chars / CHARS_PER_TOKEN / self.tokens_per_sec)
+
+    async def _stream(self, request, text: str, runaway: bool):
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+
+        async def send(chunk: str, done: bool = False):
+            await response.write((json.dumps({"response": chunk, "done": done}, ensure_ascii=False) + "\n").encode("utf-8"))
+
+        # Several tokens per message keeps the mock cheap while still pacing at --tokens_per_sec.
+        step = CHARS_PER_TOKEN * 4
+        try:
+            if runaway:
+                await send('{"lastName": "')
+                deadline = time.perf_counter() + RUNAWAY_MAX_SECONDS
+                while time.perf_counter() < deadline:
+                    await send("ha " * (step // 3))
+                    await asyncio.sleep(step / CHARS_PER_TOKEN / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.001)
+            else:
+                for index in range(0, len(text), step):
+                    await send(text[index:index + step])
+                    await self._pace(step)
+            await send("", done=True)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client stopped reading: expected once the JSON is complete, or when it aborts a generation.
+            self.stats["disconnects"] += 1
+        return response
+
+
+def build_app(mock: MockOllama) -> web.Application:
+    app = web.Application()
+    app.router.add_post("/api/generate", mock.handle_generate)
+    app.router.add_get("/api/tags", mock.handle_tags)
+    app.router.add_get("/mock/stats", mock.handle_stats)
+    app.router.add_post("/mock/reset", mock.handle_reset)
+    return app
+
+
+def add_mock_arguments(parser):
+    """Adds the mock server options (shared with bench_llm_pipeline)."""
+    parser.add_argument("--latency", type=float, default=0.05, help="Thời gian chờ cố định mỗi request (giây), mô phỏng xử lý prompt.")
+    parser.add_argument("--tokens_per_sec", type=float, default=0.0, help="Tốc độ sinh token mô phỏng (0 = trả ngay).")
+    parser.add_argument("--parallel", type=int, default=0, help="Số request xử lý đồng thời, như OLLAMA_NUM_PARALLEL (0 = không giới hạn).")
+    parser.add_argument("--failure_rate", type=float, default=0.0, help="Tỉ lệ request bị lỗi (0..1).")
+    parser.add_argument("--failure_modes", type=str, default="http_500",
+                        help=f"Các kiểu lỗi, phân tách bằng dấu phẩy: {', '.join(FAILURE_MODES)}.")
+    parser.add_argument("--hang_seconds", type=float, default=30.0, help="Thời gian treo với kiểu lỗi 'hang'.")
+    parser.add_argument("--load_seconds", type=float, default=0.0, help="Thời gian nạp model mô phỏng, mỗi khi num_ctx thay đổi.")
+    parser.add_argument("--failure_seed", type=int, default=0, help="Seed chọn request bị lỗi.")
+
+
+def mock_from_args(args) -> MockOllama:
+    failure_modes = [mode.strip() for mode in args.failure_modes.split(",") if mode.strip()]
+    unknown = set(failure_modes) - set(FAILURE_MODES)
+    if unknown:
+        raise ValueError(f"Kiểu lỗi không hợp lệ: {', '.join(sorted(unknown))}")
+    return MockOllama(args.latency, args.tokens_per_sec, args.parallel, args.failure_rate, failure_modes,
+                      args.hang_seconds, args.failure_seed, args.load_seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Máy chủ Ollama giả lập (/api/generate) để benchmark và kiểm thử pipeline LLM.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    print(f"Mock Ollama đang chạy tại http://{args.host}:{args.port}/api/generate", flush=True)
+    web.run_app(build_app(mock_from_args(args)), host=args.host, port=args.port, print=None)
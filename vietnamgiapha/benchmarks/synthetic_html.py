@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic generator of synthetic vietnamgiapha.com pages.
+
+The generated pages mirror the layout of the real site closely enough for the
+crawl cleaners and the rule-based extractors to take the same code paths they
+take on production data: member detail pages (with spouses, siblings and
+children), giapha.html and pha_he.html with N members over G generations.
+"""
+import os
+import random
+import argparse
+
+BG_URL = "https://vietnamgiapha.com/giapha_tml/oldbook//images/bg.jpeg"
+PHA_HE_BG_URL = "https://vietnamgiapha.com/giapha_tml/oldbook/images/bg.jpeg"
+
+LAST_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ", "Hồ", "Ngô", "Dương", "Lý", "Cao", "Lương", "Tô"]
+MALE_MIDDLE = ["Văn", "Hữu", "Đức", "Minh", "Quang", "Xuân", "Đắc", "Công"]
+FEMALE_MIDDLE = ["Thị", "Thị Thu", "Thị Hà", "Ngọc", "Thị Lan"]
+MALE_GIVEN = ["Tải", "Tế", "Lãng", "Cầu", "Bằng", "Hiền", "Long", "Thọ", "Hào", "Bản", "Trường", "Quá", "Triết", "Khải"]
+FEMALE_GIVEN = ["Xuyến", "Khuyên", "Hải", "Yên", "Thoái", "Lan Anh", "Thành", "Hoài", "Phúc", "Vân"]
+PLACES = ["Tam Kỳ - Xuân Cầu - Văn Giang", "Thôn Phước Ninh - Quế Châu - Quế Sơn", "Huê Cầu - Văn Giang - Hưng Yên", "Đồn Lưu - Kinh Môn - Hải Dương"]
+BIO_SENTENCES = [
+    "Cụ sinh thời là người hiền lành, chăm chỉ làm ăn.",
+    "Năm 1945 cụ tham gia cách mạng tại địa phương.",
+    "Cụ có công xây dựng nhà thờ họ và tu bổ phần mộ tổ tiên.",
+    "Con cháu đời đời ghi nhớ công đức của cụ.",
+    "Mộ cụ táng tại nghĩa trang làng, đã được quy tập năm 1998.",
+    "Cụ luôn dạy con cháu 'Đói cho sạch, rách cho thơm'.",
+]
+# Layout noise that surrounds the content <td> on the real site.
+PAGE_HEADER = """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.0 Transitional//EN">
+<HTML><HEAD><TITLE>Viet Nam Gia Pha, Website cua toc </TITLE>
+<meta http-equiv="content-type" content="text/html; charset=utf-8">
+<style type="text/css">@import url(https://vietnamgiapha.com/giapha_tml/oldbook/css.css);</style>
+</HEAD><BODY>
+<TABLE cellSpacing=0 cellPadding=1 width="100%" border=0><TR><TD vAlign=top height="80%">
+<TABLE cellSpacing=0 cellPadding=0 width="100%" border=0>
+<TR><TD width="8%" background="https://vietnamgiapha.com/giapha_tml/oldbook/images/i_mid.gif" height=27>&nbsp;</TD>
+<TD width="85%" background="https://vietnamgiapha.com/giapha_tml/oldbook/images/top_r.gif" height=27>&nbsp;</TD></TR>
+<TR><TD vAlign=center align=middle width="8%"><p>GIA </p><p>PHẢ </p><p>TỘC </p></TD>
+<TD><table width="100%"><tr><td><a href="/XemGiaPha/{family_id}/giapha.html"><img src="/images/menu1.gif" border=0></a>
+<a href="/XemPhaKy/{family_id}/pha_ky_gia_su.html"><img src="/images/menu2.gif" border=0></a>
+<a href="/XemPhaHe/{family_id}/pha_he.html"><img src="/images/menu3.gif" border=0></a></td></tr></table></TD></TR>
+<TR>
+"""
+PAGE_FOOTER = """
+</TR></TABLE></TD></TR></TABLE>
+<script language="javascript">var _gaq = _gaq || []; _gaq.push(['_trackPageview']);</script>
+</BODY></HTML>
+"""
+
+
+class SyntheticFamily:
+    """A generated family tree with one node per member, in pha_he (depth-first) order."""
+
+    def __init__(self, family_id: str, num_members: int, num_generations: int, seed: int = 0):
+        if num_members < 1 or num_generations < 1:
+            raise ValueError("num_members and num_generations must be positive.")
+        self.family_id = str(family_id)
+        self.rng = random.Random(f"{seed}-{family_id}")
+        self.last_name = self.rng.choice(LAST_NAMES)
+        self.members = self._build_tree(num_members, min(num_generations, num_members))
+        self.by_id = {member["id"]: member for member in self.members}
+
+    def _person_name(self, gender: str, last_name: str = None) -> str:
+        last_name = last_name or self.rng.choice(LAST_NAMES)
+        if gender == "Nam":
+            return f"{last_name} {self.rng.choice(MALE_MIDDLE)} {self.rng.choice(MALE_GIVEN)}"
+        return f"{last_name} {self.rng.choice(FEMALE_MIDDLE)} {self.rng.choice(FEMALE_GIVEN)}"
+
+    def _build_tree(self, num_members: int, num_generations: int) -> list:
+        # Spread members over generations with a roughly geometric growth, at least one per generation.
+        # Generation 1 keeps a single progenitor (unless there is only one generation) so the tree is connected.
+        weights = [1.6 ** g for g in range(num_generations)]
+        if num_generations > 1:
+            weights[0] = 0
+        sizes = [1] * num_generations
+        for _ in range(num_members - num_generations):
+            sizes[self.rng.choices(range(num_generations), weights=weights)[0]] += 1
+
+        nodes = []
+        next_id = 1
+        previous_generation = []
+        for generation, size in enumerate(sizes, start=1):
+            current_generation = []
+            for _ in range(size):
+                parent = self.rng.choice(previous_generation) if previous_generation else None
+                gender = "Nam" if generation == 1 or self.rng.random() < 0.6 else "Nữ"
+                node = {
+                    "id": next_id,
+                    "generation": generation,
+                    "gender": gender,
+                    "name": self._person_name(gender, self.last_name),
+                    "parent": parent["id"] if parent else None,
+                    "children": [],
+                    "spouses": [self._person_name("Nữ" if gender == "Nam" else "Nam")
+                                for _ in range(self.rng.choice([0, 1, 1, 1, 2]))],
+                    "birth_year": 1800 + generation * 25 + self.rng.randint(0, 20),
+                    "deceased": self.rng.random() < max(0.1, 1 - generation / max(len(sizes), 1)),
+                }
+                if parent:
+                    parent["children"].append(node)
+                current_generation.append(node)
+                nodes.append(node)
+                next_id += 1
+            previous_generation = current_generation
+
+        ordered = []
+        stack = [node for node in reversed(nodes) if node["parent"] is None]
+        while stack:
+            node = stack.pop()
+            ordered.append(node)
+            stack.extend(reversed(node["children"]))
+        return ordered
+
+    def _member_link(self, member: dict, with_gender: bool = True) -> str:
+        label = f"{member['name']} ({member['gender']})" if with_gender else member["name"]
+        return f'<a href="/XemChiTietTungNguoi/{self.family_id}/{member["id"]}/chitiet.html">{label}</a>'
+
+    def _biography(self) -> str:
+        return " ".join(self.rng.choice(BIO_SENTENCES) for _ in range(self.rng.randint(1, 6)))
+
+    def _person_rows(self, name: str, gender: str, birth_year: int, deceased: bool, order: int = None) -> str:
+        rows = [
+            f'<tr>\n<td style="font-weight:bold" width="18%">Tên</td>\n<td width="58%">{name}  ({gender})</td>\n<td rowspan="8" valign="top" width="23%"></td>\n</tr>',
+            f'<tr>\n<td style="font-weight:bold">Tên thường</td>\n<td>{name}</td>\n</tr>',
+            '<tr>\n<td style="font-weight:bold">Tên Tự</td>\n<td></td>\n</tr>',
+        ]
+        if order is not None:
+            rows.append(f'<tr>\n<td style="font-weight:bold">Là con thứ</td>\n<td>{order}</td>\n</tr>')
+        rows.append(f'<tr>\n<td style="font-weight:bold">Ngày sinh</td>\n<td>{self.rng.randint(1, 28)}/{self.rng.randint(1, 12)}/{birth_year}</td>\n</tr>')
+        if deceased:
+            rows.append(f'<tr>\n<td style="font-weight:bold">Hưởng thọ:</td>\n<td>{self.rng.randint(30, 95)}</td>\n<td> </td>\n</tr>')
+            death_value = self.rng.choice([
+                f"{self.rng.randint(1, 28)}/{self.rng.randint(1, 12)}/{birth_year + self.rng.randint(30, 90)}",
+                f"Ngày kỵ {self.rng.randint(1, 30)}/{self.rng.randint(1, 12)} Âm Lịch",
+                f"{self.rng.randint(1, 30)} tháng {self.rng.randint(1, 12)} năm Kỷ Tỵ",
+            ])
+            rows.append(f'<tr>\n<td style="font-weight:bold">Ngày mất</td>\n<td>{death_value}</td>\n<td> </td>\n</tr>')
+            rows.append(f'<tr>\n<td style="font-weight:bold">Nơi an táng</td>\n<td>{self.rng.choice(PLACES)}</td>\n<td> </td>\n</tr>')
+        rows.append('<tr>\n<td colspan="3" style="font-weight:bold">Sự nghiệp, công đức, ghi chú</td>\n</tr>')
+        rows.append(f'<tr>\n<td colspan="3">{self._biography()}</td>\n</tr>')
+        return "\n".join(rows)
+
+    def member_content(self, member: dict) -> str:
+        """The content <td> of a member detail page (what the crawler keeps)."""
+        parent = self.by_id.get(member["parent"])
+        if parent:
+            father_row = f'<td align="center" style="font-weight:bold;">Là con của: {self._member_link(parent, with_gender=False)}</td>'
+            siblings = [sibling for sibling in parent["children"] if sibling["id"] != member["id"]]
+            order = parent["children"].index(member) + 1
+        else:
+            father_row = f'<td align="center" style="font-weight:bold;">Là con của: <a href="/XemChiTietTungNguoi/{self.family_id}/{member["id"]}/Thuy_to.html">Thuỷ tổ</a></td>'
+            siblings = []
+            order = None
+
+        spouse_blocks = []
+        for spouse_name in member["spouses"]:
+            spouse_gender = "Nữ" if member["gender"] == "Nam" else "Nam"
+            spouse_blocks.append(self._person_rows(spouse_name, spouse_gender, member["birth_year"] + self.rng.randint(-5, 5),
+                                                   member["deceased"] and self.rng.random() < 0.8))
+
+        if siblings:
+            sibling_html = "<br/>".join(self._member_link(sibling) for sibling in siblings)
+        else:
+            sibling_html = "Không có anh em"
+        children_html = "<br/>       ".join(self._member_link(child, with_gender=False) for child in member["children"])
+
+        return f"""<td background="{BG_URL}" colspan="2" height="100%" valign="top">
+<table align="center" border="0" cellpadding="2" cellspacing="2" width="80%">
+<tbody><tr>
+<td align="center" style="font-weight:bold;font-size:24px">Chi tiết gia đình</td>
+</tr>
+<tr>
+{father_row}
+</tr>
+<tr>
+<td align="center" style="font-weight:bold;">Đời thứ: {member["generation"]}</td>
+</tr>
+<tr>
+<td><table border="0" cellpadding="1" cellspacing="1" width="100%">
+<tbody><tr>
+<td colspan="3" style="font-weight:bold">Người trong gia đình</td>
+</tr>
+<tr>
+<td style="font-weight:bold">Đời thứ</td>
+<td>{member["generation"]}</td>
+</tr>
+{self._person_rows(member["name"], member["gender"], member["birth_year"], member["deceased"], order)}
+<tr>
+<td colspan="3"><hr/></td>
+</tr>
+<tr>
+<td colspan="3" style="font-weight:bold">Liên quan (chồng, vợ) trong gia đình</td>
+</tr>
+{chr(10).join(spouse_blocks)}
+</tbody></table>
+</td>
+</tr>
+<tr>
+<td><hr/></td>
+</tr>
+<tr>
+<td><b>Các anh em, dâu rể: </b> {sibling_html}</td>
+</tr>
+<tr>
+<td><b>Con cái: </b> <br/>       {children_html}</td>
+</tr>
+</tbody></table>
+</td>"""
+
+    def member_page(self, member: dict) -> str:
+        """A full, uncleaned member detail page as served by the site."""
+        return PAGE_HEADER.format(family_id=self.family_id) + self.member_content(member) + PAGE_FOOTER
+
+    def giapha_page(self) -> str:
+        """A full, uncleaned giapha.html page."""
+        generations = max(member["generation"] for member in self.members)
+        content = f"""<td valign="top" background="{BG_URL}" height="100%">
+<table align=center width=90%>
+<tr><td>
+<br /><br />
+<div align="center"><font color="#ff0000" size="6"><b><font face="Times New Roman, Times, serif">GIA PHẢ</font></b><br />
+TỘC {self.last_name} - Chi {self.family_id}</font></div>
+<br /><br />
+<div align="center">Lời nói tiêu biểu của học tộc<br /><font size="+1">Đói cho sạch, rách cho thơm</font></div>
+<br /><br />
+<div align="center">Ở tại<br /><font size="+1"><br />{self.rng.choice(PLACES)}</font></div>
+<br /><br />
+<div align="left">
+<b>Các ngày lễ giỗ:</b>
+<li>Ngày tế xuân<b>Không rõ</b></li>
+<li>Ngày tế thu <b>Không rõ</b></li>
+<li>Ngày hội mã<b>13-7</b><br /><br /><b>Tổng quan gia phả:</b></li>
+<li>Số đời từ thuỷ tổ tới con cháu<b>{generations}</b></li>
+<li>Số lượng gia đình: <b>{len(self.members)}</b></li>
+<li>Số người: <b>{len(self.members) + sum(len(m["spouses"]) for m in self.members)}</b><br /><br /><b>Thông tin người quản lý gia phả này:</b></li>
+<li><b>Người làm: </b>Ông {self._person_name("Nam", self.last_name)}</li>
+<li><b>Địa chỉ: </b>{self.rng.choice(PLACES)}</li>
+<li><b>Điện thoại: </b>09{self.rng.randint(10000000, 99999999)}</li>
+<li><b>Email: </b><a href="mailto:quanly{self.family_id} ở gmail.com">quanly{self.family_id} ở gmail.com</a></li>
+</div>
+</td></tr>
+<tr><td><a href="/XemPhaHe/{self.family_id}/pha_he.html">Xem phả hệ</a></td></tr>
+</table>
+</td>"""
+        return PAGE_HEADER.format(family_id=self.family_id) + content + PAGE_FOOTER
+
+    def pha_he_page(self) -> str:
+        """A full pha_he.html page listing every member in depth-first order."""
+        generation_counters = {}
+        entries = []
+        for member in self.members:
+            generation = member["generation"]
+            generation_counters[generation] = generation_counters.get(generation, 0) + 1
+            label = "-".join([member["name"]] + [
+                f"{spouse} (Chính thất)" if index == 0 and len(member["spouses"]) > 1 else spouse
+                for index, spouse in enumerate(member["spouses"])
+            ])
+            indent = "&nbsp;" * 4 * (generation - 1)
+            icon = "m.jpg" if member["gender"] == "Nam" else "f.jpg"
+            entries.append(f'{indent}<img src=../../treeimg/mi.gif><img src=../../treeimg/{icon}>'
+                           f'<a href="javascript:o({self.family_id},{member["id"]})">{generation}.{generation_counters[generation]} {label}</a><br>')
+        content = f"""<TD vAlign=top background="{PHA_HE_BG_URL}" height=100%>
+<table align=center width=90% height=100% border=0 cellpadding=2 cellspacing=2>
+<tr>
+<td VALIGN=TOP align=center style="font-weight:bold;font-size:24px">PH&#7842; H&#7878; - PH&#7842; &#272;&#7890; TOÀN GIA T&#7896;C</TD>
+</TR>
+<tr>
+<td><div valign=top>
+<script language="javascript">
+<!--
+function o(fid,id){{ window.open("/XemChiTietTungNguoi/"+fid+"/"+id+"/giapha.html"); }} // -->
+</script>{"".join(entries)}</div></td>
+</tr>
+</table>
+</TD>"""
+        return PAGE_HEADER.format(family_id=self.family_id) + content + PAGE_FOOTER
+
+
+def write_synthetic_family(output_base_dir: str, family_id: str, num_members: int, num_generations: int,
+                           seed: int = 0, cleaned: bool = True) -> SyntheticFamily:
+    """
+    Writes a synthetic family in the layout produced by crawl_pipeline:
+    output/<family_id>/raw_html/{giapha,pha_he,...}.html and raw_html/members/<id>.html.
+    With cleaned=True the member and giapha pages are stored as the crawler stores them.
+    """
+    # Imported lazily so the generator itself only depends on the standard library.
+    from vietnamgiapha.crawling.crawl_giapha import _clean_giapha_html
+    from vietnamgiapha.crawling.crawl_member_details import _clean_member_html
+
+    family = SyntheticFamily(family_id, num_members, num_generations, seed)
+    raw_html_dir = os.path.join(output_base_dir, str(family_id), "raw_html")
+    members_dir = os.path.join(raw_html_dir, "members")
+    os.makedirs(members_dir, exist_ok=True)
+
+    giapha_html = family.giapha_page()
+    pages = {
+        "giapha.html": _clean_giapha_html(giapha_html) if cleaned else giapha_html,
+        "pha_he.html": family.pha_he_page(),
+        "thuy_to.html": "",
+        "pha_ky_gia_su.html": "",
+        "toc_uoc.html": "",
+    }
+    for filename, content in pages.items():
+        with open(os.path.join(raw_html_dir, filename), "w", encoding="utf-8") as f:
+            f.write(content)
+    for member in family.members:
+        member_html = family.member_page(member)
+        with open(os.path.join(members_dir, f"{member['id']}.html"), "w", encoding="utf-8") as f:
+            f.write(_clean_member_html(member_html) if cleaned else member_html)
+    return family
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh dữ liệu gia phả HTML tổng hợp (deterministic) để benchmark/kiểm thử.")
+    parser.add_argument("--output_base_dir", type=str, default="synthetic_output", help="Thư mục gốc để ghi các thư mục gia đình.")
+    parser.add_argument("--families", type=int, default=1, help="Số gia đình cần sinh (ID bắt đầu từ --start_id).")
+    parser.add_argument("--start_id", type=int, default=1, help="Family ID đầu tiên.")
+    parser.add_argument("--members", type=int, default=200, help="Số thành viên mỗi gia đình.")
+    parser.add_argument("--generations", type=int, default=8, help="Số đời mỗi gia đình.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed cho bộ sinh ngẫu nhiên.")
+    args = parser.parse_args()
+
+    for family_id in range(args.start_id, args.start_id + args.families):
+        write_synthetic_family(args.output_base_dir, str(family_id), args.members, args.generations, args.seed)
+        print(f"Đã sinh gia đình {family_id} ({args.members} thành viên, {args.generations} đời) tại '{args.output_base_dir}'.")
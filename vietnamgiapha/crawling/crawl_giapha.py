@@ -3,6 +3,8 @@ from requests import Session
 import os
 import sys
 from bs4 import BeautifulSoup
+from vietnamgiapha.utils import profiling
+from vietnamgiapha.utils import tracing
 
 # This script uses the 'requests' library for crawling static HTML pages.
 # 'requests' is generally more lightweight and efficient for static content
@@ -40,7 +42,9 @@ def _crawl_and_save_html_with_requests(session: requests.Session, url: str, outp
     """
     try:
         print(f"Crawling URL: {url}")
-        response = session.get(url)
+        with tracing.span("GET page", "http", url=url) as span:
+            response = session.get(url)
+            span["status"] = response.status_code
         response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
 
         # Explicitly set encoding to utf-8, as declared in the HTML meta tag
@@ -50,7 +54,8 @@ def _crawl_and_save_html_with_requests(session: requests.Session, url: str, outp
         # Clean the HTML content if it's giapha.html
         if os.path.basename(output_filepath) == "giapha.html":
             print("Cleaning giapha.html content...")
-            html_content_to_save = _clean_giapha_html(response.text)
+            with profiling.get_profiler().stage("clean"), tracing.span("clean", page="giapha.html"):
+                html_content_to_save = _clean_giapha_html(response.text)
             if not html_content_to_save: # If cleaning failed, use original content or handle as error
                 print("HTML cleaning returned empty content, using original content.")
                 html_content_to_save = response.text # Fallback to original content
@@ -110,9 +115,12 @@ def crawl_giapha_html(family_id: str, output_giapha_html_path: str, output_base_
 
 if __name__ == "__main__":
     if len(sys.argv) < 4:
-        print("Usage: python crawl_giapha.py <family_id> <output_giapha_html_path> <output_base_dir_for_others>")
+        print("Usage: python -m vietnamgiapha.crawling.crawl_giapha <family_id> <output_giapha_html_path> <output_base_dir_for_others>")
         sys.exit(1)
     
+    profiling.configure_from_env()
+    tracing.configure_from_env()
+
     family_id_to_crawl = sys.argv[1]
     output_giapha_html_filepath = sys.argv[2]
     output_base_dir_for_other_files = sys.argv[3]
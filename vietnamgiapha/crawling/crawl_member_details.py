@@ -4,7 +4,14 @@ import os
 import sys
 from bs4 import BeautifulSoup
 import re
-from ..utils.utils import check_file_exists
+import logging
+from ..utils import profiling
+from ..utils import budget
+from ..utils import tracing
+from ..utils import log_setup
+from ..utils import run_status
+
+logger = logging.getLogger(__name__)
 
 def _clean_member_html(html_content: str) -> str:
     """
@@ -46,48 +53,61 @@ def _clean_member_html(html_content: str) -> str:
         # Return the cleaned content of the target_td wrapped in a basic HTML structure
         return f"<html><body>{str(target_td)}</body></html>"
     else:
-        print("Warning: Specific <td> tag not found in member detail page. Returning original content.")
+        logger.debug("Specific <td> tag not found in member detail page. Returning original content.")
     
     return html_content # Return original content if specific elements are not found
 
-async def _crawl_and_save_html(session: aiohttp.ClientSession, url: str, output_filepath: str):
+async def _crawl_and_save_html(session: aiohttp.ClientSession, url: str, output_filepath: str,
+                               progress: log_setup.ProgressLog = None):
     """
     Helper function to crawl a URL asynchronously using aiohttp.ClientSession and save its HTML content to a specified file.
+    Failures are reported through `progress` (rate-limited warnings) when given.
     """
+    budget.charge_request() # Vượt ngân sách của gia đình thì dừng ở đây (BudgetExceeded)
+    member_id = os.path.splitext(os.path.basename(output_filepath))[0]
+    warn = progress.warning if progress is not None else logger.warning
     try:
-        print(f"Crawling URL: {url} using aiohttp")
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response: # 30 seconds timeout
-            response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
-            
-            html_content = await response.text()
-
-            # Check for specific error content before cleaning and saving
-            if "Error code:" in html_content and "Error message:" in html_content:
-                print(f"Nội dung HTML từ {url} chứa thông báo lỗi ('Error code:' và 'Error message:'). Bỏ qua việc lưu file.")
-                return False
-
-            # Clean the HTML content
-            print("Cleaning member HTML content...")
+        logger.debug("Crawling URL: %s using aiohttp", url)
+        with tracing.span("GET member", "http", member_id=member_id, url=url) as span:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response: # 30 seconds timeout
+                span["status"] = response.status
+                response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
+                
+                html_content = await response.text()
+                span["bytes"] = len(html_content)
+
+        # Check for specific error content before cleaning and saving
+        if "Error code:" in html_content and "Error message:" in html_content:
+            run_status.count("errors")
+            warn("Nội dung HTML từ %s chứa thông báo lỗi ('Error code:' và 'Error message:'). Bỏ qua việc lưu file.", url)
+            return False
+
+        # Clean the HTML content
+        logger.debug("Cleaning member HTML content of %s", member_id)
+        with profiling.get_profiler().stage("clean"), tracing.span("clean", member_id=member_id):
             html_content_to_save = _clean_member_html(html_content)
-            if not html_content_to_save: # Fallback if cleaning returns empty
-                print("HTML cleaning returned empty content, using original content.")
-                html_content_to_save = html_content 
-
-            # Ensure the directory exists before writing the file
-            output_dir = os.path.dirname(output_filepath)
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-                print(f"Created directory: {output_dir}")
-
-            with open(output_filepath, 'w', encoding='utf-8') as f:
-                f.write(html_content_to_save)
-            print(f"Successfully saved HTML to: {output_filepath}")
-            return True
+        if not html_content_to_save: # Fallback if cleaning returns empty
+            logger.debug("HTML cleaning returned empty content for %s, using original content.", member_id)
+            html_content_to_save = html_content 
+
+        # Ensure the directory exists before writing the file
+        output_dir = os.path.dirname(output_filepath)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+            logger.debug("Created directory: %s", output_dir)
+
+        with tracing.span("write html", "io", member_id=member_id), open(output_filepath, 'w', encoding='utf-8') as f:
+            f.write(html_content_to_save)
+        logger.debug("Successfully saved HTML to: %s", output_filepath)
+        run_status.count("pages")
+        return True
     except aiohttp.ClientError as e:
-        print(f"Error crawling URL {url} with aiohttp: {e}")
+        run_status.count("errors")
+        warn("Error crawling URL %s with aiohttp: %s", url, e)
         return False
     except Exception as e:
-        print(f"An unexpected error occurred while crawling URL {url}: {e}")
+        run_status.count("errors")
+        warn("An unexpected error occurred while crawling URL %s: %s", url, e)
         return False
 
 
@@ -104,7 +124,7 @@ async def crawl_member_details(family_id: str, members_output_dir: str, pha_he_h
     try:
         with open(pha_he_html_path, 'r', encoding='utf-8') as f:
             html_content = f.read()
-        print(f"Successfully read content from: {pha_he_html_path}")
+        logger.debug("Successfully read content from: %s", pha_he_html_path)
     except FileNotFoundError:
         print(f"Error: {pha_he_html_path} not found.")
         return False
@@ -124,6 +144,7 @@ async def crawl_member_details(family_id: str, members_output_dir: str, pha_he_h
 
             consecutive_member_failures = 0
             MEMBER_FAILURE_THRESHOLD = 100
+            progress = log_setup.ProgressLog(logger, f"Family {family_id}: thu thập thành viên (ID 1-50000)")
 
             for member_id_int in range(1, 50000): # Lặp từ 1 đến 50000
                 if consecutive_member_failures >= MEMBER_FAILURE_THRESHOLD:
@@ -134,23 +155,30 @@ async def crawl_member_details(family_id: str, members_output_dir: str, pha_he_h
                 member_id = str(member_id_int)
                 output_filepath = os.path.join(members_output_dir, f"{member_id}.html")
 
-                if not force and check_file_exists(output_filepath, f"Thành viên {member_id} HTML"):
+                if not force and os.path.exists(output_filepath):
+                    logger.debug("Thành viên %s HTML đã tồn tại: %s. Bỏ qua.", member_id, output_filepath)
+                    progress.add("skipped")
                     consecutive_member_failures = 0 # Reset on existing file (implies previous success)
                     continue 
 
-                print(f"Đang xử lý member_id: {member_id} với family_id: {family_id}")
+                logger.debug("Đang xử lý member_id: %s với family_id: %s", member_id, family_id)
                 member_detail_url = f"{member_base_url}{family_id}/{member_id}/giapha.html"
                 
-                success = await _crawl_and_save_html(session, member_detail_url, output_filepath)
+                success = await _crawl_and_save_html(session, member_detail_url, output_filepath, progress)
                 if not success:
                     consecutive_member_failures += 1
                     all_members_crawled_successfully = False 
-                    print(f"Không thể thu thập và lưu HTML cho thành viên {member_id} từ URL: {member_detail_url}. Số lần thất bại liên tiếp: {consecutive_member_failures}")
+                    progress.add("failed")
+                    logger.debug("Không thể thu thập và lưu HTML cho thành viên %s từ URL: %s. Số lần thất bại liên tiếp: %d",
+                                 member_id, member_detail_url, consecutive_member_failures)
                 else:
+                    progress.add("saved")
                     consecutive_member_failures = 0
+            progress.finish()
         return all_members_crawled_successfully
 
-    soup = BeautifulSoup(html_content, 'html.parser')
+    with tracing.span("parse pha_he", family_id=family_id):
+        soup = BeautifulSoup(html_content, 'html.parser')
 
     member_base_url = "https://vietnamgiapha.com/XemChiTietTungNguoi/"
     
@@ -162,11 +190,13 @@ async def crawl_member_details(family_id: str, members_output_dir: str, pha_he_h
     # Find all <a> tags that have an href containing "javascript:o("
     links = soup.find_all('a', href=re.compile(r'javascript:o\(\d+,\d+\)'))
     print(f"Found {len(links)} member links in {pha_he_html_path}.")
+    budget.check_members(len(links))
 
     async with aiohttp.ClientSession() as session: # Use an aiohttp ClientSession for persistent connection
         all_members_crawled_successfully = True
         consecutive_member_failures = 0
         MEMBER_FAILURE_THRESHOLD = 100
+        progress = log_setup.ProgressLog(logger, f"Family {family_id}: thu thập thành viên", total=len(links))
         
         for link in links:
             if consecutive_member_failures >= MEMBER_FAILURE_THRESHOLD:
@@ -175,31 +205,35 @@ async def crawl_member_details(family_id: str, members_output_dir: str, pha_he_h
                 break
 
             href = link.get('href')
-            print(f"Checking href: {href}")
             match = re.search(r'o\((\d+),(\d+)\)', href)
             if match:
-                print(f"Match found for href: {href}")
                 extracted_family_id = match.group(1)
                 member_id = match.group(2)
                 
                 # Construct the output file path for this member
                 output_filepath = os.path.join(members_output_dir, f"{member_id}.html")
                 
-                if not force and check_file_exists(output_filepath, f"Thành viên {member_id} HTML"):
+                if not force and os.path.exists(output_filepath):
+                    logger.debug("Thành viên %s HTML đã tồn tại: %s. Bỏ qua.", member_id, output_filepath)
+                    progress.add("skipped")
                     consecutive_member_failures = 0 # Reset on existing file (implies previous success)
                     continue # Skip if file already exists
                 
-                print(f"Processing member_id: {member_id} from family_id: {extracted_family_id}")
+                logger.debug("Processing member_id: %s from family_id: %s (href: %s)", member_id, extracted_family_id, href)
                 # Construct the full member detail URL
                 member_detail_url = f"{member_base_url}{extracted_family_id}/{member_id}/giapha.html"
                 
-                success = await _crawl_and_save_html(session, member_detail_url, output_filepath)
+                success = await _crawl_and_save_html(session, member_detail_url, output_filepath, progress)
                 if not success:
                     consecutive_member_failures += 1
                     all_members_crawled_successfully = False
-                    print(f"Không thể thu thập và lưu HTML cho thành viên {member_id} từ URL: {member_detail_url}. Số lần thất bại liên tiếp: {consecutive_member_failures}")
+                    progress.add("failed")
+                    logger.debug("Không thể thu thập và lưu HTML cho thành viên %s từ URL: %s. Số lần thất bại liên tiếp: %d",
+                                 member_id, member_detail_url, consecutive_member_failures)
                 else:
+                    progress.add("saved")
                     consecutive_member_failures = 0
+        progress.finish()
     return all_members_crawled_successfully
 
 if __name__ == "__main__":
@@ -209,7 +243,9 @@ if __name__ == "__main__":
     parser.add_argument("members_output_dir", type=str, help="Thư mục đầu ra cho các file HTML thành viên.")
     parser.add_argument("pha_he_html_path", type=str, help="Đường dẫn đến file pha_he.html chứa các link thành viên.")
     parser.add_argument("--force", action="store_true", help="Buộc thu thập lại dữ liệu ngay cả khi file đã tồn tại.")
+    log_setup.add_logging_arguments(parser)
     
     args = parser.parse_args()
+    log_setup.setup_from_args(args)
     
     asyncio.run(crawl_member_details(args.family_id, args.members_output_dir, args.pha_he_html_path, args.force))
\ No newline at end of file
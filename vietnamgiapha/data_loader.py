@@ -2,6 +2,7 @@
 import json
 import logging
 import os
+import sqlite3
 from typing import Optional
 
 logger = logging.getLogger(__name__)
@@ -14,7 +15,7 @@ def load_json_file(file_path: str) -> Optional[dict]:
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
-        logger.info(f"Đã tải và xử lý '{file_path}'.")
+        logger.debug("Đã tải và xử lý '%s'.", file_path)
         return data
     except FileNotFoundError:
         logger.warning(f"Không tìm thấy file tại '{file_path}'.")
@@ -44,3 +45,53 @@ def load_member_data(member_json_file_path: str) -> Optional[dict]:
     Tải dữ liệu thành viên từ file JSON cụ thể.
     """
     return load_json_file(member_json_file_path)
+
+
+# --- Truy vấn kho dữ liệu SQLite (xem data_store.py) ---
+
+def _rows_to_dicts(rows) -> list:
+    return [json.loads(row["data"]) for row in rows]
+
+def get_family_from_store(conn: sqlite3.Connection, family_id: str) -> Optional[dict]:
+    """
+    Lấy dữ liệu gia đình từ kho theo family ID (tên thư mục).
+    """
+    row = conn.execute("SELECT data FROM families WHERE family_id = ?", (family_id,)).fetchone()
+    return json.loads(row["data"]) if row else None
+
+def get_member_by_code_from_store(conn: sqlite3.Connection, member_code: str) -> Optional[dict]:
+    """
+    Tìm một thành viên theo mã (ví dụ: 'GPVN-1-2') trên toàn bộ các gia đình.
+    """
+    row = conn.execute("SELECT data FROM members WHERE code = ? LIMIT 1", (member_code,)).fetchone()
+    return json.loads(row["data"]) if row else None
+
+def get_members_by_family_from_store(conn: sqlite3.Connection, family_id: str) -> list:
+    """
+    Lấy tất cả thành viên của một gia đình, sắp xếp theo đời rồi theo thứ tự con.
+    """
+    rows = conn.execute(
+        "SELECT data FROM members WHERE family_id = ? ORDER BY generation, birth_order, member_file",
+        (family_id,)
+    ).fetchall()
+    return _rows_to_dicts(rows)
+
+def get_members_by_generation_from_store(conn: sqlite3.Connection, family_id: str, generation: int) -> list:
+    """
+    Lấy tất cả thành viên thuộc đời thứ `generation` của một gia đình.
+    """
+    rows = conn.execute(
+        "SELECT data FROM members WHERE family_id = ? AND generation = ? ORDER BY birth_order, member_file",
+        (family_id, generation)
+    ).fetchall()
+    return _rows_to_dicts(rows)
+
+def get_children_by_father_code_from_store(conn: sqlite3.Connection, father_code: str) -> list:
+    """
+    Lấy tất cả thành viên có mã cha (father.code) là `father_code`.
+    """
+    rows = conn.execute(
+        "SELECT data FROM members WHERE father_code = ? ORDER BY birth_order, member_file",
+        (father_code,)
+    ).fetchall()
+    return _rows_to_dicts(rows)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import sqlite3
+import logging
+import argparse
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join("output", "giapha.sqlite")
+
+# Các cột được tách ra từ JSON để đánh chỉ mục; toàn bộ bản ghi vẫn được giữ trong cột `data`.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS families (
+    family_id TEXT PRIMARY KEY,
+    code TEXT,
+    name TEXT,
+    address TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS members (
+    family_id TEXT NOT NULL,
+    member_file TEXT NOT NULL,
+    code TEXT,
+    last_name TEXT,
+    first_name TEXT,
+    gender TEXT,
+    generation INTEGER,
+    birth_order INTEGER,
+    is_root INTEGER,
+    is_deceased INTEGER,
+    father_code TEXT,
+    mother_code TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (family_id, member_file)
+);
+
+CREATE INDEX IF NOT EXISTS idx_members_code ON members (code);
+CREATE INDEX IF NOT EXISTS idx_members_family_generation ON members (family_id, generation);
+CREATE INDEX IF NOT EXISTS idx_members_father_code ON members (father_code);
+"""
+
+MEMBER_INSERT_SQL = """
+INSERT OR REPLACE INTO members (
+    family_id, member_file, code, last_name, first_name, gender, generation, birth_order,
+    is_root, is_deceased, father_code, mother_code, data
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+MEMBER_DELETE_FAMILY_SQL = "DELETE FROM members WHERE family_id = ?"
+
+FAMILY_INSERT_SQL = """
+INSERT OR REPLACE INTO families (family_id, code, name, address, data) VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def open_store(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    """
+    Mở (hoặc tạo mới) kho dữ liệu SQLite và đảm bảo schema cùng các chỉ mục đã tồn tại.
+    """
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA_SQL)
+    return conn
+
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None and value != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _relative_code(person) -> Optional[str]:
+    if isinstance(person, dict):
+        return person.get("code") or None
+    return None
+
+
+def _member_row(family_id: str, member_file: str, member_data: dict) -> tuple:
+    return (
+        family_id,
+        member_file,
+        member_data.get("code") or None,
+        member_data.get("lastName"),
+        member_data.get("firstName"),
+        member_data.get("gender"),
+        _as_int(member_data.get("generation")),
+        _as_int(member_data.get("order")),
+        1 if member_data.get("isRoot") else 0,
+        1 if member_data.get("isDeceased") else 0,
+        _relative_code(member_data.get("father")),
+        _relative_code(member_data.get("mother")),
+        json.dumps(member_data, ensure_ascii=False),
+    )
+
+
+def bulk_load_members(conn: sqlite3.Connection, family_id: str, members: Iterable[tuple],
+                      replace_family: bool = False) -> int:
+    """
+    Nạp hàng loạt thành viên của một gia đình trong một transaction.
+    `members` là các cặp (member_file, member_data). Trả về số thành viên đã nạp.
+    Với replace_family=True (nạp cả gia đình), các thành viên cũ của gia đình bị xoá trong cùng transaction,
+    để thành viên đã bị đổi tên hoặc xoá khỏi output không còn sót lại trong kho.
+    """
+    rows = [_member_row(family_id, member_file, member_data) for member_file, member_data in members if member_data]
+    with conn:
+        if replace_family:
+            conn.execute(MEMBER_DELETE_FAMILY_SQL, (family_id,))
+        conn.executemany(MEMBER_INSERT_SQL, rows)
+    return len(rows)
+
+
+def upsert_family(conn: sqlite3.Connection, family_id: str, family_data: dict):
+    """Ghi (hoặc ghi đè) thông tin một gia đình."""
+    with conn:
+        conn.execute(FAMILY_INSERT_SQL, (
+            family_id,
+            family_data.get("code"),
+            family_data.get("name"),
+            family_data.get("address"),
+            json.dumps(family_data, ensure_ascii=False),
+        ))
+
+
+def load_family_folder(conn: sqlite3.Connection, family_folder_path: str, family_id: str) -> int:
+    """
+    Nạp family.json và data/members/*.json của một thư mục gia đình đã trích xuất vào kho.
+    Trả về số thành viên đã nạp.
+    """
+    # Import tại đây để tránh vòng lặp import giữa data_loader và data_store.
+    from vietnamgiapha import data_loader
+
+    family_data = data_loader.load_family_data(family_folder_path)
+    if family_data:
+        upsert_family(conn, family_id, family_data)
+
+    members_dir = os.path.join(family_folder_path, "data", "members")
+    if not os.path.isdir(members_dir):
+        return 0
+    members = []
+    for member_json_filename in sorted(os.listdir(members_dir)):
+        if member_json_filename.endswith(".json"):
+            member_data = data_loader.load_member_data(os.path.join(members_dir, member_json_filename))
+            members.append((os.path.splitext(member_json_filename)[0], member_data))
+    return bulk_load_members(conn, family_id, members, replace_family=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nạp dữ liệu đã trích xuất (output/<id>/data) vào kho SQLite có chỉ mục.")
+    parser.add_argument("--output_base_dir", type=str, default="output",
+                        help="Thư mục gốc chứa các thư mục gia đình (ví dụ: 'output/1').")
+    parser.add_argument("--db_path", type=str, default=DEFAULT_DB_PATH, help="Đường dẫn file SQLite.")
+    parser.add_argument("--family_id", type=str, help="Chỉ nạp một family ID cụ thể.")
+    args = parser.parse_args()
+
+    if args.family_id:
+        family_ids = [args.family_id]
+    else:
+        family_ids = sorted((entry for entry in os.listdir(args.output_base_dir)
+                             if entry.isdigit() and os.path.isdir(os.path.join(args.output_base_dir, entry))), key=int)
+
+    conn = open_store(args.db_path)
+    try:
+        total_members = 0
+        for family_id in family_ids:
+            total_members += load_family_folder(conn, os.path.join(args.output_base_dir, family_id), family_id)
+        print(f"Đã nạp {len(family_ids)} gia đình và {total_members} thành viên vào '{args.db_path}'.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import argparse
+from typing import Iterator, Optional
+
+from vietnamgiapha import data_loader
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_ROWS_PER_FILE = 500000
+SUPPORTED_FORMATS = ("parquet", "arrow")
+
+# Các trường người "rút gọn" (cha, mẹ, anh em, con cái) mà extractor sinh ra.
+PERSON_STUB_FIELDS = ["lastName", "firstName", "code", "gender"]
+SPOUSE_FIELDS = ["code", "lastName", "firstName", "gender", "dateOfBirth", "dateOfDeath", "biography"]
+
+# Các trường extractor rule-based sinh thêm ngoài OUTPUT_SCHEMA.
+EXTRA_MEMBER_FIELDS = {
+    "isDeceased": False,
+    "siblings": [],
+    "children": [],
+}
+
+
+def _require_pyarrow():
+    """Import pyarrow khi cần, để các lệnh khác không phải phụ thuộc vào nó."""
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        print("Lỗi: cần cài đặt 'pyarrow' để xuất dữ liệu dạng Parquet/Arrow (pip install pyarrow).", file=sys.stderr)
+        sys.exit(1)
+    return pa
+
+
+def _person_stub_type(pa):
+    return pa.struct([(field, pa.string()) for field in PERSON_STUB_FIELDS])
+
+
+def _arrow_type_for(pa, key: str, default):
+    """Suy ra kiểu Arrow của một trường từ giá trị mặc định trong schema."""
+    if key in ("father", "mother"):
+        return _person_stub_type(pa)
+    if key == "spouses":
+        return pa.list_(pa.struct([(field, pa.string()) for field in SPOUSE_FIELDS]))
+    if key in ("siblings", "children"):
+        return pa.list_(_person_stub_type(pa))
+    if isinstance(default, bool):
+        return pa.bool_()
+    if isinstance(default, int):
+        return pa.int32()
+    if isinstance(default, list):
+        return pa.list_(pa.string())
+    return pa.string() # str hoặc None (ngày tháng, nơi chốn) đều lưu dạng chuỗi
+
+
+def build_member_schema(pa):
+    """Schema Arrow cố định cho thành viên, suy ra từ OUTPUT_SCHEMA."""
+    # Nạp ở đây: module extractor kéo theo bs4/lxml, không cần cho các lệnh chỉ xem --help.
+    from vietnamgiapha.extraction.rule_based.extract_member import OUTPUT_SCHEMA
+    fields = [pa.field("familyId", pa.string(), nullable=False)]
+    member_fields = dict(OUTPUT_SCHEMA)
+    member_fields.update(EXTRA_MEMBER_FIELDS)
+    for key, default in member_fields.items():
+        fields.append(pa.field(key, _arrow_type_for(pa, key, default)))
+    return pa.schema(fields)
+
+
+def build_family_schema(pa):
+    """Schema Arrow cố định cho gia đình, suy ra từ FINAL_OUTPUT_SCHEMA."""
+    from vietnamgiapha.extraction.rule_based.extract_family import FINAL_OUTPUT_SCHEMA
+    fields = [pa.field("familyId", pa.string(), nullable=False)]
+    for key, default in FINAL_OUTPUT_SCHEMA.items():
+        fields.append(pa.field(key, _arrow_type_for(pa, key, default)))
+    return pa.schema(fields)
+
+
+def _coerce_string(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def _coerce_int(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None and value != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _coerce_bool(value) -> Optional[bool]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+def _coerce_struct(value, fields: list) -> Optional[dict]:
+    if not isinstance(value, dict):
+        return None
+    return {field: _coerce_string(value.get(field)) for field in fields}
+
+
+def _coerce_value(pa, arrow_type, value):
+    """Ép giá trị JSON (có thể do LLM sinh ra, sai kiểu) về kiểu Arrow của cột."""
+    if pa.types.is_struct(arrow_type):
+        return _coerce_struct(value, [f.name for f in arrow_type])
+    if pa.types.is_list(arrow_type):
+        if not isinstance(value, list):
+            return []
+        item_type = arrow_type.value_type
+        if pa.types.is_struct(item_type):
+            item_fields = [f.name for f in item_type]
+            return [_coerce_struct(item, item_fields) for item in value if isinstance(item, dict)]
+        return [_coerce_string(item) for item in value]
+    if pa.types.is_boolean(arrow_type):
+        return _coerce_bool(value)
+    if pa.types.is_integer(arrow_type):
+        return _coerce_int(value)
+    return _coerce_string(value)
+
+
+def _to_row(pa, schema, family_id: str, data: dict) -> dict:
+    row = {"familyId": family_id}
+    for field in schema:
+        if field.name == "familyId":
+            continue
+        row[field.name] = _coerce_value(pa, field.type, data.get(field.name))
+    return row
+
+
+def list_family_ids(output_base_dir: str, start_id: Optional[int] = None, end_id: Optional[int] = None) -> list:
+    """Liệt kê các thư mục gia đình (output/<id>) theo thứ tự số."""
+    try:
+        entries = os.listdir(output_base_dir)
+    except FileNotFoundError:
+        print(f"Lỗi: Thư mục '{output_base_dir}' không tồn tại.")
+        return []
+    family_ids = []
+    for entry_name in entries:
+        if not entry_name.isdigit() or not os.path.isdir(os.path.join(output_base_dir, entry_name)):
+            continue
+        if start_id is not None and int(entry_name) < start_id:
+            continue
+        if end_id is not None and int(entry_name) > end_id:
+            continue
+        family_ids.append(entry_name)
+    return sorted(family_ids, key=int)
+
+
+def iter_member_records(output_base_dir: str, family_ids: list) -> Iterator[tuple]:
+    """Duyệt lần lượt (family_id, member_data) từ data/members/*.json của từng gia đình."""
+    for family_id in family_ids:
+        members_dir = os.path.join(output_base_dir, family_id, "data", "members")
+        if not os.path.isdir(members_dir):
+            continue
+        for member_json_filename in sorted(os.listdir(members_dir)):
+            if not member_json_filename.endswith(".json"):
+                continue
+            member_data = data_loader.load_member_data(os.path.join(members_dir, member_json_filename))
+            if member_data:
+                yield family_id, member_data
+
+
+def iter_family_records(output_base_dir: str, family_ids: list) -> Iterator[tuple]:
+    """Duyệt lần lượt (family_id, family_data) từ data/family.json của từng gia đình."""
+    for family_id in family_ids:
+        family_data = data_loader.load_family_data(os.path.join(output_base_dir, family_id))
+        if family_data:
+            yield family_id, family_data
+
+
+class _PartitionedWriter:
+    """
+    Ghi các record batch vào một chuỗi file part-NNNNN.<ext>, chuyển sang file mới
+    sau mỗi rows_per_file dòng. Chỉ giữ trong bộ nhớ một batch tại một thời điểm.
+    """
+
+    def __init__(self, pa, schema, dest_dir: str, file_format: str, rows_per_file: int):
+        self.pa = pa
+        self.schema = schema
+        self.dest_dir = dest_dir
+        self.file_format = file_format
+        self.rows_per_file = rows_per_file
+        self.part_index = 0
+        self.rows_in_part = 0
+        self.total_rows = 0
+        self.files = []
+        self._writer = None
+        os.makedirs(dest_dir, exist_ok=True)
+
+    def _open(self):
+        extension = "parquet" if self.file_format == "parquet" else "arrow"
+        path = os.path.join(self.dest_dir, f"part-{self.part_index:05d}.{extension}")
+        if self.file_format == "parquet":
+            self._writer = self.pa.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self._writer = self.pa.ipc.new_file(path, self.schema)
+        self.files.append(path)
+        self.part_index += 1
+        self.rows_in_part = 0
+
+    def write_rows(self, rows: list):
+        if not rows:
+            return
+        if self._writer is None:
+            self._open()
+        batch = self.pa.RecordBatch.from_pylist(rows, schema=self.schema)
+        if self.file_format == "parquet":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write(batch)
+        self.rows_in_part += len(rows)
+        self.total_rows += len(rows)
+        if self.rows_in_part >= self.rows_per_file:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _export_records(pa, schema, records: Iterator[tuple], dest_dir: str, file_format: str,
+                    batch_size: int, rows_per_file: int) -> _PartitionedWriter:
+    writer = _PartitionedWriter(pa, schema, dest_dir, file_format, rows_per_file)
+    rows = []
+    try:
+        for family_id, data in records:
+            rows.append(_to_row(pa, schema, family_id, data))
+            if len(rows) >= batch_size:
+                writer.write_rows(rows)
+                rows = []
+        writer.write_rows(rows)
+    finally:
+        writer.close()
+    return writer
+
+
+def export_columnar(output_base_dir: str, dest_dir: str, file_format: str = "parquet",
+                    start_id: Optional[int] = None, end_id: Optional[int] = None,
+                    batch_size: int = DEFAULT_BATCH_SIZE, rows_per_file: int = DEFAULT_ROWS_PER_FILE) -> dict:
+    """
+    Xuất toàn bộ thành viên và gia đình đã trích xuất thành các file Parquet/Arrow IPC.
+    Kết quả nằm trong <dest_dir>/members/ và <dest_dir>/families/.
+    Trả về số dòng đã ghi cho mỗi bảng.
+    """
+    if file_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"Định dạng không hỗ trợ: {file_format}. Chọn một trong {SUPPORTED_FORMATS}.")
+    pa = _require_pyarrow()
+
+    family_ids = list_family_ids(output_base_dir, start_id, end_id)
+    print(f"Đang xuất dữ liệu của {len(family_ids)} gia đình từ '{output_base_dir}' sang '{dest_dir}' ({file_format}).")
+
+    member_writer = _export_records(pa, build_member_schema(pa), iter_member_records(output_base_dir, family_ids),
+                                    os.path.join(dest_dir, "members"), file_format, batch_size, rows_per_file)
+    family_writer = _export_records(pa, build_family_schema(pa), iter_family_records(output_base_dir, family_ids),
+                                    os.path.join(dest_dir, "families"), file_format, batch_size, rows_per_file)
+
+    print(f"Đã ghi {member_writer.total_rows} thành viên vào {len(member_writer.files)} file.")
+    print(f"Đã ghi {family_writer.total_rows} gia đình vào {len(family_writer.files)} file.")
+    return {"members": member_writer.total_rows, "families": family_writer.total_rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất dữ liệu thành viên/gia đình đã trích xuất sang Parquet hoặc Arrow IPC.")
+    parser.add_argument("--output_base_dir", type=str, default="output",
+                        help="Thư mục gốc chứa các thư mục gia đình (ví dụ: 'output/1').")
+    parser.add_argument("--dest", type=str, default="export",
+                        help="Thư mục đích cho các file Parquet/Arrow.")
+    parser.add_argument("--format", type=str, choices=SUPPORTED_FORMATS, default="parquet",
+                        help="Định dạng đầu ra: parquet hoặc arrow (Arrow IPC).")
+    parser.add_argument("--start_id", type=int, help="Chỉ xuất từ family ID này (bao gồm).")
+    parser.add_argument("--end_id", type=int, help="Chỉ xuất đến family ID này (bao gồm).")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Số dòng giữ trong bộ nhớ trước khi ghi ra một record batch.")
+    parser.add_argument("--rows_per_file", type=int, default=DEFAULT_ROWS_PER_FILE,
+                        help="Số dòng tối đa trong mỗi file part.")
+    args = parser.parse_args()
+
+    if args.batch_size < 1 or args.rows_per_file < 1:
+        print("Lỗi: --batch_size và --rows_per_file phải là số nguyên dương.")
+        sys.exit(1)
+
+    export_columnar(args.output_base_dir, args.dest, args.format, args.start_id, args.end_id,
+                    args.batch_size, args.rows_per_file)
+
+
+if __name__ == "__main__":
+    main()
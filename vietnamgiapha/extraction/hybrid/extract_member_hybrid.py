@@ -0,0 +1,118 @@
+import re
+import json
+
+from ..rule_based import extract_member
+from ..llm_based import extract_member_ollama
+
+# Các trường được kiểm tra độ đầy đủ sau khi trích xuất bằng luật, theo thứ tự gộp cố định.
+CHECKED_FIELDS = ["lastName", "firstName", "gender", "generation", "order", "dateOfBirth", "dateOfDeath"]
+
+# Nhãn HTML tương ứng với các trường ngày; nếu có giá trị thô mà normalize_date không hiểu thì gửi cho LLM.
+DATE_LABELS = {"dateOfBirth": "Ngày sinh", "dateOfDeath": "Ngày mất"}
+UNKNOWN_VALUES = ["chưa rõ", "không rõ"]
+# Ngày mất theo âm lịch (ví dụ: "Ngày kỵ 12/5 Âm Lịch", "năm Kỷ Tỵ") không quy đổi được sang dương lịch;
+# giữ nguyên chuỗi vào dateOfDeathLunar thay vì gửi cho LLM.
+LUNAR_DATE_PATTERN = re.compile(r'âm lịch|\b(AL|ÂL)\b|năm (Giáp|Ất|Bính|Đinh|Mậu|Kỷ|Canh|Tân|Nhâm|Quý)\b', re.IGNORECASE)
+
+
+def find_missing_fields(member_data: dict, raw_values: dict) -> list:
+    """
+    Trả về các trường mà bộ trích xuất theo luật để trống hoặc không phân tích được,
+    theo thứ tự của CHECKED_FIELDS.
+    """
+    missing = set()
+    if not member_data.get("lastName"):
+        # Họ và tên được tách cùng nhau, nên hỏi lại cả hai.
+        missing.update(["lastName", "firstName"])
+    if not member_data.get("gender"):
+        missing.add("gender")
+    if not member_data.get("generation"):
+        missing.add("generation")
+    if not member_data.get("order") and raw_values.get("Là con thứ"):
+        missing.add("order")
+    for field, label in DATE_LABELS.items():
+        raw_value = raw_values.get(label, "")
+        if field == "dateOfDeath" and LUNAR_DATE_PATTERN.search(raw_value):
+            continue
+        if raw_value and raw_value.lower() not in UNKNOWN_VALUES and member_data.get(field) is None:
+            missing.add(field)
+    return [field for field in CHECKED_FIELDS if field in missing]
+
+
+def completeness_score(missing_fields: list) -> float:
+    """1.0 khi mọi trường được kiểm tra đều đã có giá trị."""
+    return 1 - len(missing_fields) / len(CHECKED_FIELDS)
+
+
+def _normalize_llm_date(value):
+    """Đưa ngày do LLM trả về (ISO 8601 hoặc DD/MM/YYYY) về định dạng YYYY-MM-DD của bộ trích xuất theo luật."""
+    if not isinstance(value, str) or not value.strip():
+        return None
+    match = re.match(r'(\d{4})-(\d{2})-(\d{2})', value.strip())
+    if match:
+        return "-".join(match.groups())
+    return extract_member.normalize_date(value)
+
+
+def merge_llm_fields(member_data: dict, llm_data: dict, fields: list, family_id: str, member_filename: str) -> list:
+    """
+    Gộp các trường do LLM trả về vào kết quả theo luật (sửa trực tiếp `member_data`).
+    Chỉ các trường trong `fields` được ghi, và chỉ khi LLM trả về giá trị hợp lệ; giá trị theo luật
+    không bao giờ bị ghi đè. Trả về danh sách trường đã được bổ sung.
+    """
+    filled = []
+    if not isinstance(llm_data, dict):
+        return filled
+    for field in CHECKED_FIELDS:
+        if field not in fields:
+            continue
+        value = llm_data.get(field)
+        if field in DATE_LABELS:
+            value = _normalize_llm_date(value)
+        elif field in ("generation", "order"):
+            try:
+                value = int(value) if value is not None else None
+            except (TypeError, ValueError):
+                value = None
+            if not value or value < 0:
+                value = None
+        else:
+            value = extract_member.clean_text(value) if isinstance(value, str) else None
+        if value:
+            member_data[field] = value
+            filled.append(field)
+
+    if member_data.get("dateOfDeath"):
+        member_data["isDeceased"] = True
+    if not member_data.get("code") and member_data.get("lastName") and member_data.get("firstName") and member_data.get("gender"):
+        member_data["code"] = extract_member.generate_member_code(folder_name=family_id, member_filename=member_filename)
+    return filled
+
+
+def extract_rule_based(html_content: str, family_id: str, member_filename: str) -> tuple:
+    """Chạy bộ trích xuất theo luật, trả về (member_data, missing_fields)."""
+    raw_values = {}
+    member_data = json.loads(extract_member.parse_family_html(html_content, family_id=family_id,
+                                                              member_filename=member_filename, raw_values=raw_values))
+    raw_death = raw_values.get("Ngày mất", "")
+    if not member_data.get("dateOfDeathLunar") and LUNAR_DATE_PATTERN.search(raw_death):
+        member_data["dateOfDeathLunar"] = raw_death
+    return member_data, find_missing_fields(member_data, raw_values)
+
+
+async def extract_member_hybrid(client, html_content: str, family_id: str, member_id: str, cache=None,
+                                options: dict = None, avoid_urls: set = None) -> tuple:
+    """
+    Trích xuất theo luật trước; chỉ khi còn trường thiếu mới gửi prompt rút gọn (chỉ gồm các trường đó)
+    cho Ollama rồi gộp kết quả. Trả về (member_data, missing_fields, filled_fields).
+    """
+    member_filename = f"{member_id}.html"
+    member_data, missing_fields = extract_rule_based(html_content, family_id, member_filename)
+    if not missing_fields:
+        return member_data, [], []
+
+    prompt = extract_member_ollama.build_member_fields_prompt(html_content, missing_fields, page=f"{family_id}/{member_id}")
+    llm_data = await extract_member_ollama.generate_json_cached(
+        client, prompt, extract_member_ollama.MEMBER_FIELDS_PROMPT_VERSION, cache, options, avoid_urls)
+    filled_fields = merge_llm_fields(member_data, llm_data, missing_fields, family_id, member_filename)
+    return member_data, missing_fields, filled_fields
@@ -2,20 +2,27 @@ import json
 import sys
 import requests
 import os
-from ..utils.utils import remove_html_tag_attributes, remove_specific_html_tags # Import the utility function
+from .prompt_compaction import compact_for_prompt, compaction_stats
+from .llm_cache import get_default_cache
+from ...utils import tracing
+from .ollama_client import OllamaExtractionError, generate_sync, OLLAMA_MAX_RESPONSE_CHARS
 
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
+# Tăng số phiên bản mỗi khi sửa prompt hoặc cấu trúc kết quả mong đợi, để không dùng lại phản hồi cũ trong cache.
+FAMILY_PROMPT_VERSION = "2"
+# Thông tin gia phả có các đoạn văn dài (phả ký, thủy tổ, tộc ước) nên cho phép phản hồi dài hơn một thành viên.
+FAMILY_MAX_RESPONSE_CHARS = OLLAMA_MAX_RESPONSE_CHARS * 4
 
 def extract_info_with_ollama(html_content: str, model_name: str):
     """
     Sends HTML content to Ollama for structured data extraction according to schema-family.txt.
+    Raises OllamaExtractionError (with a `reason`) on connection, HTTP or JSON errors.
     """
-    # Clean the HTML content by removing all tag attributes
-    cleaned_html_content = remove_html_tag_attributes(html_content)
-    # Further clean by removing specific tags (a, b, i) while keeping their text content
-    cleaned_html_content = remove_specific_html_tags(cleaned_html_content, ['a', 'b', 'i'])
+    # Compact the HTML into "label: value" lines in a single parse (replaces attribute stripping + unwrapping a/b/i)
+    page_content = compact_for_prompt(html_content, page="giapha")
+    print(f"Rút gọn nội dung: {compaction_stats.page_summary('giapha')}")
 
-    prompt = f"""Bạn là một chuyên gia phân tích dữ liệu gia phả. Nhiệm vụ của bạn là trích xuất thông tin từ nội dung HTML được cung cấp về thông tin chung của gia phả.
+    prompt = f"""Bạn là một chuyên gia phân tích dữ liệu gia phả. Nhiệm vụ của bạn là trích xuất thông tin từ nội dung trang được cung cấp về thông tin chung của gia phả.
 Hãy trích xuất các thông tin sau và trả về dưới dạng JSON, tuân thủ chính xác cấu trúc và các trường sau:
 
 {{
@@ -38,49 +45,54 @@ Nếu không tìm thấy thông tin cho một trường nào đó, hãy sử d
 
 Lưu ý quan trọng: KHÔNG trích xuất bất kỳ thông tin nào từ các phần có tiêu đề "Các anh em, dâu rể:" và "Con cái:". Bỏ qua hoàn toàn các phần này.
 
-Nội dung HTML:
+Nội dung trang (mỗi dòng một cặp "nhãn: giá trị", tiêu đề mục nằm trên dòng riêng):
 ---
-{cleaned_html_content}
+{page_content}
 ---
 
 Hãy trả về CHỈ JSON hợp lệ, không có bất kỳ văn bản bổ sung nào.
 """
 
-    headers = {"Content-Type": "application/json"}
+    generated_text = ""
+    cache = get_default_cache()
+    if cache is not None:
+        cached_text = cache.get(model_name, FAMILY_PROMPT_VERSION, prompt)
+        if cached_text is not None:
+            print("Dùng phản hồi đã lưu trong cache LLM.")
+            return json.loads(cached_text)
+
     data = {
         "model": model_name,
         "prompt": prompt,
-        "stream": False,
         "format": "json"
     }
 
     try:
-        response = requests.post(OLLAMA_API_URL, headers=headers, json=data)
-        response.raise_for_status() # Raise an exception for HTTP errors
-        
-        result = response.json()
-        generated_text = result.get("response", "").strip()
+        # Streams the answer and stops early on invalid JSON, excessive length or the deadline (see ollama_client).
+        generated_text = generate_sync(OLLAMA_API_URL, data, max_chars=FAMILY_MAX_RESPONSE_CHARS)
         
         # Ollama's format="json" sometimes wraps the JSON in markdown code block.
         if generated_text.startswith("```json") and generated_text.endswith("```"):
             generated_text = generated_text[len("```json"):-len("```")].strip()
 
-        return json.loads(generated_text)
+        extracted_data = json.loads(generated_text)
+        if cache is not None:
+            cache.put(model_name, FAMILY_PROMPT_VERSION, prompt, generated_text)
+        return extracted_data
 
+    except OllamaExtractionError:
+        raise
     except requests.exceptions.ConnectionError as e:
-        print(f"Lỗi kết nối đến Ollama API tại {OLLAMA_API_URL}. Vui lòng đảm bảo Ollama đang chạy.", file=sys.stderr)
-        print(e, file=sys.stderr)
-        sys.exit(1)
+        raise OllamaExtractionError("connection", f"Lỗi kết nối đến Ollama API tại {OLLAMA_API_URL}. Vui lòng đảm bảo Ollama đang chạy. {e}") from e
+    except requests.exceptions.Timeout as e:
+        raise OllamaExtractionError("timeout", f"Hết thời gian chờ Ollama API tại {OLLAMA_API_URL}. {e}") from e
     except requests.exceptions.HTTPError as e:
-        print(f"Lỗi HTTP từ Ollama API: {e}", file=sys.stderr)
-        sys.exit(1)
+        status = e.response.status_code if e.response is not None else "unknown"
+        raise OllamaExtractionError(f"http_{status}", f"Lỗi HTTP từ Ollama API: {e}") from e
     except json.JSONDecodeError as e:
-        print(f"Lỗi khi giải mã JSON từ phản hồi của Ollama: {e}", file=sys.stderr)
-        print(f"Phản hồi nhận được:\n{generated_text}", file=sys.stderr)
-        sys.exit(1)
+        raise OllamaExtractionError("invalid_json", f"Lỗi khi giải mã JSON từ phản hồi của Ollama: {e}\nPhản hồi nhận được:\n{generated_text}") from e
     except Exception as e:
-        print(f"Lỗi không xác định khi gọi Ollama API: {e}", file=sys.stderr)
-        sys.exit(1)
+        raise OllamaExtractionError(type(e).__name__, f"Lỗi không xác định khi gọi Ollama API: {e}") from e
 
 
 def extract_giapha_info_ollama(html_file_path: str, output_json_file_path: str, model_name: str):
@@ -114,5 +126,6 @@ if __name__ == '__main__':
     input_html_file = sys.argv[1]
     output_json_file = sys.argv[2]
     ollama_model = sys.argv[3]
+    tracing.configure_from_env()
 
     extract_giapha_info_ollama(input_html_file, output_json_file, ollama_model)
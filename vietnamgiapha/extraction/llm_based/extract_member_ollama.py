@@ -2,25 +2,40 @@ import json
 import sys
 import requests
 import os
-from ..utils.utils import remove_html_tag_attributes # Import the utility function
+from .prompt_compaction import compact_for_prompt, compaction_stats
+from .llm_cache import get_default_cache
+from .ollama_client import OllamaExtractionError, generate_sync
 
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:8b") # Default model, can be overridden
+# Bump whenever the prompt template or its expected output changes, so cached responses are not reused.
+MEMBER_PROMPT_VERSION = "2"
+MEMBER_FIELDS_PROMPT_VERSION = "2"
+MEMBER_BATCH_PROMPT_VERSION = "1"
 
-def extract_info_with_ollama(html_content: str, family_id: str, member_id: str):
+# Field descriptions for the reduced prompt used by the hybrid router (same wording as the full prompt).
+MEMBER_FIELD_DESCRIPTIONS = {
+    "lastName": '"string", // Last name (e.g., Triết)',
+    "firstName": '"string", // Middle and first name (e.g., Minh)',
+    "gender": '"string", // Gender ("Nam", "Nữ", or "Không rõ") - use Vietnamese for consistency with source data.',
+    "generation": '"integer", // Số đời (ví dụ: từ "Đời thứ: 10" hãy trích xuất số 10). Nếu không tìm thấy, để giá trị null.',
+    "order": '"integer", // Thứ tự con cái. Nếu không đề cập trong HTML, để giá trị 0.',
+    "dateOfBirth": '"YYYY-MM-DDTHH:mm:ssZ", // Date of birth, ISO 8601 format. If only the year is available, use YYYY-01-01T00:00:00Z.',
+    "dateOfDeath": '"YYYY-MM-DDTHH:mm:ssZ", // Date of death, ISO 8601 format. If only the year is available, use YYYY-01-01T00:00:00Z.',
+    "dateOfDeathLunar": '"string", // Ngày mất âm lịch (nếu có định dạng ngày/tháng hoặc có từ "Âm Lịch", "AL").',
+    "placeOfBirth": '"string", // Place of birth',
+    "placeOfDeath": '"string", // Place of death',
+}
+
+def member_schema_block(code: str) -> str:
     """
-    Sends HTML content to Ollama for structured data extraction according to schema-member.txt.
+    The member JSON schema and field instructions shared by the single and batched prompts.
+    `code` is what the "code" field should contain (a concrete code or a format description).
     """
-    # Clean the HTML content by removing all tags
-    cleaned_html_content = remove_html_tag_attributes(html_content)
-
-    prompt = f"""You are a genealogy data analysis expert. Your task is to extract information about a family member from the provided HTML content.
-Extract the following information and return it as a JSON object, strictly adhering to the following structure and fields. For the "code" field, format it as "GPVN-M-{family_id}-{member_id}".
-
-{{
+    return f"""{{
   "lastName": "string", // Last name (e.g., Triết)
   "firstName": "string", // Middle and first name (e.g., Minh)
-  "code": "GPVN-M-{family_id}-{member_id}", // Member code, format: GPVN-M-<family_id>-<member_id>
+  "code": "{code}", // Member code, format: GPVN-M-<family_id>-<member_id>
   "nickname": "string", // Nickname (e.g., Lý Triết)
   "dateOfBirth": "YYYY-MM-DDTHH:mm:ssZ", // Date of birth, ISO 8601 format. If only the year is available, use YYYY-01-01T00:00:00Z.
   "dateOfDeath": "YYYY-MM-DDTHH:mm:ssZ", // Date of death, ISO 8601 format. If only the year is available, use YYYY-01-01T00:00:00Z.
@@ -61,51 +76,216 @@ Extract the following information and return it as a JSON object, strictly adher
   ]
 }}
 
-If information for a field is not found, use `null` or an empty string/array appropriate for the field's data type. For date fields, if only the year is available, use the YYYY-01-01T00:00:00Z format. For `dateOfDeathLunar`, extract the day/month string if the death date contains "Âm Lịch", "AL", or is in "day/month" format; otherwise, use `null`.
+If information for a field is not found, use `null` or an empty string/array appropriate for the field's data type. For date fields, if only the year is available, use the YYYY-01-01T00:00:00Z format. For `dateOfDeathLunar`, extract the day/month string if the death date contains "Âm Lịch", "AL", or is in "day/month" format; otherwise, use `null`."""
+
+def build_member_prompt(html_content: str, family_id: str, member_id: str) -> str:
+    """
+    Builds the member extraction prompt (schema-member.txt) for one member HTML page.
+    """
+    # Compact the HTML into "label: value" lines to keep the prompt short
+    page_content = compact_for_prompt(html_content, page=f"{family_id}/{member_id}")
+
+    return f"""You are a genealogy data analysis expert. Your task is to extract information about a family member from the provided page content.
+Extract the following information and return it as a JSON object, strictly adhering to the following structure and fields. For the "code" field, format it as "GPVN-M-{family_id}-{member_id}".
+
+{member_schema_block(f"GPVN-M-{family_id}-{member_id}")}
+
+Page content (one "label: value" per line, section headers on their own line):
+---
+{page_content}
+---
+
+Return ONLY valid JSON, with no additional text.
+"""
+
+
+def build_member_fields_prompt(html_content: str, fields: list, page: str = None) -> str:
+    """
+    Builds a reduced prompt asking only for `fields` (keys of MEMBER_FIELD_DESCRIPTIONS).
+    Used for members whose rule-based extraction left these fields empty or unparsed.
+    """
+    page_content = compact_for_prompt(html_content, page=page)
+    field_lines = "\n".join(f'  "{field}": {MEMBER_FIELD_DESCRIPTIONS[field]}' for field in fields)
+
+    return f"""You are a genealogy data analysis expert. Extract ONLY the following fields about the main person ("Người trong gia đình") from the provided page content and return them as a JSON object:
+
+{{
+{field_lines}
+}}
+
+If a field is not found, use `null`. Do not include any other fields.
 
-HTML Content:
+Page content (one "label: value" per line, section headers on their own line):
 ---
-{cleaned_html_content}
+{page_content}
 ---
 
 Return ONLY valid JSON, with no additional text.
 """
 
-    headers = {"Content-Type": "application/json"}
+
+def member_code(family_id: str, member_id: str) -> str:
+    return f"GPVN-M-{family_id}-{member_id}"
+
+
+def build_member_batch_prompt(pages: list) -> str:
+    """
+    Builds one prompt for several members. `pages` is a list of (family_id, member_id, html_content);
+    the answer is expected as a JSON object mapping each member code to its member object.
+    """
+    sections = []
+    for family_id, member_id, html_content in pages:
+        page_content = compact_for_prompt(html_content, page=f"{family_id}/{member_id}")
+        sections.append(f"=== MEMBER {member_code(family_id, member_id)} ===\n{page_content}")
+    codes = ", ".join(f'"{member_code(family_id, member_id)}"' for family_id, member_id, _ in pages)
+    members_content = "\n\n".join(sections)
+    schema_block = member_schema_block("GPVN-M-<family_id>-<member_id> (same as the MEMBER header)")
+
+    return f"""You are a genealogy data analysis expert. Your task is to extract information about {len(pages)} family members. Each member's page content starts with a line "=== MEMBER <code> ===".
+Return a JSON object whose keys are exactly the member codes {codes}, and whose value for each code is an object strictly adhering to the following structure and fields, extracted ONLY from that member's page content:
+
+{schema_block}
+
+Page contents (one "label: value" per line, section headers on their own line):
+---
+{members_content}
+---
+
+Return ONLY valid JSON, with no additional text.
+"""
+
+
+def is_valid_member_data(member_data) -> bool:
+    """Minimal shape check for one extracted member object."""
+    return (isinstance(member_data, dict)
+            and isinstance(member_data.get("lastName"), (str, type(None)))
+            and isinstance(member_data.get("firstName"), (str, type(None)))
+            and bool(member_data.get("lastName") or member_data.get("firstName")))
+
+
+def parse_ollama_response(generated_text: str) -> dict:
+    """
+    Decodes the JSON returned by Ollama. Raises json.JSONDecodeError if it is not valid JSON.
+    """
+    generated_text = generated_text.strip()
+    # Ollama's format="json" sometimes wraps the JSON in markdown code block.
+    if generated_text.startswith("```json") and generated_text.endswith("```"):
+        generated_text = generated_text[len("```json"):-len("```")].strip()
+    return json.loads(generated_text)
+
+
+async def extract_info_with_client(client, html_content: str, family_id: str, member_id: str, cache=None,
+                                   options: dict = None, avoid_urls: set = None) -> dict:
+    """
+    Async variant of extract_info_with_ollama using a shared OllamaClient (see ollama_client.py).
+    Responses are looked up in / stored to `cache` (an LLMCache) when given.
+    Errors are raised to the caller instead of exiting the process.
+    """
+    prompt = build_member_prompt(html_content, family_id, member_id)
+    return await generate_json_cached(client, prompt, MEMBER_PROMPT_VERSION, cache, options, avoid_urls,
+                                      validate=is_valid_member_data)
+
+
+async def generate_json_cached(client, prompt: str, prompt_version: str, cache=None,
+                               options: dict = None, avoid_urls: set = None, validate=None, max_chars: int = None) -> dict:
+    """
+    Runs `prompt` through the client and decodes the JSON answer, going through `cache` first.
+    Only responses that decode successfully (and pass `validate`, when given) are stored; an answer
+    failing `validate` raises OllamaExtractionError("invalid_output"). `options` (e.g. a lower
+    temperature), `avoid_urls` and `max_chars` (the streaming length bound) are passed to OllamaClient.generate.
+    """
+    if cache is not None:
+        cached_text = cache.get(client.model, prompt_version, prompt)
+        if cached_text is not None:
+            cached_data = parse_ollama_response(cached_text)
+            if validate is None or validate(cached_data):
+                return cached_data
+    generated_text = await client.generate(prompt, options=options, avoid_urls=avoid_urls, max_chars=max_chars)
+    extracted_data = parse_ollama_response(generated_text)
+    if validate is not None and not validate(extracted_data):
+        raise OllamaExtractionError("invalid_output", f"Phản hồi của Ollama không hợp lệ: {generated_text[:200]}")
+    if cache is not None:
+        cache.put(client.model, prompt_version, prompt, generated_text)
+    return extracted_data
+
+
+async def extract_batch_with_client(client, pages: list, cache=None) -> dict:
+    """
+    Extracts several members with one batched request. `pages` is a list of
+    (family_id, member_id, html_content). Returns {member_id: member_data} for the members whose
+    entry was present and valid; callers fall back to single-member calls for the rest.
+    An unparseable (or aborted) batch response returns an empty dict.
+    """
+    prompt = build_member_batch_prompt(pages)
+    try:
+        batch_data = await generate_json_cached(client, prompt, MEMBER_BATCH_PROMPT_VERSION, cache,
+                                                max_chars=client.max_chars * len(pages))
+    except json.JSONDecodeError:
+        return {}
+    except OllamaExtractionError as e:
+        if e.reason not in ("invalid_json", "too_long"):
+            raise
+        return {}
+    if isinstance(batch_data, list):
+        # Some models answer with an array despite the instructions; index it by each element's code.
+        batch_data = {item.get("code"): item for item in batch_data if isinstance(item, dict)}
+    if not isinstance(batch_data, dict):
+        return {}
+
+    results = {}
+    for family_id, member_id, _ in pages:
+        code = member_code(family_id, member_id)
+        member_data = batch_data.get(code)
+        if is_valid_member_data(member_data):
+            member_data["code"] = code
+            results[member_id] = member_data
+    return results
+
+
+def extract_info_with_ollama(html_content: str, family_id: str, member_id: str):
+    """
+    Sends HTML content to Ollama for structured data extraction according to schema-member.txt.
+    Raises OllamaExtractionError (with a `reason`) on connection, HTTP or JSON errors.
+    """
+    prompt = build_member_prompt(html_content, family_id, member_id)
+    print(f"Rút gọn nội dung: {compaction_stats.page_summary(f'{family_id}/{member_id}')}")
+    generated_text = ""
+
+    cache = get_default_cache()
+    if cache is not None:
+        cached_text = cache.get(OLLAMA_MODEL, MEMBER_PROMPT_VERSION, prompt)
+        if cached_text is not None:
+            print("Dùng phản hồi đã lưu trong cache LLM.")
+            return parse_ollama_response(cached_text)
+
     data = {
         "model": OLLAMA_MODEL,
         "prompt": prompt,
-        "stream": False,
         "format": "json"
     }
 
     try:
-        response = requests.post(OLLAMA_API_URL, headers=headers, json=data)
-        response.raise_for_status() # Raise an exception for HTTP errors
-        
-        result = response.json()
-        generated_text = result.get("response", "").strip()
-        
-        # Ollama's format="json" sometimes wraps the JSON in markdown code block.
-        if generated_text.startswith("```json") and generated_text.endswith("```"):
-            generated_text = generated_text[len("```json"):-len("```")].strip()
+        # Streams the answer and stops early on invalid JSON, excessive length or the deadline (see ollama_client).
+        generated_text = generate_sync(OLLAMA_API_URL, data)
 
-        return json.loads(generated_text)
+        extracted_data = parse_ollama_response(generated_text)
+        if cache is not None:
+            cache.put(OLLAMA_MODEL, MEMBER_PROMPT_VERSION, prompt, generated_text)
+        return extracted_data
 
+    except OllamaExtractionError:
+        raise
     except requests.exceptions.ConnectionError as e:
-        print(f"Lỗi kết nối đến Ollama API tại {OLLAMA_API_URL}. Vui lòng đảm bảo Ollama đang chạy.", file=sys.stderr)
-        print(e, file=sys.stderr)
-        sys.exit(1)
+        raise OllamaExtractionError("connection", f"Lỗi kết nối đến Ollama API tại {OLLAMA_API_URL}. Vui lòng đảm bảo Ollama đang chạy. {e}") from e
+    except requests.exceptions.Timeout as e:
+        raise OllamaExtractionError("timeout", f"Hết thời gian chờ Ollama API tại {OLLAMA_API_URL}. {e}") from e
     except requests.exceptions.HTTPError as e:
-        print(f"Lỗi HTTP từ Ollama API: {e}", file=sys.stderr)
-        sys.exit(1)
+        status = e.response.status_code if e.response is not None else "unknown"
+        raise OllamaExtractionError(f"http_{status}", f"Lỗi HTTP từ Ollama API: {e}") from e
     except json.JSONDecodeError as e:
-        print(f"Lỗi khi giải mã JSON từ phản hồi của Ollama: {e}", file=sys.stderr)
-        print(f"Phản hồi nhận được:\n{generated_text}", file=sys.stderr)
-        sys.exit(1)
+        raise OllamaExtractionError("invalid_json", f"Lỗi khi giải mã JSON từ phản hồi của Ollama: {e}\nPhản hồi nhận được:\n{generated_text}") from e
     except Exception as e:
-        print(f"Lỗi không xác định khi gọi Ollama API: {e}", file=sys.stderr)
-        sys.exit(1)
+        raise OllamaExtractionError(type(e).__name__, f"Lỗi không xác định khi gọi Ollama API: {e}") from e
 
 
 def extract_member_info_ollama(html_file_path: str, family_id: str):
@@ -0,0 +1,93 @@
+import re
+
+# Kiểm tra cấu trúc JSON theo từng đoạn token khi Ollama trả về dạng stream, để dừng sớm
+# những phản hồi chắc chắn hỏng thay vì chờ model sinh hết ngữ cảnh.
+
+MAX_DEPTH = 32
+_CODE_FENCE = "```json"
+_LITERAL_CHARS = re.compile(r"[A-Za-z0-9.+\-]")
+_CLOSING = {"}": "{", "]": "["}
+
+
+class UnsalvageableJSON(ValueError):
+    """The streamed text can no longer become valid JSON."""
+
+
+class JSONStreamValidator:
+    """
+    Incremental structural check of a streamed JSON value (one object or array, optionally inside a
+    ```json fence). It tracks strings, escapes and bracket nesting only; full decoding is still done
+    by json.loads once the text is complete.
+
+        validator = JSONStreamValidator()
+        for chunk in chunks:
+            if validator.feed(chunk):  # True once the top-level value is closed
+                break
+        text = validator.text()
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._prefix = ""
+        self._stack = []
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self.done = False
+        self.length = 0
+
+    def text(self) -> str:
+        """The JSON received so far, from its first bracket (any code fence dropped) to the end of the value."""
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Checks `chunk` and returns True once the top-level value is complete. Raises
+        UnsalvageableJSON as soon as the text cannot be valid JSON anymore.
+        """
+        if self.done:
+            return True
+        start = 0 if self._started else len(chunk)
+        for index, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if not self._started:
+                if char.isspace():
+                    continue
+                if char in "{[":
+                    self._started = True
+                    self._stack.append(char)
+                    start = index
+                    continue
+                self._prefix += char
+                if not _CODE_FENCE.startswith(self._prefix):
+                    raise UnsalvageableJSON(f"Phản hồi không bắt đầu bằng JSON: {self._prefix[:50]!r}")
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+                if len(self._stack) > MAX_DEPTH:
+                    raise UnsalvageableJSON(f"JSON lồng sâu quá {MAX_DEPTH} cấp")
+            elif char in _CLOSING:
+                if not self._stack or self._stack[-1] != _CLOSING[char]:
+                    raise UnsalvageableJSON(f"Dấu đóng '{char}' không khớp")
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                    self._append(chunk[start:index + 1]) # Anything after the value (fence, padding) is dropped.
+                    return True
+            elif not (char.isspace() or char in ":," or _LITERAL_CHARS.match(char)):
+                raise UnsalvageableJSON(f"Ký tự không hợp lệ ngoài chuỗi: {char!r}")
+        self._append(chunk[start:])
+        return False
+
+    def _append(self, chunk: str):
+        self._chunks.append(chunk)
+        self.length += len(chunk)
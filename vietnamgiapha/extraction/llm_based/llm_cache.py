@@ -0,0 +1,144 @@
+import os
+import time
+import sqlite3
+import hashlib
+
+# Cache phản hồi LLM trên đĩa. Khóa = (model, phiên bản prompt, hash của prompt đã dựng).
+# Prompt đã chứa HTML sau khi làm sạch, nên trang nào không đổi sẽ không phải gọi lại Ollama.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("output", "llm_cache.sqlite"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "512"))
+LLM_CACHE_MAX_AGE_DAYS = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "90"))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "") in ("1", "true", "yes")
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used_at);
+"""
+
+# Số lần ghi giữa hai lần dọn cache.
+EVICT_EVERY_PUTS = 200
+
+
+def make_key(model: str, prompt_version: str, prompt: str) -> str:
+    """Content-addressed key: any change to the model, template version or cleaned HTML gives a new key."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}\0{prompt_version}\0{prompt_hash}".encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite-backed cache of raw Ollama responses with age and size eviction and hit/miss counters.
+    Entries older than `max_age_days` are treated as misses; once the cache grows past `max_mb`
+    the least recently used entries are dropped.
+    """
+
+    def __init__(self, db_path: str = None, max_mb: float = None, max_age_days: float = None):
+        self.db_path = db_path or LLM_CACHE_PATH
+        self.max_bytes = int((max_mb if max_mb is not None else LLM_CACHE_MAX_MB) * 1024 * 1024)
+        self.max_age_seconds = (max_age_days if max_age_days is not None else LLM_CACHE_MAX_AGE_DAYS) * 86400
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._puts_since_evict = 0
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # Several extraction processes may share the file; WAL and a busy timeout keep them from failing.
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA_SQL)
+
+    def get(self, model: str, prompt_version: str, prompt: str):
+        """Returns the cached response text, or None on a miss."""
+        key = make_key(model, prompt_version, prompt)
+        row = self.conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.max_age_seconds:
+            self.misses += 1
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, model: str, prompt_version: str, prompt: str, response: str):
+        """Stores a response that has already been validated by the caller."""
+        key = make_key(model, prompt_version, prompt)
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, prompt_version, response, size, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, prompt_version, response, len(response.encode("utf-8")), now, now),
+            )
+        self._puts_since_evict += 1
+        if self._puts_since_evict >= EVICT_EVERY_PUTS:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drops expired entries, then least recently used ones until the cache fits in max_bytes."""
+        self._puts_since_evict = 0
+        removed = 0
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            removed += cursor.rowcount
+            total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total_size > self.max_bytes:
+                excess = total_size - self.max_bytes
+                stale_keys = []
+                for key, size in self.conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used_at"):
+                    stale_keys.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self.conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale_keys)
+                removed += len(stale_keys)
+        self.evicted += removed
+        return removed
+
+    def stats(self) -> dict:
+        entries, total_size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "entries": entries,
+            "size_mb": total_size / (1024 * 1024),
+        }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (f"LLM cache: {stats['hits']} hit, {stats['misses']} miss ({stats['hit_rate']:.0%} hit rate), "
+                f"{stats['evicted']} evicted, {stats['entries']} entries / {stats['size_mb']:.1f} MB")
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """
+    Returns the process-wide cache at LLM_CACHE_PATH, or None when LLM_CACHE_DISABLED is set.
+    """
+    global _default_cache
+    if LLM_CACHE_DISABLED:
+        return None
+    if _default_cache is None:
+        _default_cache = LLMCache()
+    return _default_cache
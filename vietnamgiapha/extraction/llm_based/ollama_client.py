@@ -0,0 +1,451 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import aiohttp
+import requests
+import contextvars
+
+from .json_stream import JSONStreamValidator, UnsalvageableJSON
+from .prompt_compaction import estimate_tokens
+from ...utils import tracing
+
+OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
+# Nhiều endpoint Ollama, phân tách bằng dấu phẩy, mỗi endpoint có thể kèm trọng số sau "|":
+#   OLLAMA_API_URLS="http://gpu1:11434/api/generate|2,http://gpu2:11434/api/generate"
+# Nếu không đặt, chỉ dùng OLLAMA_API_URL.
+OLLAMA_API_URLS = os.getenv("OLLAMA_API_URLS", "")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:8b")
+# Số request generate được phép chạy đồng thời tới mỗi endpoint có trọng số 1 (nên khớp với OLLAMA_NUM_PARALLEL của server).
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "4"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "600"))
+# Stream responses and check the JSON as it arrives, aborting a generation once it cannot become valid JSON,
+# grows past OLLAMA_MAX_RESPONSE_CHARS characters or runs longer than OLLAMA_REQUEST_DEADLINE seconds.
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "1") not in ("0", "false", "no")
+OLLAMA_MAX_RESPONSE_CHARS = int(os.getenv("OLLAMA_MAX_RESPONSE_CHARS", "6000"))
+OLLAMA_REQUEST_DEADLINE = float(os.getenv("OLLAMA_REQUEST_DEADLINE", "300"))
+# num_ctx is set to the smallest of these buckets that fits the prompt plus the longest allowed answer.
+OLLAMA_NUM_CTX_BUCKETS = sorted(int(size) for size in os.getenv("OLLAMA_NUM_CTX_BUCKETS", "2048,4096,8192,16384,32768").split(","))
+# Every request refreshes keep_alive, so the model stays loaded for the whole run; when a pooled client
+# closes after warming up, the model is handed back with OLLAMA_RELEASE_KEEP_ALIVE (Ollama's default).
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_RELEASE_KEEP_ALIVE = os.getenv("OLLAMA_RELEASE_KEEP_ALIVE", "5m")
+# estimate_tokens counts words; Vietnamese syllables with diacritics often take more than one model token.
+MODEL_TOKENS_PER_WORD = 1.6
+CHARS_PER_OUTPUT_TOKEN = 4
+
+# Một endpoint bị loại tạm thời sau chừng này lỗi liên tiếp, và được kiểm tra sức khỏe lại mỗi HEALTH_CHECK_INTERVAL giây.
+MAX_CONSECUTIVE_FAILURES = 2
+HEALTH_CHECK_INTERVAL = 15.0
+HEALTH_CHECK_TIMEOUT = 5.0
+
+
+# Endpoint that served the most recent generate() call in the current task, so callers can
+# retry a bad answer somewhere else.
+_last_endpoint_url = contextvars.ContextVar("ollama_last_endpoint_url", default=None)
+
+
+class OllamaExtractionError(Exception):
+    """
+    An LLM extraction that failed for one page. `reason` is a short machine-readable category
+    (see classify_error) so failures can be queued and retried instead of ending the process.
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def classify_error(error: Exception) -> str:
+    """Short reason for a failed extraction: connection, timeout, http_<status>, invalid_json, ..."""
+    if isinstance(error, OllamaExtractionError):
+        return error.reason
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"http_{error.status}"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, aiohttp.ClientError):
+        return "connection"
+    if isinstance(error, json.JSONDecodeError):
+        return "invalid_json"
+    return type(error).__name__
+
+
+def estimate_num_ctx(prompt: str, max_chars: int = None) -> int:
+    """Context tokens needed for `prompt` plus an answer of up to `max_chars` characters."""
+    prompt_tokens = int(estimate_tokens(prompt) * MODEL_TOKENS_PER_WORD)
+    return prompt_tokens + (max_chars or OLLAMA_MAX_RESPONSE_CHARS) // CHARS_PER_OUTPUT_TOKEN
+
+
+def choose_num_ctx(needed_tokens: int) -> int:
+    """Smallest bucket holding `needed_tokens`; the largest bucket (with a warning) if none does."""
+    for size in OLLAMA_NUM_CTX_BUCKETS:
+        if size >= needed_tokens:
+            return size
+    print(f"Cảnh báo: prompt cần khoảng {needed_tokens} tokens, vượt num_ctx lớn nhất {OLLAMA_NUM_CTX_BUCKETS[-1]}; "
+          "nội dung có thể bị cắt.", file=sys.stderr)
+    return OLLAMA_NUM_CTX_BUCKETS[-1]
+
+
+def _stream_chunk(line, validator: JSONStreamValidator, max_chars: int) -> bool:
+    """
+    Feeds one NDJSON line of an Ollama stream to `validator`. Returns True when generation is over
+    (the JSON value is complete or Ollama sent done); raises OllamaExtractionError to abort it.
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    if not line.strip():
+        return False
+    message = json.loads(line)
+    if message.get("error"):
+        raise OllamaExtractionError("ollama_error", f"Ollama trả về lỗi: {message['error']}")
+    try:
+        complete = validator.feed(message.get("response", ""))
+    except UnsalvageableJSON as e:
+        raise OllamaExtractionError("invalid_json", f"Dừng sinh sớm, phản hồi không phải JSON hợp lệ: {e}") from e
+    if not complete and max_chars and validator.length > max_chars:
+        raise OllamaExtractionError("too_long", f"Dừng sinh sớm, phản hồi vượt quá {max_chars} ký tự.")
+    return complete or bool(message.get("done"))
+
+
+def generate_sync(api_url: str, data: dict, stream: bool = None, max_chars: int = None, deadline: float = None) -> str:
+    """
+    Blocking /api/generate call for the single-page CLI extractors. With streaming (OLLAMA_STREAM),
+    the response is validated as it arrives and the connection is closed as soon as the JSON is
+    complete, unsalvageable, longer than `max_chars` or past `deadline` seconds.
+    Raises requests exceptions or OllamaExtractionError.
+    """
+    stream = OLLAMA_STREAM if stream is None else stream
+    deadline = deadline or OLLAMA_REQUEST_DEADLINE
+    options = dict(data.get("options") or {})
+    options.setdefault("num_ctx", choose_num_ctx(estimate_num_ctx(data["prompt"], max_chars)))
+    # keep_alive keeps the model loaded between the one-page-per-process CLI calls.
+    data = dict(data, stream=stream, options=options, keep_alive=data.get("keep_alive", OLLAMA_KEEP_ALIVE))
+    if not stream:
+        with tracing.span("ollama generate", "http", url=api_url, stream=False) as span:
+            response = requests.post(api_url, json=data, timeout=OLLAMA_TIMEOUT)
+            span["status"] = response.status_code
+        response.raise_for_status()
+        return response.json().get("response", "").strip()
+
+    validator = JSONStreamValidator()
+    started = time.monotonic()
+    # The read timeout bounds a silent server; the deadline bounds a server that keeps generating.
+    with tracing.span("ollama generate", "http", url=api_url, stream=True) as span, \
+            requests.post(api_url, json=data, stream=True, timeout=(10, deadline)) as response:
+        span["status"] = response.status_code
+        response.raise_for_status()
+        try:
+            for line in response.iter_lines():
+                if _stream_chunk(line, validator, max_chars or OLLAMA_MAX_RESPONSE_CHARS):
+                    break
+                if time.monotonic() - started > deadline:
+                    raise OllamaExtractionError("deadline", f"Dừng sinh sớm, vượt quá thời hạn {deadline:g}s.")
+        except requests.exceptions.ConnectionError as e:
+            # A read timeout while streaming surfaces as ConnectionError.
+            if time.monotonic() - started >= deadline:
+                raise OllamaExtractionError("deadline", f"Dừng sinh sớm, vượt quá thời hạn {deadline:g}s.") from e
+            raise
+    return validator.text().strip()
+
+
+def parse_endpoints(spec: str = None) -> list:
+    """Parses "url[|weight],url[|weight]" into [(url, weight)]; falls back to OLLAMA_API_URL."""
+    spec = OLLAMA_API_URLS if spec is None else spec
+    endpoints = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        url, _, weight = entry.partition("|")
+        endpoints.append((url.strip(), float(weight) if weight.strip() else 1.0))
+    return endpoints or [(OLLAMA_API_URL, 1.0)]
+
+
+class OllamaEndpoint:
+    """One Ollama server with its weight, in-flight count and health state."""
+
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        self.weight = max(weight, 0.01)
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def base_url(self) -> str:
+        return self.url.split("/api/")[0]
+
+    def load(self) -> float:
+        """Outstanding requests relative to weight; the dispatcher picks the lowest."""
+        return (self.outstanding + 1) / self.weight
+
+    def record_success(self):
+        self.completed += 1
+        self.consecutive_failures = 0
+        self.healthy = True
+
+    def record_failure(self):
+        self.failed += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES and self.healthy:
+            self.healthy = False
+            print(f"Ollama endpoint {self.url} bị loại tạm thời sau {self.consecutive_failures} lỗi liên tiếp.", file=sys.stderr)
+
+
+class OllamaClient:
+    """
+    Async Ollama client that keeps one pooled aiohttp session open for a whole run,
+    so members are extracted in-process instead of spawning one interpreter per member.
+
+    Responses are streamed (see OLLAMA_STREAM) so a generation is cut off as soon as its JSON is
+    complete, unsalvageable, too long or past its deadline, freeing the inference slot early.
+
+    Each request asks for the smallest num_ctx bucket that fits it. Ollama reloads the model when
+    num_ctx changes, so within one client the context only ever grows: warm_up() loads the model
+    once with a bucket sized for the largest expected prompt, and later requests reuse it.
+
+    With several endpoints (OLLAMA_API_URLS) each request goes to the healthy endpoint with the
+    fewest outstanding requests per unit of weight. Connection errors, timeouts and 5xx answers
+    are retried on another endpoint; endpoints that keep failing are ejected until a background
+    health check (GET /api/tags) sees them answer again.
+
+    Usage:
+        async with OllamaClient(concurrency=4) as client:
+            text = await client.generate(prompt)
+    """
+
+    def __init__(self, api_url: str = None, model: str = None, concurrency: int = None, timeout: float = None,
+                 endpoints: list = None, stream: bool = None, max_chars: int = None, deadline: float = None,
+                 keep_alive: str = None):
+        if endpoints is None:
+            endpoints = [(api_url, 1.0)] if api_url else parse_endpoints()
+        self.endpoints = [OllamaEndpoint(url, weight) for url, weight in endpoints]
+        self.model = model or OLLAMA_MODEL
+        per_endpoint = max(1, concurrency or OLLAMA_CONCURRENCY)
+        # Total in-flight limit: `concurrency` per unit of weight on every endpoint.
+        self.concurrency = sum(max(1, round(per_endpoint * endpoint.weight)) for endpoint in self.endpoints)
+        self.timeout = timeout or OLLAMA_TIMEOUT
+        self.stream = OLLAMA_STREAM if stream is None else stream
+        self.max_chars = max_chars or OLLAMA_MAX_RESPONSE_CHARS
+        self.deadline = deadline or OLLAMA_REQUEST_DEADLINE
+        self.aborted = {} # reason -> number of generations cut off early
+        self.keep_alive = keep_alive or OLLAMA_KEEP_ALIVE
+        self.num_ctx = 0 # Current context bucket; only grows, to avoid model reloads.
+        self._pinned = False # True once a request has loaded the model with our keep_alive
+        self._session = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._health_task = None
+
+    @property
+    def api_url(self) -> str:
+        return self.endpoints[0].url
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Content-Type": "application/json"},
+            )
+            if len(self.endpoints) > 1:
+                self._health_task = asyncio.create_task(self._health_check_loop())
+
+    async def close(self):
+        if self._pinned and self._session is not None:
+            await self._set_keep_alive(OLLAMA_RELEASE_KEEP_ALIVE)
+            self._pinned = False
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def check_health(self, endpoint: OllamaEndpoint) -> bool:
+        try:
+            async with self._session.get(f"{endpoint.base_url}/api/tags",
+                                         timeout=aiohttp.ClientTimeout(total=HEALTH_CHECK_TIMEOUT)) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for endpoint in self.endpoints:
+                if not endpoint.healthy and await self.check_health(endpoint):
+                    endpoint.healthy = True
+                    endpoint.consecutive_failures = 0
+                    print(f"Ollama endpoint {endpoint.url} hoạt động trở lại.")
+
+    async def _load_model(self, endpoint: OllamaEndpoint, keep_alive: str, timeout: float):
+        # An empty prompt makes Ollama load the model (with these options) without generating anything.
+        data = {"model": self.model, "prompt": "", "stream": False, "keep_alive": keep_alive}
+        if self.num_ctx:
+            data["options"] = {"num_ctx": self.num_ctx}
+        async with self._session.post(endpoint.url, json=data, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            await response.read()
+
+    def size_context(self, sample_prompt: str, max_chars: int = None):
+        """Sizes num_ctx for the run from its largest expected prompt, before the model is loaded."""
+        self.num_ctx = max(self.num_ctx, choose_num_ctx(estimate_num_ctx(sample_prompt, max_chars or self.max_chars)))
+
+    async def warm_up(self):
+        """
+        Loads the model on every endpoint before a batch run and pins it with keep_alive, using the
+        num_ctx from size_context(). Failures are only reported: the requests themselves retry and
+        record endpoint errors.
+        """
+        if self._session is None:
+            await self.open()
+        for endpoint in self.endpoints:
+            start = time.perf_counter()
+            try:
+                await self._load_model(endpoint, self.keep_alive, self.timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Không thể nạp trước model {self.model} trên {endpoint.url}: {e}", file=sys.stderr)
+                continue
+            print(f"Đã nạp model {self.model} trên {endpoint.url} (num_ctx={self.num_ctx or 'mặc định'}, "
+                  f"keep_alive={self.keep_alive}) trong {time.perf_counter() - start:.1f}s.")
+            self._pinned = True
+
+    async def _set_keep_alive(self, keep_alive: str):
+        for endpoint in self.endpoints:
+            try:
+                await self._load_model(endpoint, keep_alive, HEALTH_CHECK_TIMEOUT)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+    def _options_for(self, prompt: str, max_chars: int, options: dict) -> dict:
+        needed = choose_num_ctx(estimate_num_ctx(prompt, max_chars))
+        if needed > self.num_ctx:
+            if self.num_ctx:
+                print(f"Tăng num_ctx từ {self.num_ctx} lên {needed} cho prompt dài (model sẽ được nạp lại).")
+            self.num_ctx = needed
+        return {"num_ctx": self.num_ctx, **(options or {})}
+
+    def last_endpoint_url(self) -> str:
+        """URL of the endpoint that answered (or failed) the last generate() call of the current task."""
+        return _last_endpoint_url.get()
+
+    def _pick_endpoint(self, exclude: set) -> OllamaEndpoint:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.url not in exclude]
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+        # If every remaining endpoint is ejected, still try the least loaded one rather than fail outright.
+        return min(healthy or candidates, key=lambda endpoint: endpoint.load())
+
+    async def _post(self, endpoint: OllamaEndpoint, data: dict, max_chars: int) -> str:
+        """
+        One /api/generate call to `endpoint`. The deadline only starts once the response has started: a timeout
+        before that (a host that accepts the connection and never answers) is raised as asyncio.TimeoutError, so
+        generate() counts it against the endpoint and tries the next one. With streaming the headers arrive when
+        generation starts, so waiting for them is bounded by the deadline too (like generate_sync's read timeout);
+        without streaming they only arrive with the whole answer, so only the session timeout applies.
+        """
+        loop = asyncio.get_running_loop()
+        endpoint.outstanding += 1
+        try:
+            with tracing.span("ollama generate", "http", url=endpoint.url, stream=data["stream"],
+                              num_ctx=data["options"].get("num_ctx")) as span:
+                headers_timeout = self.deadline if data["stream"] else None
+                async with await asyncio.wait_for(self._session.post(endpoint.url, json=data), headers_timeout) as response:
+                    span["status"] = response.status
+                    response.raise_for_status()
+                    started = loop.time()
+                    try:
+                        return await asyncio.wait_for(self._read(response, data, max_chars), self.deadline)
+                    except asyncio.TimeoutError:
+                        if loop.time() - started < self.deadline:
+                            raise # The session timeout fired while reading: a connection problem, not the deadline.
+                        raise OllamaExtractionError("deadline", f"Dừng sinh sớm, vượt quá thời hạn {self.deadline:g}s.")
+        finally:
+            endpoint.outstanding -= 1
+
+    async def _read(self, response, data: dict, max_chars: int) -> str:
+        if not data["stream"]:
+            result = await response.json(content_type=None)
+            return result.get("response", "")
+        validator = JSONStreamValidator()
+        # Leaving the block before the stream ends closes the connection, which stops the generation.
+        async for line in response.content:
+            if _stream_chunk(line, validator, max_chars):
+                break
+        return validator.text()
+
+    async def generate(self, prompt: str, model: str = None, format: str = "json", options: dict = None,
+                       avoid_urls: set = None, max_chars: int = None) -> str:
+        """
+        Sends one /api/generate request and returns the raw `response` text.
+        At most `concurrency` generations are in flight at once. The request is retried on each
+        other endpoint in turn; the last error propagates (as an aiohttp exception) once all have failed.
+        Endpoints in `avoid_urls` are only used when no other endpoint is left.
+        A streamed generation that is aborted early (invalid JSON, longer than `max_chars`, past the
+        deadline once the answer has started) raises OllamaExtractionError and is not retried here;
+        an endpoint that does not answer at all counts as a failure and the next endpoint is tried.
+        """
+        if self._session is None:
+            await self.open()
+        max_chars = max_chars or self.max_chars
+        data = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": self.stream,
+            "keep_alive": self.keep_alive,
+            "options": self._options_for(prompt, max_chars, options),
+        }
+        if format:
+            data["format"] = format
+
+        async with self._semaphore:
+            tried = set()
+            while True:
+                exclude = tried | (avoid_urls or set())
+                endpoint = self._pick_endpoint(exclude if len(exclude) < len(self.endpoints) else tried)
+                tried.add(endpoint.url)
+                _last_endpoint_url.set(endpoint.url)
+                try:
+                    text = await self._post(endpoint, data, max_chars)
+                except OllamaExtractionError as e:
+                    endpoint.record_success() # The endpoint answered; the generation itself was bad.
+                    self.aborted[e.reason] = self.aborted.get(e.reason, 0) + 1
+                    raise
+                except aiohttp.ClientResponseError as e:
+                    if e.status < 500 or len(tried) == len(self.endpoints):
+                        if e.status >= 500:
+                            endpoint.record_failure()
+                        raise
+                    endpoint.record_failure()
+                    continue
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    endpoint.record_failure()
+                    if len(tried) == len(self.endpoints):
+                        raise
+                    continue
+                endpoint.record_success()
+                self._pinned = True
+                return text.strip()
+
+    def summary(self) -> str:
+        parts = [f"{endpoint.url} (w={endpoint.weight:g}): {endpoint.completed} ok, {endpoint.failed} lỗi"
+                 + ("" if endpoint.healthy else ", đang bị loại") for endpoint in self.endpoints]
+        lines = ["Ollama endpoints: " + "; ".join(parts)]
+        if self.aborted:
+            lines.append("Generations aborted early: " + ", ".join(f"{reason}: {count}" for reason, count in sorted(self.aborted.items())))
+        return "\n".join(lines)
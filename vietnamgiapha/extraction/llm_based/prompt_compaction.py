@@ -0,0 +1,93 @@
+import re
+from bs4 import BeautifulSoup, NavigableString
+
+# Chuyển HTML (đã làm sạch khi crawl) thành văn bản "nhãn: giá trị" tối giản để đưa vào prompt.
+# Mỗi hàng <tr> thành một dòng; các hàng chỉ có một ô (tiêu đề như "Người trong gia đình",
+# "Liên quan (chồng, vợ)", "Con cái:") được giữ nguyên vì prompt dựa vào chúng.
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_WHITESPACE_PATTERN = re.compile(r"[ \t\r\f\v\xa0]+")
+_TAG_ATTRIBUTES_PATTERN = re.compile(r"<(/?\w+)[^>]*>")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate (one token per word or punctuation mark). Vietnamese syllables and HTML
+    tag pieces tokenize to roughly one token each, which is close enough to compare prompt sizes.
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def _cell_lines(cell) -> list:
+    lines = (_WHITESPACE_PATTERN.sub(" ", line).strip() for line in cell.get_text("\n").split("\n"))
+    return [line for line in lines if line]
+
+
+def compact_html(html_content: str) -> str:
+    """Returns the page as compact "label: value" lines, parsing the HTML once."""
+    soup = BeautifulSoup(html_content, "lxml")
+    for tag in soup.find_all(["script", "style", "img"]):
+        tag.decompose()
+    for br in soup.find_all("br"):
+        br.replace_with("\n")
+
+    for row in soup.find_all("tr"):
+        if row.find("table") is not None:
+            continue # Outer layout row: its nested rows become lines of their own.
+        cells = row.find_all(["td", "th"])
+        cell_lines = [_cell_lines(cell) for cell in cells]
+        non_empty = [lines for lines in cell_lines if lines]
+        if not non_empty or (len(cells) > 1 and not any(cell_lines[1:])):
+            row.decompose() # Empty row, or a label whose value is empty.
+            continue
+        if len(non_empty) == 1:
+            text = "\n".join(non_empty[0]) # Section header or free-text block: keep its lines.
+        else:
+            label = " ".join(non_empty[0]).rstrip(":").strip()
+            text = f"{label}: {' | '.join('; '.join(lines) for lines in non_empty[1:])}"
+        row.replace_with(NavigableString(f"\n{text}\n"))
+
+    lines = []
+    for line in soup.get_text("\n").split("\n"):
+        line = _WHITESPACE_PATTERN.sub(" ", line).strip()
+        if line and (not lines or lines[-1] != line):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def estimate_html_prompt_tokens(html_content: str) -> int:
+    """Estimated tokens of the page as previously sent (remove_html_tag_attributes output), without parsing it."""
+    return estimate_tokens(_TAG_ATTRIBUTES_PATTERN.sub(r"<\1>", html_content))
+
+
+class CompactionStats:
+    """Accumulates per-page token estimates before (attribute-stripped HTML) and after compaction."""
+
+    def __init__(self):
+        self.pages = {}
+
+    def record(self, page: str, html_tokens: int, compact_tokens: int):
+        self.pages[page] = (html_tokens, compact_tokens)
+
+    def page_summary(self, page: str) -> str:
+        html_tokens, compact_tokens = self.pages[page]
+        saved = 1 - compact_tokens / html_tokens if html_tokens else 0.0
+        return f"prompt ~{html_tokens} -> ~{compact_tokens} tokens (-{saved:.0%})"
+
+    def summary(self) -> str:
+        html_tokens = sum(before for before, _ in self.pages.values())
+        compact_tokens = sum(after for _, after in self.pages.values())
+        saved = 1 - compact_tokens / html_tokens if html_tokens else 0.0
+        return (f"Prompt compaction: {len(self.pages)} pages, ~{html_tokens} -> ~{compact_tokens} tokens "
+                f"(-{saved:.0%}, ~{html_tokens - compact_tokens} tokens saved)")
+
+
+compaction_stats = CompactionStats()
+
+
+def compact_for_prompt(html_content: str, page: str = None) -> str:
+    """Compacts `html_content`; when `page` is given, its token savings are recorded in `compaction_stats`."""
+    compact_text = compact_html(html_content)
+    if page is not None:
+        compaction_stats.record(page, estimate_html_prompt_tokens(html_content), estimate_tokens(compact_text))
+    return compact_text
@@ -271,19 +271,18 @@ def build_schema(overview: dict, progenitor: dict, phaky: dict, tocuoc: dict, fo
 
 if __name__ == "__main__":
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.abspath(os.path.join(current_dir, "../../../../"))
+    sample_dir = os.path.abspath(os.path.join(current_dir, "..", "..", "data", "samples", "sample"))
 
     folder_to_process = "1"
-    base_raw_html_path = os.path.join(project_root, f"dong-ho-viet-data-scripts/output/{folder_to_process}/raw_html")
 
     sample_files_map = {
-        "giapha": os.path.join(base_raw_html_path, "giapha.html"),
-        "thuy_to": os.path.join(base_raw_html_path, "thuy_to.html"),
-        "pha_ky_gia_su": os.path.join(base_raw_html_path, "pha_ky_gia_su.html"),
-        "toc_uoc": os.path.join(base_raw_html_path, "toc_uoc.html"),
+        "giapha": os.path.join(sample_dir, "family", "giapha.html"),
+        "thuy_to": os.path.join(sample_dir, "thuy_to.html"),
+        "pha_ky_gia_su": os.path.join(sample_dir, "pha_ky_gia_su.html"),
+        "toc_uoc": os.path.join(sample_dir, "toc_uoc.html"),
     }
     
-    output_dir = os.path.join(project_root, "dong-ho-viet-data-scripts/output_json_family")
+    output_dir = "output_json_family"
     os.makedirs(output_dir, exist_ok=True)
 
     giapha_html_content = ""
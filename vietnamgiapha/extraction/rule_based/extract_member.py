@@ -133,8 +133,11 @@ def parse_stub_member(name_text):
         "code": None
     }
 
-def parse_family_html(html_content, family_id, member_filename):
-    """Phân tích HTML gia phả và trả về JSON theo schema."""
+def parse_family_html(html_content, family_id, member_filename, raw_values=None):
+    """Phân tích HTML gia phả và trả về JSON theo schema.
+    Nếu truyền dict `raw_values`, giá trị thô của từng nhãn trong phần "Người trong gia đình"
+    (ví dụ: "Ngày sinh" chưa chuẩn hóa) sẽ được ghi vào đó để đánh giá độ đầy đủ.
+    """
     soup = BeautifulSoup(html_content, "lxml")
     rows = soup.find_all("tr")
 
@@ -243,6 +246,8 @@ def parse_family_html(html_content, family_id, member_filename):
         
         # Now process fields specific to the current_section
         if current_section == "PERSON":
+            if raw_values is not None and label:
+                raw_values[label] = value
             if label == "Tên":
                 name_gender_info = parse_name_gender(value)
                 output["lastName"] = name_gender_info["lastName"]
@@ -478,8 +483,9 @@ def parse_family_html(html_content, family_id, member_filename):
     return json.dumps(output, ensure_ascii=False, indent=2)
 
 if __name__ == "__main__":
-    import os
-    sample_dir = "vietnamgiapha/sample"
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    sample_dir = os.path.join(current_dir, "..", "..", "data", "samples", "sample", "members")
+    sample_family_id = "1"
     output_dir = "output_json"
     
     # Create output directory if it doesn't exist
@@ -494,7 +500,7 @@ if __name__ == "__main__":
             html_content = f.read()
         
         try:
-            json_output = parse_family_html(html_content)
+            json_output = parse_family_html(html_content, family_id=sample_family_id, member_filename=filename)
             
             # Construct output JSON filename
             base_filename = os.path.splitext(filename)[0]
@@ -5,12 +5,32 @@ import argparse
 import os
 import sys
 
-# Cấu hình logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from vietnamgiapha.utils import profiling
+from vietnamgiapha.utils import budget
+from vietnamgiapha.utils import tracing
+from vietnamgiapha.utils import log_setup
+from vietnamgiapha.utils import run_status
+
+CREATE_MEMBERS_MODULE = "vietnamgiapha.api_integration.create_members"
+UPDATE_RELATIONSHIPS_MODULE = "vietnamgiapha.api_integration.update_relationships"
+# "inprocess": gọi trực tiếp hàm của từng bước; "subprocess": chạy "python -m <module>" cho mỗi bước.
+ISOLATION_MODES = ["inprocess", "subprocess"]
+# Số request tạo thành viên cùng lúc của create_members (create_members.MEMBER_CONCURRENCY_ENV); được truyền xuống
+# tiến trình con qua biến môi trường, như các thiết lập dùng chung khác.
+MEMBER_CONCURRENCY_ENV = "API_MEMBER_CONCURRENCY"
+
+def add_member_concurrency_argument(parser):
+    parser.add_argument("--member_concurrency", type=int,
+                        help=f"Tạo thành viên song song, tối đa N request cùng lúc (mặc định: {MEMBER_CONCURRENCY_ENV} hoặc 0 = tuần tự).")
+
+def setup_member_concurrency(args):
+    if getattr(args, "member_concurrency", None) is not None:
+        os.environ[MEMBER_CONCURRENCY_ENV] = str(args.member_concurrency)
 
 def run_script(script_path: str, args: list = None):
     """
-    Chạy một script Python và in ra output.
+    Chạy một module Python trong tiến trình con và in output của nó ngay khi có
+    (không giữ toàn bộ output trong bộ nhớ).
     """
     if args is None:
         args = []
@@ -22,22 +42,24 @@ def run_script(script_path: str, args: list = None):
     project_root = os.path.abspath(os.path.join(current_script_dir, "..", ".."))
     env = os.environ.copy()
     env["PYTHONPATH"] = project_root
+    env["PYTHONUNBUFFERED"] = "1" # Để từng dòng output của tiến trình con đến ngay
     
     logging.info(f"Đang chạy lệnh: {' '.join(command)} với PYTHONPATH={env['PYTHONPATH']}")
+    script_name = script_path.rsplit(".", 1)[-1]
     try:
-        # Chạy script như một tiến trình con
-        process = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8', env=env)
+        # Chạy script như một tiến trình con, gộp stderr vào stdout và in từng dòng
+        with tracing.span("subprocess", "process", command=script_path) as span, \
+                subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                 encoding='utf-8', errors='replace', env=tracing.spawn_env(env)) as process:
+            for line in process.stdout:
+                print(f"[{script_name}] {line}", end="", flush=True)
+            returncode = process.wait()
+            span["returncode"] = returncode
+        if returncode != 0:
+            logging.error(f"Script '{script_path}' thất bại với mã lỗi {returncode}.")
+            return False
         logging.info(f"Script '{script_path}' hoàn tất thành công.")
-        if process.stdout:
-            logging.info(f"Stdout từ '{script_path}':\n{process.stdout}")
-        if process.stderr:
-            logging.warning(f"Stderr từ '{script_path}':\n{process.stderr}")
         return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Script '{script_path}' thất bại với mã lỗi {e.returncode}.")
-        logging.error(f"Stdout từ '{script_path}':\n{e.stdout}")
-        logging.error(f"Stderr từ '{script_path}':\n{e.stderr}")
-        return False
     except FileNotFoundError:
         logging.error(f"Lỗi: Không tìm thấy trình thông dịch 'python' hoặc script '{script_path}'. Đảm bảo Python đã được cài đặt và nằm trong PATH.")
         return False
@@ -45,42 +67,137 @@ def run_script(script_path: str, args: list = None):
         logging.error(f"Lỗi không xác định khi chạy script '{script_path}': {e}")
         return False
 
-def main():
-    parser = argparse.ArgumentParser(description="Chạy pipeline tạo thành viên và cập nhật mối quan hệ cho hệ thống gia phả.")
-    parser.add_argument("--folder", type=str, help="Chỉ định thư mục gia đình cần xử lý (ví dụ: '1'). Nếu không, tất cả các thư mục sẽ được xử lý.")
-    parser.add_argument("--member_limit", type=int, default=0, help="Giới hạn số lượng thành viên được tạo từ mỗi thư mục. Mặc định là 0 (không giới hạn). (Chỉ áp dụng cho create_members.py)")
-    parser.add_argument("--relation_limit", type=int, help="Giới hạn số lượng mối quan hệ cần cập nhật cho mục đích debug hoặc test. (Chỉ áp dụng cho update_relationships.py)")
-    
-    args = parser.parse_args()
+def run_in_process(stage_name: str, func, *args, **kwargs) -> bool:
+    """
+    Chạy một bước pipeline ngay trong tiến trình hiện tại. Lỗi (kể cả sys.exit với mã khác 0)
+    được ghi log và trả về False, giống như một tiến trình con thất bại.
+    """
+    try:
+        result = func(*args, **kwargs)
+    except SystemExit as e:
+        if e.code in (None, 0):
+            return True
+        logging.error(f"Bước '{stage_name}' kết thúc với mã lỗi {e.code}.")
+        return False
+    except Exception as e:
+        logging.exception(f"Lỗi không xác định trong bước '{stage_name}': {e}")
+        return False
+    return result is not False # Các hàm main() cũ trả về None khi thành công
 
-    create_members_script = "vietnamgiapha.api_integration.create_members"
-    update_relationships_script = "vietnamgiapha.api_integration.update_relationships"
+def ingest_family(folder: str = None, member_limit: int = 0, relation_limit: int = None, isolation: str = "inprocess") -> bool:
+    """
+    Tạo thành viên rồi cập nhật mối quan hệ cho `folder` (hoặc mọi thư mục nếu None).
+    isolation="subprocess" chạy mỗi bước trong một tiến trình Python riêng như trước đây.
+    Với một `folder`, ngân sách của gia đình được áp dụng; vượt ngân sách thì gia đình bị tạm hoãn và trả về False.
+    """
+    if folder is None:
+        return _ingest_steps(folder, member_limit, relation_limit, isolation)
+    ingest_ok = False
+    with budget.enforce(folder, "ingest"), tracing.span("ingest", family_id=folder):
+        members_dir = os.path.join("output", folder, "data", "members")
+        if os.path.isdir(members_dir):
+            budget.check_members(sum(1 for name in os.listdir(members_dir) if name.endswith(".json")))
+        ingest_ok = _ingest_steps(folder, member_limit, relation_limit, isolation)
+    return ingest_ok
+
+def ingest_all_families(member_limit: int = 0, relation_limit: int = None, isolation: str = "inprocess",
+                        status_path: str = None, progress_bar: bool = False) -> bool:
+    """
+    Nhập liệu lần lượt mọi thư mục gia đình trong output/, mỗi gia đình với ngân sách riêng; một gia đình lỗi
+    không dừng các gia đình sau. Tiến độ của lần chạy được ghi vào `status_path` (và thanh tiến độ nếu bật).
+    """
+    try:
+        entries = os.listdir("output")
+    except FileNotFoundError:
+        logging.error("Thư mục đầu ra 'output' không tồn tại.")
+        return False
+    folders = sorted((entry for entry in entries if os.path.isdir(os.path.join("output", entry))),
+                     key=lambda entry: (not entry.isdigit(), int(entry) if entry.isdigit() else 0, entry))
+    failed = []
+    with run_status.RunStatus("ingest", folders, status_path, progress_bar) as status:
+        for folder in folders:
+            logging.info(f"--- Đang nhập liệu thư mục gia đình: {folder} ---")
+            status.family_started(folder)
+            folder_ok = ingest_family(folder, member_limit, relation_limit, isolation)
+            status.family_finished(folder, folder_ok)
+            if not folder_ok:
+                failed.append(folder)
+    if failed:
+        logging.error(f"Nhập liệu thất bại hoặc bị tạm hoãn cho {len(failed)} thư mục: {', '.join(failed)}")
+    return not failed
+
+def _ingest_steps(folder: str, member_limit: int, relation_limit: int, isolation: str) -> bool:
+    profiler = profiling.get_profiler()
+    in_process = isolation == "inprocess"
 
     # Bước 1: Chạy create_members.py
     logging.info("--- Bắt đầu Bước 1: Tạo thành viên và thu thập mối quan hệ ---")
-    create_members_args = []
-    if args.folder:
-        create_members_args.extend(["--folder", args.folder])
-    if args.member_limit > 0:
-        create_members_args.extend(["--member_limit", str(args.member_limit)])
-
-    if not run_script(create_members_script, create_members_args):
+    with profiler.stage("ingest", folder, profile_functions=in_process):
+        if in_process:
+            from vietnamgiapha.api_integration import create_members
+            create_members_ok = run_in_process("create_members", create_members.main, target_folder=folder, member_limit=member_limit)
+        else:
+            create_members_args = []
+            if folder:
+                create_members_args.extend(["--folder", folder])
+            if member_limit > 0:
+                create_members_args.extend(["--member_limit", str(member_limit)])
+            create_members_ok = run_script(CREATE_MEMBERS_MODULE, create_members_args)
+    if not create_members_ok:
         logging.error("Pipeline bị dừng do lỗi trong quá trình tạo thành viên.")
-        return
+        return False
 
     # Bước 2: Chạy update_relationships.py
     logging.info("--- Bắt đầu Bước 2: Cập nhật mối quan hệ ---")
-    update_relationships_args = []
-    if args.folder:
-        update_relationships_args.extend(["--folder", args.folder])
-    if args.relation_limit:
-        update_relationships_args.extend(["--limit", str(args.relation_limit)])
-
-    if not run_script(update_relationships_script, update_relationships_args):
+    with profiler.stage("ingest", folder, profile_functions=in_process):
+        if in_process:
+            from vietnamgiapha.api_integration import update_relationships
+            update_relationships_ok = run_in_process("update_relationships", update_relationships.main, target_folder=folder,
+                                                     limit=relation_limit or 0)
+        else:
+            update_relationships_args = []
+            if folder:
+                update_relationships_args.extend(["--folder", folder])
+            if relation_limit:
+                update_relationships_args.extend(["--limit", str(relation_limit)])
+            update_relationships_ok = run_script(UPDATE_RELATIONSHIPS_MODULE, update_relationships_args)
+    if not update_relationships_ok:
         logging.error("Pipeline bị dừng do lỗi trong quá trình cập nhật mối quan hệ.")
-        return
+        return False
+    return True
 
-    logging.info("--- Pipeline hoàn tất thành công! ---")
+def main():
+    parser = argparse.ArgumentParser(description="Chạy pipeline tạo thành viên và cập nhật mối quan hệ cho hệ thống gia phả.")
+    parser.add_argument("--folder", type=str, help="Chỉ định thư mục gia đình cần xử lý (ví dụ: '1'). Nếu không, tất cả các thư mục sẽ được xử lý.")
+    parser.add_argument("--member_limit", type=int, default=0, help="Giới hạn số lượng thành viên được tạo từ mỗi thư mục. Mặc định là 0 (không giới hạn). (Chỉ áp dụng cho create_members.py)")
+    parser.add_argument("--relation_limit", type=int, help="Chỉ cập nhật mối quan hệ cho N thành viên đầu tiên (theo tên file) của mỗi gia đình, cho mục đích debug hoặc test. (Chỉ áp dụng cho update_relationships.py)")
+    parser.add_argument("--isolation", choices=ISOLATION_MODES, default="inprocess",
+                        help="inprocess: chạy các bước ngay trong tiến trình này (mặc định); subprocess: mỗi bước một tiến trình Python riêng.")
+    profiling.add_profile_arguments(parser)
+    tracing.add_trace_arguments(parser)
+    budget.add_budget_arguments(parser)
+    log_setup.add_logging_arguments(parser)
+    run_status.add_status_arguments(parser)
+    add_member_concurrency_argument(parser)
+    
+    args = parser.parse_args()
+    log_setup.setup_from_args(args)
+    profiling.setup_from_args(args)
+    tracing.setup_from_args(args)
+    budget.setup_from_args(args)
+    setup_member_concurrency(args)
+
+    if args.folder:
+        ingest_ok = ingest_family(args.folder, args.member_limit, args.relation_limit, args.isolation)
+    else:
+        ingest_ok = ingest_all_families(args.member_limit, args.relation_limit, args.isolation,
+                                        run_status.status_path_from_args(args, "ingest"), args.progress_bar)
+    if ingest_ok:
+        logging.info("--- Pipeline hoàn tất thành công! ---")
+    profiling.finish_and_report()
+    tracing.finish_and_write()
+    if not ingest_ok:
+        sys.exit(1) # Let main_pipeline's subprocess mode see the failure
 
 if __name__ == "__main__":
     main()
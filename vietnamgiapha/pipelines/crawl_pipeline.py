@@ -4,12 +4,28 @@ import sys
 import argparse # Import argparse
 
 from ..utils.utils import run_command, check_file_exists
-from ..crawling.crawl_member_details import crawl_member_details
+from ..utils import profiling
+from ..utils import scheduling
+from ..utils import budget
+from ..utils import tracing
+from ..utils import log_setup
+from ..utils import run_status
 
-# Define the paths for scripts
-CRAWL_GIAPHA_SCRIPT = "vietnamgiapha/crawling/crawl_giapha.py"
+# Define the modules for scripts (run with "python -m" so package imports resolve)
+CRAWL_GIAPHA_MODULE = "vietnamgiapha.crawling.crawl_giapha"
 
-async def crawl_pipeline(family_id: str, force: bool = False):
+async def crawl_pipeline(family_id: str, force: bool = False, profile_functions: bool = True):
+    # profile_functions=False when several families share the event loop (see StageProfiler.stage).
+    with profiling.get_profiler().stage("crawl", family_id, profile_functions), \
+            tracing.span("crawl", family_id=family_id) as span:
+        # Vượt ngân sách (thời gian, số request, số thành viên) thì gia đình bị tạm hoãn; các trang đã tải được giữ lại.
+        crawl_ok = False
+        with budget.enforce(family_id, "crawl"):
+            crawl_ok = await _crawl_family(family_id, force)
+        span["ok"] = crawl_ok
+        return crawl_ok
+
+async def _crawl_family(family_id: str, force: bool = False):
     print(f"Starting crawling pipeline for Family ID: {family_id} (Force: {force})")
 
     # --- Define common paths ---
@@ -30,15 +46,15 @@ async def crawl_pipeline(family_id: str, force: bool = False):
     #toc_uoc_html_path = os.path.join(raw_html_dir, "toc_uoc.html")
 
     if not force and not check_file_exists(giapha_html_path, "Main Giapha HTML"):
-        # CRAWL_GIAPHA_SCRIPT now expects the full path for giapha.html and the base dir for other files
-        crawl_giapha_args = ["python3", CRAWL_GIAPHA_SCRIPT, family_id, giapha_html_path, raw_html_dir]
+        # CRAWL_GIAPHA_MODULE expects the full path for giapha.html and the base dir for other files
+        crawl_giapha_args = [sys.executable, "-m", CRAWL_GIAPHA_MODULE, family_id, giapha_html_path, raw_html_dir]
         if force:
             crawl_giapha_args.append("--force")
         if not await run_command(crawl_giapha_args, f"Crawling main family pages for {family_id}"):
             return False
     elif force:
         print(f"Force crawling giapha.html for Family ID: {family_id}")
-        crawl_giapha_args = ["python3", CRAWL_GIAPHA_SCRIPT, family_id, giapha_html_path, raw_html_dir]
+        crawl_giapha_args = [sys.executable, "-m", CRAWL_GIAPHA_MODULE, family_id, giapha_html_path, raw_html_dir]
         crawl_giapha_args.append("--force")
         if not await run_command(crawl_giapha_args, f"Crawling main family pages for {family_id}"):
             return False
@@ -46,6 +62,7 @@ async def crawl_pipeline(family_id: str, force: bool = False):
         print(f"Skipping giapha.html crawling for Family ID: {family_id} as file exists and force is not true.")
     
     # --- Step 1.2: Crawl individual member details HTML pages ---
+    from ..crawling.crawl_member_details import crawl_member_details # aiohttp/bs4 are only needed once we crawl
     # The crawl_member_details.py script now handles individual file existence checks
     # and directly awaits its execution to avoid subprocess issues.
     if not await crawl_member_details(family_id, members_raw_html_dir, pha_he_html_path, force):
@@ -54,21 +71,36 @@ async def crawl_pipeline(family_id: str, force: bool = False):
     print(f"\nCrawling pipeline completed successfully for Family ID: {family_id}")
     return True
 
-async def run_crawl_pipeline_for_range(start_id: int, end_id: int, force: bool = False):
+async def run_crawl_pipeline_for_range(start_id: int, end_id: int, force: bool = False, workers: int = 1,
+                                       status_path: str = None, progress_bar: bool = False):
     failed_crawls = []
+    family_ids = [str(i) for i in range(start_id, end_id + 1)]
+    sizes = {family_id: scheduling.estimate_family_size(family_id) for family_id in family_ids}
+    if workers > 1:
+        # Gia đình lớn (ước lượng từ lần thu thập trước) được bắt đầu trước để không thành phần đuôi dài.
+        family_ids = scheduling.order_largest_first(family_ids, sizes=sizes)
+    semaphore = asyncio.Semaphore(max(1, workers))
+    concurrent_families = min(max(1, workers), len(family_ids))
 
-    for i in range(start_id, end_id + 1):
-        family_id = str(i)
-        print(f"--- Đang xử lý Family ID: {family_id} để thu thập dữ liệu ---")
-        try:
-            success = await crawl_pipeline(family_id, force)
-            if not success:
+    async def crawl_one(family_id: str):
+        async with semaphore:
+            print(f"--- Đang xử lý Family ID: {family_id} để thu thập dữ liệu ---")
+            status.family_started(family_id)
+            success = False
+            try:
+                success = await crawl_pipeline(family_id, force, profile_functions=concurrent_families <= 1)
+                if not success:
+                    failed_crawls.append(family_id)
+                    print(f"Thất bại khi thu thập dữ liệu Family ID: {family_id}")
+            except Exception as e:
                 failed_crawls.append(family_id)
-                print(f"Thất bại khi thu thập dữ liệu Family ID: {family_id}")
-        except Exception as e:
-            failed_crawls.append(family_id)
-            print(f"Có lỗi xảy ra khi thu thập dữ liệu Family ID: {family_id}: {e}")
-        print(f"--- Đã hoàn tất xử lý Family ID: {family_id} để thu thập dữ liệu ---\n")
+                print(f"Có lỗi xảy ra khi thu thập dữ liệu Family ID: {family_id}: {e}")
+            status.family_finished(family_id, success)
+            print(f"--- Đã hoàn tất xử lý Family ID: {family_id} để thu thập dữ liệu ---\n")
+
+    with run_status.RunStatus("crawl", family_ids, status_path, progress_bar, sizes=sizes) as status:
+        await asyncio.gather(*(crawl_one(family_id) for family_id in family_ids))
+    failed_crawls.sort(key=int)
 
     if failed_crawls:
         print(f"\n--- Tóm tắt: Thất bại khi thu thập dữ liệu {len(failed_crawls)} Family ID ---")
@@ -83,11 +115,21 @@ if __name__ == "__main__":
     parser.add_argument("family_id_or_start_id", type=str, help="ID của gia đình hoặc ID bắt đầu cho dải.")
     parser.add_argument("end_id", nargs='?', type=int, help="ID kết thúc cho dải ID gia đình (nếu cung cấp start_id).")
     parser.add_argument("--force", action="store_true", help="Buộc thu thập lại dữ liệu ngay cả khi file đã tồn tại.")
+    parser.add_argument("--workers", type=int, default=1, help="Số gia đình được thu thập đồng thời khi chạy theo dải (gia đình lớn trước).")
+    profiling.add_profile_arguments(parser)
+    tracing.add_trace_arguments(parser)
+    budget.add_budget_arguments(parser)
+    log_setup.add_logging_arguments(parser)
+    run_status.add_status_arguments(parser)
     
     args = parser.parse_args()
+    log_setup.setup_from_args(args)
+    profiling.setup_from_args(args)
+    tracing.setup_from_args(args)
+    budget.setup_from_args(args)
 
     if args.end_id is None: # Single family ID
-        asyncio.run(crawl_pipeline(args.family_id_or_start_id, args.force))
+        crawl_ok = asyncio.run(crawl_pipeline(args.family_id_or_start_id, args.force))
     else: # Range of family IDs
         try:
             start_id = int(args.family_id_or_start_id)
@@ -95,10 +137,15 @@ if __name__ == "__main__":
             if start_id > end_id:
                 print("Lỗi: start_id không được lớn hơn end_id.")
                 sys.exit(1)
-            asyncio.run(run_crawl_pipeline_for_range(start_id, end_id, args.force))
+            crawl_ok = asyncio.run(run_crawl_pipeline_for_range(start_id, end_id, args.force, args.workers,
+                                                                run_status.status_path_from_args(args, "crawl"), args.progress_bar))
         except ValueError:
             print("Lỗi: start_id và end_id phải là số nguyên.")
             print("Cách dùng: python crawl_pipeline.py <family_id> [--force]")
             print("       python crawl_pipeline.py <start_id> <end_id> [--force]")
             sys.exit(1)
+    profiling.finish_and_report()
+    tracing.finish_and_write()
+    if not crawl_ok:
+        sys.exit(1) # Let main_pipeline's subprocess mode see the failure
 
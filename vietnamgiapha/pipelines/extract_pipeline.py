@@ -1,14 +1,259 @@
 import os
 import sys
+import json
+import time
 import asyncio
+import logging
+import argparse
 
 from ..utils.utils import run_command, check_file_exists
+from ..utils import profiling
+from ..utils import tracing
+from ..utils import log_setup
+from ..extraction.llm_based.llm_cache import get_default_cache
+# ollama_client, extract_member_ollama, prompt_compaction and the hybrid extractor pull in aiohttp, requests
+# and bs4, so they are imported where they are used: "--help" and argument errors stay fast.
 
-# Define the paths for scripts
-EXTRACT_GIAPHA_INFO_SCRIPT = "vietnamgiapha/extraction/llm_based/extract_family_ollama.py"
-EXTRACT_MEMBER_INFO_SCRIPT = "vietnamgiapha/extraction/llm_based/extract_member_ollama.py"
+# Define the modules for scripts
+EXTRACT_GIAPHA_INFO_MODULE = "vietnamgiapha.extraction.llm_based.extract_family_ollama"
 
-async def extract_pipeline(family_id: str, limit: int = None):
+logger = logging.getLogger(__name__)
+
+# "hybrid": rule-based first, Ollama only for missing fields; "llm": full Ollama prompt for every member.
+EXTRACTION_MODES = ["hybrid", "llm"]
+
+# Failed members are retried after the main pass: round N waits RETRY_BACKOFF_SECONDS * 2**(N-1),
+# runs at RETRY_TEMPERATURES[N-1] (the last value for later rounds) and avoids the endpoint that failed.
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 2.0
+RETRY_TEMPERATURES = [0.3, 0.0]
+FAILURES_FILENAME = "llm_failures.json"
+
+# Retry rounds run and seconds spent in their backoff sleeps by this process (bench_llm_pipeline leaves them out).
+retry_stats = {"rounds": 0, "wait_seconds": 0.0}
+
+async def extract_single_member(client: "OllamaClient", html_content: str, family_id: str, member_id: str,
+                                cache=None, mode: str = "hybrid", routing_stats: dict = None,
+                                options: dict = None, avoid_urls: set = None) -> dict:
+    """
+    Extracts one member with the hybrid router or the full single-member prompt. In hybrid mode,
+    `routing_stats` ({"rule_based": n, "llm": n}), when given, counts where the member was routed.
+    """
+    from ..extraction.llm_based import extract_member_ollama
+    from ..extraction.hybrid import extract_member_hybrid
+    profiler = profiling.get_profiler()
+    start = time.perf_counter()
+    with tracing.span("llm member", family_id=family_id, member_id=member_id, mode=mode) as span:
+        if mode == "hybrid":
+            extracted_data, missing_fields, filled_fields = await extract_member_hybrid.extract_member_hybrid(
+                client, html_content, family_id, member_id, cache, options, avoid_urls)
+            span["missing_fields"] = len(missing_fields)
+            if missing_fields:
+                profiler.record("llm", time.perf_counter() - start, family_id)
+                if routing_stats is not None:
+                    routing_stats["llm"] += 1
+                logger.debug("Member %s: rule-based thiếu %s; Ollama bổ sung: %s.", member_id,
+                             ", ".join(missing_fields), ", ".join(filled_fields) or "không có")
+            elif routing_stats is not None:
+                routing_stats["rule_based"] += 1
+            return extracted_data
+        extracted_data = await extract_member_ollama.extract_info_with_client(client, html_content, family_id, member_id,
+                                                                              cache, options, avoid_urls)
+    profiler.record("llm", time.perf_counter() - start, family_id)
+    return extracted_data
+
+async def extract_member_batch(client: "OllamaClient", jobs: list, family_id: str, cache=None) -> dict:
+    """
+    Sends `jobs` as one batched prompt. Returns {member_id: member_data} for the valid entries;
+    on any request error the whole batch falls back to single-member calls.
+    """
+    from ..extraction.llm_based import extract_member_ollama
+    pages = []
+    for member_id, member_html_path, _ in jobs:
+        with open(member_html_path, "r", encoding="utf-8") as f:
+            pages.append((family_id, member_id, f.read()))
+    start = time.perf_counter()
+    try:
+        with tracing.span("llm batch", family_id=family_id, members=len(jobs)):
+            results = await extract_member_ollama.extract_batch_with_client(client, pages, cache)
+    except Exception as e:
+        print(f"Batch extraction failed for members {', '.join(job[0] for job in jobs)}: {e}", file=sys.stderr)
+        return {}
+    profiling.get_profiler().record("llm", time.perf_counter() - start, family_id)
+    if len(results) < len(jobs):
+        print(f"Batch of {len(jobs)}: {len(jobs) - len(results)} members invalid or missing, retrying them one by one.")
+    return results
+
+def largest_prompt_sample(member_jobs: list, family_id: str, mode: str, batch_size: int) -> str:
+    """
+    Builds the prompt for the largest member page, repeated `batch_size` times for batched runs,
+    so the client can size num_ctx once for the whole run.
+    """
+    from ..extraction.llm_based import extract_member_ollama
+    member_id, member_html_path, _ = max(member_jobs, key=lambda job: os.path.getsize(job[1]))
+    with open(member_html_path, "r", encoding="utf-8") as f:
+        html_content = f.read()
+    if mode == "llm" and batch_size > 1:
+        return extract_member_ollama.build_member_batch_prompt([(family_id, member_id, html_content)] * batch_size)
+    # Hybrid prompts ask for a subset of the same fields, so the full prompt is an upper bound.
+    return extract_member_ollama.build_member_prompt(html_content, family_id, member_id)
+
+def save_member_json(extracted_data: dict, family_id: str, member_id: str, member_json_path: str):
+    from ..extraction.llm_based.prompt_compaction import compaction_stats
+    with open(member_json_path, "w", encoding="utf-8") as f:
+        json.dump(extracted_data, f, ensure_ascii=False, indent=4)
+    if logger.isEnabledFor(logging.DEBUG): # the compaction summary is only built when it is logged
+        page = f"{family_id}/{member_id}"
+        prompt_note = f" ({compaction_stats.page_summary(page)})" if page in compaction_stats.pages else ""
+        logger.debug("Thông tin thành viên %s đã được trích xuất và lưu vào '%s'.%s", member_id, member_json_path, prompt_note)
+
+def record_failure(client: "OllamaClient", failure: dict, error: Exception):
+    """Updates a retry-queue entry with the reason and endpoint of its latest failed attempt."""
+    from ..extraction.llm_based.ollama_client import classify_error
+    failure["reason"] = classify_error(error)
+    failure["error"] = str(error)[:500]
+    failure["endpoint"] = client.last_endpoint_url()
+    failure["attempts"] = failure.get("attempts", 0) + 1
+
+async def extract_member_worker(client: "OllamaClient", queue: asyncio.Queue, family_id: str, failed: list,
+                                cache=None, mode: str = "hybrid", routing_stats: dict = None, batch_size: int = 1,
+                                progress: log_setup.ProgressLog = None):
+    """
+    Takes up to `batch_size` (member_id, html_path, json_path) jobs off the queue at a time until
+    it is empty and writes each member JSON as soon as its extraction returns. Failed members are
+    appended to `failed` (the retry queue) with their reason; the run carries on. Each member is
+    counted in `progress` (the family's aggregated progress lines).
+    """
+    progress = progress or log_setup.ProgressLog(logger, f"Family {family_id}: trích xuất LLM")
+    while True:
+        jobs = []
+        while len(jobs) < batch_size:
+            try:
+                jobs.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        if not jobs:
+            return
+
+        batch_results = await extract_member_batch(client, jobs, family_id, cache) if len(jobs) > 1 else {}
+        for member_id, member_html_path, member_json_path in jobs:
+            try:
+                extracted_data = batch_results.get(member_id)
+                if extracted_data is None:
+                    with open(member_html_path, "r", encoding="utf-8") as f:
+                        html_content = f.read()
+                    extracted_data = await extract_single_member(client, html_content, family_id, member_id,
+                                                                 cache, mode, routing_stats)
+                save_member_json(extracted_data, family_id, member_id, member_json_path)
+                progress.add("extracted")
+            except Exception as e:
+                failure = {"member_id": member_id, "job": (member_id, member_html_path, member_json_path)}
+                record_failure(client, failure, e)
+                progress.add("failed")
+                progress.warning("Extraction failed for member %s (%s), queued for retry: %s", member_id, failure["reason"], e)
+                failed.append(failure)
+            finally:
+                queue.task_done()
+
+async def retry_failed_members(client: "OllamaClient", failed: list, family_id: str, retries: int,
+                               cache=None, mode: str = "hybrid", routing_stats: dict = None) -> list:
+    """
+    Retries the queued failures one member per request, with exponential backoff between rounds,
+    a lower temperature and a different endpoint than the one that failed. Returns the failures left.
+    """
+    for retry_round in range(1, retries + 1):
+        if not failed:
+            break
+        delay = RETRY_BACKOFF_SECONDS * 2 ** (retry_round - 1)
+        temperature = RETRY_TEMPERATURES[min(retry_round, len(RETRY_TEMPERATURES)) - 1]
+        print(f"\n--- Retry {retry_round}/{retries}: {len(failed)} members in {delay:g}s (temperature {temperature:g}) ---")
+        await asyncio.sleep(delay)
+        retry_stats["rounds"] += 1
+        retry_stats["wait_seconds"] += delay
+
+        async def retry_one(failure: dict) -> bool:
+            member_id, member_html_path, member_json_path = failure["job"]
+            avoid_urls = {failure["endpoint"]} if failure.get("endpoint") else None
+            try:
+                with open(member_html_path, "r", encoding="utf-8") as f:
+                    html_content = f.read()
+                extracted_data = await extract_single_member(client, html_content, family_id, member_id, cache, mode,
+                                                             routing_stats, {"temperature": temperature}, avoid_urls)
+                save_member_json(extracted_data, family_id, member_id, member_json_path)
+                return True
+            except Exception as e:
+                record_failure(client, failure, e)
+                print(f"Retry failed for member {member_id} ({failure['reason']}): {e}", file=sys.stderr)
+                return False
+
+        succeeded = await asyncio.gather(*(retry_one(failure) for failure in failed))
+        failed = [failure for failure, ok in zip(failed, succeeded) if not ok]
+    return failed
+
+def write_failures_file(data_dir: str, failed: list):
+    """Writes the members still failing after all retries to llm_failures.json, or removes a stale one."""
+    failures_path = os.path.join(data_dir, FAILURES_FILENAME)
+    if not failed:
+        if os.path.exists(failures_path):
+            os.remove(failures_path)
+        return
+    entries = [{key: failure.get(key) for key in ("member_id", "reason", "attempts", "endpoint", "error")}
+               for failure in sorted(failed, key=lambda failure: failure["member_id"])]
+    with open(failures_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=4)
+    print(f"Danh sách {len(entries)} thành viên trích xuất thất bại đã được lưu vào '{failures_path}'.", file=sys.stderr)
+
+async def extract_members(family_id: str, member_jobs: list, concurrency: int = None, mode: str = "hybrid",
+                          batch_size: int = 1, retries: int = DEFAULT_RETRIES) -> list:
+    """
+    Extracts all members of a family in-process through one pooled OllamaClient, with
+    `concurrency` requests in flight. In llm mode, `batch_size` > 1 packs that many members
+    into each request. Failures are retried up to `retries` times at the end; returns the
+    retry-queue entries (member_id, reason, attempts, endpoint, ...) of members that still failed.
+    """
+    from ..extraction.llm_based.ollama_client import OllamaClient
+    from ..extraction.llm_based.prompt_compaction import compaction_stats
+    if mode != "llm":
+        batch_size = 1 # Hybrid prompts ask for different fields per member, so they are not batched.
+    batch_size = max(1, batch_size)
+    queue = asyncio.Queue()
+    for job in member_jobs:
+        queue.put_nowait(job)
+    failed = []
+    cache = get_default_cache()
+    routing_stats = {"rule_based": 0, "llm": 0}
+    async with OllamaClient(concurrency=concurrency) as client:
+        # Size the context once for the largest page so the model is not reloaded mid-run. In llm mode every
+        # member needs the model, so load it up front; hybrid runs load it on the first missing field.
+        client.size_context(largest_prompt_sample(member_jobs, family_id, mode, batch_size), client.max_chars * batch_size)
+        if mode == "llm":
+            await client.warm_up()
+        num_workers = min(client.concurrency, -(-len(member_jobs) // batch_size))
+        progress = log_setup.ProgressLog(logger, f"Family {family_id}: trích xuất LLM", total=len(member_jobs))
+        workers = [asyncio.create_task(extract_member_worker(client, queue, family_id, failed, cache, mode,
+                                                             routing_stats, batch_size, progress))
+                   for _ in range(num_workers)]
+        await asyncio.gather(*workers)
+        progress.finish()
+        if failed:
+            reasons = {}
+            for failure in failed:
+                reasons[failure["reason"]] = reasons.get(failure["reason"], 0) + 1
+            print(f"{len(failed)} members failed in the first pass "
+                  f"({', '.join(f'{reason}: {count}' for reason, count in sorted(reasons.items()))}).")
+            failed = await retry_failed_members(client, failed, family_id, retries, cache, mode, routing_stats)
+        if len(client.endpoints) > 1 or client.aborted:
+            print(client.summary())
+    if mode == "hybrid":
+        print(f"Hybrid routing: {routing_stats['rule_based']} members rule-based only, {routing_stats['llm']} sent to Ollama.")
+    if compaction_stats.pages:
+        print(compaction_stats.summary())
+    if cache is not None:
+        print(cache.summary())
+    return failed
+
+async def extract_pipeline(family_id: str, limit: int = None, concurrency: int = None, mode: str = "hybrid",
+                           batch_size: int = 1, retries: int = DEFAULT_RETRIES):
     print(f"Starting extraction pipeline for Family ID: {family_id}")
 
     # --- Define common paths ---
@@ -31,7 +276,7 @@ async def extract_pipeline(family_id: str, limit: int = None):
 
     if not check_file_exists(giapha_info_json_path, "Main Giapha Info JSON"):
         # The extract_giapha_info.py script now expects the path to giapha.html
-        if not await run_command(["python3", EXTRACT_GIAPHA_INFO_SCRIPT, giapha_html_path, giapha_info_json_path, os.getenv("OLLAMA_MODEL", "llama3:8b"), pha_ky_gia_su_html_path, thuy_to_html_path, toc_uoc_html_path],
+        if not await run_command([sys.executable, "-m", EXTRACT_GIAPHA_INFO_MODULE, giapha_html_path, giapha_info_json_path, os.getenv("OLLAMA_MODEL", "llama3:8b"), pha_ky_gia_su_html_path, thuy_to_html_path, toc_uoc_html_path],
                            f"Extracting main family info for {family_id}"):
             return False
     
@@ -46,40 +291,53 @@ async def extract_pipeline(family_id: str, limit: int = None):
             print(f"Limiting member extraction to {limit} files.")
 
         
+        member_jobs = []
         for member_html_filename in member_html_files:
             member_id = member_html_filename.replace('.html', '')
             member_html_path = os.path.join(members_raw_html_dir, member_html_filename)
             member_json_path = os.path.join(members_data_dir, f"{member_id}.json")
 
             if not check_file_exists(member_json_path, f"Member {member_id} Info JSON"):
-                result = await run_command(["python3", EXTRACT_MEMBER_INFO_SCRIPT, member_html_path, family_id],
-                                           f"Extracting info for member {member_id}")
-                if not result:
-                    print(f"Extraction failed for member {member_id}", file=sys.stderr)
-                    return False
-            else:
-                print(f"Member {member_id} JSON file already exists. Skipping.")
+                member_jobs.append((member_id, member_html_path, member_json_path))
+
+        if member_jobs:
+            from ..extraction.llm_based.ollama_client import OLLAMA_CONCURRENCY
+            print(f"\n--- Extracting info for {len(member_jobs)} members (concurrency: {concurrency or OLLAMA_CONCURRENCY}) ---")
+            failed_members = await extract_members(family_id, member_jobs, concurrency, mode, batch_size, retries)
+            write_failures_file(data_dir, failed_members)
+            if failed_members:
+                print(f"Extraction failed for {len(failed_members)} members after {retries} retries: "
+                      f"{', '.join(sorted(failure['member_id'] for failure in failed_members))}", file=sys.stderr)
+                return False
         print("Hoàn thành trích xuất thông tin thành viên.")
 
     print(f"\nExtraction pipeline completed successfully for Family ID: {family_id}")
     return True
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python extract_pipeline.py <family_id> [limit]")
+    parser = argparse.ArgumentParser(description="Extract family and member information from crawled HTML using Ollama.")
+    parser.add_argument("family_id", type=str, help="Family ID to extract (output/<family_id>/raw_html).")
+    parser.add_argument("limit", type=int, nargs="?", help="Only extract the first N member files.")
+    parser.add_argument("--concurrency", type=int,
+                        help="Number of concurrent Ollama generations (default: OLLAMA_CONCURRENCY or 4).")
+    parser.add_argument("--mode", choices=EXTRACTION_MODES, default="hybrid",
+                        help="hybrid: rule-based first, Ollama only for missing fields (default); llm: full Ollama prompt for every member.")
+    parser.add_argument("--batch_size", type=int, default=1,
+                        help="With --mode llm, pack this many members into one Ollama request (default: 1, no batching).")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retry rounds for members whose extraction failed (default: {DEFAULT_RETRIES}).")
+    tracing.add_trace_arguments(parser)
+    log_setup.add_logging_arguments(parser)
+    args = parser.parse_args()
+
+    if args.limit is not None and args.limit < 1:
+        print("Error: limit must be a positive integer.")
+        sys.exit(1)
+
+    log_setup.setup_from_args(args)
+    profiling.configure_from_env()
+    tracing.setup_from_args(args)
+    extract_ok = asyncio.run(extract_pipeline(args.family_id, args.limit, args.concurrency, args.mode, args.batch_size, args.retries))
+    tracing.finish_and_write()
+    if not extract_ok:
         sys.exit(1)
-    
-    target_family_id = sys.argv[1]
-    extraction_limit = None
-    if len(sys.argv) > 2:
-        try:
-            extraction_limit = int(sys.argv[2])
-            if extraction_limit < 1:
-                print("Error: limit must be a positive integer.")
-                sys.exit(1)
-        except ValueError:
-            print("Error: limit must be an integer.")
-            print("Usage: python extract_pipeline.py <family_id> [limit]")
-            sys.exit(1)
-
-    asyncio.run(extract_pipeline(target_family_id, extraction_limit))
\ No newline at end of file
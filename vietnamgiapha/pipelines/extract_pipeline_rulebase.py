@@ -1,9 +1,328 @@
 import os
 import json
+import sys
+import logging
 import argparse
-from vietnamgiapha.extraction.rule_based import extract_family_tree
-from vietnamgiapha.extraction.rule_based import extract_family
-from vietnamgiapha.extraction.rule_based import extract_member
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from vietnamgiapha import data_loader
+from vietnamgiapha import data_store
+from vietnamgiapha.utils import profiling
+from vietnamgiapha.utils import scheduling
+from vietnamgiapha.utils import budget
+from vietnamgiapha.utils import tracing
+from vietnamgiapha.utils import log_setup
+from vietnamgiapha.utils import run_status
+
+logger = logging.getLogger(__name__)
+# Families with more members than this are split into several tasks when running with --workers.
+DEFAULT_CHUNK_SIZE = 500
+
+def extract_family_overview(output_base_path: str, entry_name: str, force: bool = False, load_existing: bool = False):
+    """
+    Extracts family.json and pha_he.json for one family folder. Returns the family data to put in the
+    SQLite store: the freshly extracted data, or (with load_existing) the existing family.json; else None.
+    """
+    from vietnamgiapha.extraction.rule_based import extract_family, extract_family_tree # bs4/lxml: loaded on first use
+    family_folder_path = os.path.join(output_base_path, entry_name)
+    profiler = profiling.get_profiler()
+    store_family = None
+
+    raw_html_dir = os.path.join(family_folder_path, "raw_html")
+    output_data_dir = os.path.join(family_folder_path, "data")
+    os.makedirs(output_data_dir, exist_ok=True)
+
+    # --- Process Family Overview (giapha.html, thuy_to.html, pha_ky_gia_su.html, toc_uoc.html) ---
+    family_output_json_file = os.path.join(output_data_dir, "family.json")
+    if not os.path.exists(family_output_json_file) or force:
+        try:
+            giapha_html_content = ""
+            thuy_to_html_content = ""
+            phaky_html_content = ""
+            tocuoc_html_content = ""
+
+            # Read HTML files for family extraction
+            giapha_path = os.path.join(raw_html_dir, "giapha.html")
+            if os.path.exists(giapha_path):
+                with open(giapha_path, "r", encoding="utf-8") as f:
+                    giapha_html_content = f.read()
+
+            thuy_to_path = os.path.join(raw_html_dir, "thuy_to.html")
+            if os.path.exists(thuy_to_path):
+                with open(thuy_to_path, "r", encoding="utf-8") as f:
+                    thuy_to_html_content = f.read()
+            
+            pha_ky_gia_su_path = os.path.join(raw_html_dir, "pha_ky_gia_su.html")
+            if os.path.exists(pha_ky_gia_su_path):
+                with open(pha_ky_gia_su_path, "r", encoding="utf-8") as f:
+                    phaky_html_content = f.read()
+
+            toc_uoc_path = os.path.join(raw_html_dir, "toc_uoc.html")
+            if os.path.exists(toc_uoc_path):
+                with open(toc_uoc_path, "r", encoding="utf-8") as f:
+                    tocuoc_html_content = f.read()
+
+            with profiler.stage("parse", entry_name), tracing.span("parse family", family_id=entry_name):
+                overview_data = extract_family.extract_overview(giapha_html_content)
+                progenitor_data = extract_family.extract_progenitor(thuy_to_html_content)
+                phaky_data = extract_family.extract_phaky(phaky_html_content)
+                tocuoc_data = extract_family.extract_tocuoc(tocuoc_html_content)
+
+                final_family_data = extract_family.build_schema(overview_data, progenitor_data, phaky_data, tocuoc_data, entry_name)
+
+            with open(family_output_json_file, 'w', encoding='utf-8') as f:
+                json.dump(final_family_data, f, ensure_ascii=False, indent=2)
+            print(f"  Dữ liệu gia đình đã trích xuất thành công và lưu vào: {family_output_json_file}")
+            store_family = final_family_data
+        except Exception as e:
+            print(f"  Lỗi khi xử lý dữ liệu gia đình cho {family_folder_path}: {e}")
+    else:
+        print(f"  File '{family_output_json_file}' đã tồn tại. Bỏ qua.")
+        if load_existing:
+            store_family = data_loader.load_family_data(family_folder_path) or None
+
+    # --- Process Family Tree (pha_he.html) ---
+    pha_he_output_json_file = os.path.join(output_data_dir, "pha_he.json")
+    html_file_path_for_tree = os.path.join(raw_html_dir, "pha_he.html")
+    if not os.path.exists(pha_he_output_json_file) or force:
+        if os.path.exists(html_file_path_for_tree):
+            try:
+                with profiler.stage("tree build", entry_name), tracing.span("tree build", family_id=entry_name):
+                    family_tree_data = extract_family_tree.extract_data(html_file_path_for_tree)
+                with open(pha_he_output_json_file, 'w', encoding='utf-8') as f:
+                    json.dump(family_tree_data, f, ensure_ascii=False, indent=2)
+                print(f"  Dữ liệu cây gia đình đã trích xuất thành công và lưu vào: {pha_he_output_json_file}")
+            except Exception as e:
+                print(f"  Lỗi khi xử lý cây gia đình cho {family_folder_path}: {e}")
+        else:
+            print(f"  Không tìm thấy file pha_he.html tại {html_file_path_for_tree}. Bỏ qua trích xuất cây gia đình.")
+    else:
+        print(f"  File '{pha_he_output_json_file}' đã tồn tại. Bỏ qua.")
+    return store_family
+
+def list_member_html_files(output_base_path: str, entry_name: str):
+    """Sorted raw_html/members/*.html file names of a family, or None if the folder does not exist."""
+    members_raw_html_dir = os.path.join(output_base_path, entry_name, "raw_html", "members")
+    if not os.path.isdir(members_raw_html_dir):
+        return None
+    return sorted(name for name in os.listdir(members_raw_html_dir) if name.endswith(".html"))
+
+def extract_member_files(output_base_path: str, entry_name: str, member_html_filenames: list, force: bool = False,
+                         load_existing: bool = False) -> list:
+    """
+    Extracts data/members/<name>.json for the given raw_html/members files of one family. Returns the
+    (member_file, member_data) pairs for the SQLite bulk load (existing files only with load_existing).
+    """
+    from vietnamgiapha.extraction.rule_based import extract_member
+    family_folder_path = os.path.join(output_base_path, entry_name)
+    profiler = profiling.get_profiler()
+    members_raw_html_dir = os.path.join(family_folder_path, "raw_html", "members")
+    members_output_data_dir = os.path.join(family_folder_path, "data", "members")
+    os.makedirs(members_output_data_dir, exist_ok=True)
+    store_members = [] # (member_file, member_data) pairs for the SQLite bulk load
+    progress = log_setup.ProgressLog(logger, f"Family {entry_name}: trích xuất thành viên", total=len(member_html_filenames))
+
+    for member_html_filename in member_html_filenames:
+        budget.check_time()
+        member_html_file_path = os.path.join(members_raw_html_dir, member_html_filename)
+        base_member_name = os.path.splitext(member_html_filename)[0]
+        member_output_json_file = os.path.join(members_output_data_dir, f"{base_member_name}.json")
+
+        if not os.path.exists(member_output_json_file) or force:
+            try:
+                with tracing.span("read html", "io", member_id=base_member_name), \
+                        open(member_html_file_path, "r", encoding="utf-8") as f:
+                    member_html_content = f.read()
+                
+                with profiler.stage("parse", entry_name), tracing.span("parse member", member_id=base_member_name):
+                    member_data_json_str = extract_member.parse_family_html(
+                        member_html_content, 
+                        family_id=entry_name, 
+                        member_filename=member_html_filename
+                    )
+                    member_data = json.loads(member_data_json_str)
+
+                final_member_output_json_file = os.path.join(members_output_data_dir, f"{base_member_name}.json")
+
+                with tracing.span("write json", "io", member_id=base_member_name), \
+                        open(final_member_output_json_file, 'w', encoding='utf-8') as f:
+                    json.dump(member_data, f, ensure_ascii=False, indent=2)
+                logger.debug("Dữ liệu thành viên '%s' đã trích xuất thành công và lưu vào: %s", base_member_name, final_member_output_json_file)
+                store_members.append((base_member_name, member_data))
+                progress.add("extracted")
+            except Exception as e:
+                progress.add("failed")
+                progress.warning("Lỗi khi xử lý thành viên '%s' cho %s: %s", member_html_filename, family_folder_path, e)
+        else:
+            logger.debug("File '%s' đã tồn tại. Bỏ qua.", member_output_json_file)
+            progress.add("skipped")
+            if load_existing:
+                store_members.append((base_member_name, data_loader.load_member_data(member_output_json_file)))
+    progress.finish()
+    return store_members
+
+def process_family_folder(output_base_path: str, entry_name: str, force: bool = False, store_conn=None):
+    """
+    Extracts family.json, pha_he.json and data/members/*.json for one family folder
+    (output/<entry_name>) and optionally bulk-loads the results into the SQLite store.
+    """
+    family_folder_path = os.path.join(output_base_path, entry_name)
+    print(f"Đang xử lý thư mục gia đình: {family_folder_path}")
+    member_html_filenames = list_member_html_files(output_base_path, entry_name)
+    budget.check_members(len(member_html_filenames or []))
+
+    store_family = extract_family_overview(output_base_path, entry_name, force, load_existing=store_conn is not None)
+    if store_conn is not None and store_family:
+        data_store.upsert_family(store_conn, entry_name, store_family)
+
+    # --- Process Individual Members (raw_html/members/*.html) ---
+    if member_html_filenames is not None:
+        store_members = extract_member_files(output_base_path, entry_name, member_html_filenames, force,
+                                             load_existing=store_conn is not None)
+        if store_conn is not None:
+            loaded_count = data_store.bulk_load_members(store_conn, entry_name, store_members, replace_family=True)
+            print(f"  Đã nạp {loaded_count} thành viên vào kho dữ liệu SQLite.")
+    else:
+        members_raw_html_dir = os.path.join(family_folder_path, "raw_html", "members")
+        print(f"  Không tìm thấy thư mục 'members' tại {members_raw_html_dir}. Bỏ qua trích xuất thành viên.")
+
+def extract_family_folder(family_id: str, output_base_dir: str = "output", force: bool = False, store_conn=None) -> bool:
+    """
+    In-process entry point for one family (used by main_pipeline): runs process_family_folder
+    under the "extract" profiling stage and the family budget. Returns False if the family folder
+    does not exist or the family was deferred for going over its budget.
+    """
+    output_base_path = os.path.abspath(output_base_dir)
+    if not os.path.isdir(os.path.join(output_base_path, family_id)):
+        print(f"Lỗi: Không tìm thấy thư mục gia đình '{family_id}' tại '{output_base_path}'.")
+        return False
+    with profiling.get_profiler().stage("extract", family_id), tracing.span("extract", family_id=family_id):
+        with budget.enforce(family_id, "extract", output_base_dir=output_base_path) as tracker:
+            process_family_folder(output_base_path, family_id, force, store_conn)
+    return tracker.exceeded is None
+
+def _extract_task(output_base_path: str, entry_name: str, member_html_filenames: list, with_overview: bool,
+                  force: bool, for_store: bool):
+    """
+    Pool worker task: one chunk of a family's members, plus family.json/pha_he.json for the family's
+    first chunk. Returns (entry_name, store_family, store_members, seconds, exceeded) for the parent, which
+    adds up the chunks against the family budget and alone writes or clears deferred.json;
+    `exceeded` is (reason, detail) if this chunk alone went over the budget, else None.
+    """
+    profiler = profiling.get_profiler()
+    store_family, store_members = None, []
+    with profiler.stage("extract", entry_name), tracing.span("extract", family_id=entry_name, members=len(member_html_filenames)):
+        with budget.track(entry_name, "extract") as tracker:
+            if with_overview:
+                print(f"Đang xử lý thư mục gia đình: {os.path.join(output_base_path, entry_name)}")
+                store_family = extract_family_overview(output_base_path, entry_name, force, for_store)
+            store_members = extract_member_files(output_base_path, entry_name, member_html_filenames, force, for_store)
+    profiler.save()
+    tracing.get_tracer().save()
+    log_setup.flush()
+    exceeded = (tracker.exceeded.reason, tracker.exceeded.detail) if tracker.exceeded else None
+    return entry_name, store_family, store_members if for_store else [], tracker.elapsed(), exceeded
+
+def _init_worker():
+    """Process-pool initializer: fresh profiler, tracer and log listener for each worker process."""
+    profiling.configure_worker()
+    tracing.configure_worker()
+    log_setup.setup_logging()
+
+def process_families_parallel(output_base_path: str, family_names: list, force: bool = False, store_conn=None,
+                              workers: int = 2, chunk_size: int = DEFAULT_CHUNK_SIZE, status: run_status.RunStatus = None):
+    """
+    Extracts several families in `workers` processes. Families larger than `chunk_size` members are
+    split into chunks, and the largest tasks are submitted first so a huge family cannot end up as the
+    last, lone task of the run. SQLite writes stay in this process, and a family's old member rows are
+    deleted in the transaction that loads its first finished chunk. `status` counts the members of each
+    finished chunk and a family once its last chunk is back.
+
+    The family budget applies to the family as a whole: the chunks' seconds are added up here, the
+    family's chunks that have not started yet are cancelled once it is over budget, and deferred.json is
+    written or cleared only here, after the family's last chunk.
+    """
+    family_budget = budget.FamilyBudget.from_env()
+    tasks = [] # (entry_name, member files, with_overview)
+    chunks_left = {} # entry_name -> chunks still running
+    seconds_used = {} # entry_name -> seconds spent by its finished chunks
+    exceeded = {} # entry_name -> BudgetExceeded once the family is over budget
+    failed_families = set()
+    for entry_name in family_names:
+        member_html_filenames = list_member_html_files(output_base_path, entry_name)
+        if member_html_filenames is None:
+            members_raw_html_dir = os.path.join(output_base_path, entry_name, "raw_html", "members")
+            print(f"  Không tìm thấy thư mục 'members' tại {members_raw_html_dir}. Bỏ qua trích xuất thành viên.")
+            member_html_filenames = []
+        with budget.track(entry_name, "extract", family_budget) as tracker:
+            budget.check_members(len(member_html_filenames))
+        if tracker.exceeded:
+            budget.defer(entry_name, "extract", tracker.exceeded, 0, 0.0, output_base_path)
+            if status is not None:
+                status.family_finished(entry_name, False)
+            continue
+        seconds_used[entry_name] = 0.0
+        for index, chunk in enumerate(scheduling.split_into_chunks(member_html_filenames, chunk_size)):
+            tasks.append((entry_name, chunk, index == 0))
+            chunks_left[entry_name] = chunks_left.get(entry_name, 0) + 1
+    tasks.sort(key=lambda task: -len(task[1]))
+    print(f"Trích xuất {len(family_names)} gia đình ({len(tasks)} phần việc) với {workers} tiến trình, gia đình lớn trước.")
+
+    def finish_family(entry_name: str):
+        if entry_name in failed_families:
+            ok = False # Lỗi không phải do ngân sách: không đổi đánh dấu tạm hoãn
+        elif entry_name in exceeded:
+            budget.defer(entry_name, "extract", exceeded[entry_name], 0, seconds_used[entry_name], output_base_path)
+            ok = False
+        else:
+            budget.clear_deferred(entry_name, "extract", output_base_path)
+            ok = True
+        if status is not None:
+            status.family_finished(entry_name, ok, members=0)
+
+    loaded_counts = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(_extract_task, output_base_path, entry_name, chunk, with_overview, force,
+                                   store_conn is not None): (entry_name, len(chunk))
+                   for entry_name, chunk, with_overview in tasks}
+        for future in as_completed(futures):
+            entry_name, chunk_members = futures[future]
+            chunks_left[entry_name] -= 1
+            if future.cancelled(): # Gia đình đã vượt ngân sách trước khi phần này bắt đầu
+                if not chunks_left[entry_name]:
+                    finish_family(entry_name)
+                continue
+            try:
+                entry_name, store_family, store_members, seconds, chunk_exceeded = future.result()
+            except Exception as e:
+                print(f"  Lỗi khi trích xuất gia đình {entry_name}: {e}")
+                failed_families.add(entry_name)
+                if not chunks_left[entry_name]:
+                    finish_family(entry_name)
+                continue
+            seconds_used[entry_name] += seconds
+            if entry_name not in exceeded:
+                if chunk_exceeded:
+                    exceeded[entry_name] = budget.BudgetExceeded(*chunk_exceeded)
+                elif family_budget.max_seconds is not None and seconds_used[entry_name] > family_budget.max_seconds:
+                    exceeded[entry_name] = budget.BudgetExceeded(
+                        "max_seconds", f"{seconds_used[entry_name]:.1f}s > {family_budget.max_seconds:g}s")
+                if entry_name in exceeded:
+                    for other, (other_name, _) in futures.items():
+                        if other_name == entry_name:
+                            other.cancel() # Chỉ huỷ được các phần chưa bắt đầu
+            if status is not None:
+                run_status.count("members", chunk_members)
+            if store_conn is not None:
+                if store_family:
+                    data_store.upsert_family(store_conn, entry_name, store_family)
+                # Thành viên cũ của gia đình được xoá cùng transaction với phần việc đầu tiên được nạp.
+                first_load = entry_name not in loaded_counts
+                loaded_counts[entry_name] = loaded_counts.get(entry_name, 0) + data_store.bulk_load_members(
+                    store_conn, entry_name, store_members, replace_family=first_load)
+            if not chunks_left[entry_name]:
+                finish_family(entry_name)
+    if store_conn is not None:
+        print(f"  Đã nạp {sum(loaded_counts.values())} thành viên của {len(loaded_counts)} gia đình vào kho dữ liệu SQLite.")
 
 def main():
     parser = argparse.ArgumentParser(description="Process family tree data from HTML files in subfolders.")
@@ -19,7 +338,24 @@ def main():
                         help="Start processing from this family ID (inclusive). Requires --end_id.")
     parser.add_argument("--end_id", type=int,
                         help="End processing at this family ID (inclusive). Requires --start_id.")
+    parser.add_argument("--db_path", type=str,
+                        help="Also bulk-load extracted families and members into this SQLite store (see data_store.py).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of extraction processes. With more than one, the largest families are scheduled first.")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"With --workers, split families with more members than this into chunks (default: {DEFAULT_CHUNK_SIZE}).")
+    run_status.add_status_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    tracing.add_trace_arguments(parser)
+    budget.add_budget_arguments(parser)
+    log_setup.add_logging_arguments(parser)
     args = parser.parse_args()
+    log_setup.setup_from_args(args)
+    profiling.setup_from_args(args)
+    tracing.setup_from_args(args)
+    budget.setup_from_args(args)
+
+    store_conn = data_store.open_store(args.db_path) if args.db_path else None
 
     # Resolve absolute path for the output base directory
     output_base_path = os.path.abspath(args.output_base_dir)
@@ -51,119 +387,38 @@ def main():
             if os.path.isdir(os.path.join(output_base_path, entry_name)) and entry_name.isdigit():
                 family_folders_to_process.append(entry_name)
 
-    for entry_name in family_folders_to_process:
-        family_folder_path = os.path.join(output_base_path, entry_name)
-
-        if args.limit and processed_count >= args.limit:
-            print(f"Đã đạt đến giới hạn {args.limit} thư mục. Dừng xử lý.")
-            break
+    requested_families = list(family_folders_to_process)
+    if args.limit:
+        family_folders_to_process = family_folders_to_process[:args.limit]
+    # Trạng thái lần chạy (file JSON + thanh tiến độ) chỉ dành cho các lần chạy nhiều gia đình.
+    status_path = None if args.family_id else run_status.status_path_from_args(args, "extract", output_base_path)
+    with run_status.RunStatus("extract", family_folders_to_process, status_path, args.progress_bar and not args.family_id,
+                              output_base_dir=output_base_path) as status:
+        if args.workers > 1:
+            process_families_parallel(output_base_path, family_folders_to_process, args.force, store_conn,
+                                      args.workers, args.chunk_size, status)
+            family_folders_to_process = []
 
-        print(f"Đang xử lý thư mục gia đình: {family_folder_path}")
+        for entry_name in family_folders_to_process:
+            if args.limit and processed_count >= args.limit:
+                print(f"Đã đạt đến giới hạn {args.limit} thư mục. Dừng xử lý.")
+                break
 
-        raw_html_dir = os.path.join(family_folder_path, "raw_html")
-        output_data_dir = os.path.join(family_folder_path, "data")
-        os.makedirs(output_data_dir, exist_ok=True)
+            status.family_started(entry_name)
+            status.family_finished(entry_name, extract_family_folder(entry_name, output_base_path, args.force, store_conn))
 
-        # --- Process Family Overview (giapha.html, thuy_to.html, pha_ky_gia_su.html, toc_uoc.html) ---
-        family_output_json_file = os.path.join(output_data_dir, "family.json")
-        if not os.path.exists(family_output_json_file) or args.force:
-            try:
-                giapha_html_content = ""
-                thuy_to_html_content = ""
-                phaky_html_content = ""
-                tocuoc_html_content = ""
-
-                # Read HTML files for family extraction
-                giapha_path = os.path.join(raw_html_dir, "giapha.html")
-                if os.path.exists(giapha_path):
-                    with open(giapha_path, "r", encoding="utf-8") as f:
-                        giapha_html_content = f.read()
-
-                thuy_to_path = os.path.join(raw_html_dir, "thuy_to.html")
-                if os.path.exists(thuy_to_path):
-                    with open(thuy_to_path, "r", encoding="utf-8") as f:
-                        thuy_to_html_content = f.read()
-                
-                pha_ky_gia_su_path = os.path.join(raw_html_dir, "pha_ky_gia_su.html")
-                if os.path.exists(pha_ky_gia_su_path):
-                    with open(pha_ky_gia_su_path, "r", encoding="utf-8") as f:
-                        phaky_html_content = f.read()
+            processed_count += 1
+            print("-" * 50) # Separator for better readability
 
-                toc_uoc_path = os.path.join(raw_html_dir, "toc_uoc.html")
-                if os.path.exists(toc_uoc_path):
-                    with open(toc_uoc_path, "r", encoding="utf-8") as f:
-                        tocuoc_html_content = f.read()
-
-                overview_data = extract_family.extract_overview(giapha_html_content)
-                progenitor_data = extract_family.extract_progenitor(thuy_to_html_content)
-                phaky_data = extract_family.extract_phaky(phaky_html_content)
-                tocuoc_data = extract_family.extract_tocuoc(tocuoc_html_content)
-                
-                final_family_data = extract_family.build_schema(overview_data, progenitor_data, phaky_data, tocuoc_data, entry_name)
-
-                with open(family_output_json_file, 'w', encoding='utf-8') as f:
-                    json.dump(final_family_data, f, ensure_ascii=False, indent=2)
-                print(f"  Dữ liệu gia đình đã trích xuất thành công và lưu vào: {family_output_json_file}")
-            except Exception as e:
-                print(f"  Lỗi khi xử lý dữ liệu gia đình cho {family_folder_path}: {e}")
-        else:
-            print(f"  File '{family_output_json_file}' đã tồn tại. Bỏ qua.")
-
-        # --- Process Family Tree (pha_he.html) ---
-        pha_he_output_json_file = os.path.join(output_data_dir, "pha_he.json")
-        html_file_path_for_tree = os.path.join(raw_html_dir, "pha_he.html")
-        if not os.path.exists(pha_he_output_json_file) or args.force:
-            if os.path.exists(html_file_path_for_tree):
-                try:
-                    family_tree_data = extract_family_tree.extract_data(html_file_path_for_tree)
-                    with open(pha_he_output_json_file, 'w', encoding='utf-8') as f:
-                        json.dump(family_tree_data, f, ensure_ascii=False, indent=2)
-                    print(f"  Dữ liệu cây gia đình đã trích xuất thành công và lưu vào: {pha_he_output_json_file}")
-                except Exception as e:
-                    print(f"  Lỗi khi xử lý cây gia đình cho {family_folder_path}: {e}")
-            else:
-                print(f"  Không tìm thấy file pha_he.html tại {html_file_path_for_tree}. Bỏ qua trích xuất cây gia đình.")
-        else:
-            print(f"  File '{pha_he_output_json_file}' đã tồn tại. Bỏ qua.")
-
-        # --- Process Individual Members (raw_html/members/*.html) ---
-        members_raw_html_dir = os.path.join(raw_html_dir, "members")
-        if os.path.isdir(members_raw_html_dir):
-            members_output_data_dir = os.path.join(output_data_dir, "members")
-            os.makedirs(members_output_data_dir, exist_ok=True)
-
-            for member_html_filename in sorted(os.listdir(members_raw_html_dir)):
-                if member_html_filename.endswith(".html"):
-                    member_html_file_path = os.path.join(members_raw_html_dir, member_html_filename)
-                    base_member_name = os.path.splitext(member_html_filename)[0]
-                    member_output_json_file = os.path.join(members_output_data_dir, f"{base_member_name}.json")
-
-                    if not os.path.exists(member_output_json_file) or args.force:
-                        try:
-                            with open(member_html_file_path, "r", encoding="utf-8") as f:
-                                member_html_content = f.read()
-                            
-                            member_data_json_str = extract_member.parse_family_html(
-                                member_html_content, 
-                                family_id=entry_name, 
-                                member_filename=member_html_filename
-                            )
-                            member_data = json.loads(member_data_json_str)
-
-                            final_member_output_json_file = os.path.join(members_output_data_dir, f"{base_member_name}.json")
-
-                            with open(final_member_output_json_file, 'w', encoding='utf-8') as f:
-                                json.dump(member_data, f, ensure_ascii=False, indent=2)
-                            print(f"  Dữ liệu thành viên '{base_member_name}' đã trích xuất thành công và lưu vào: {final_member_output_json_file}")
-                        except Exception as e:
-                            print(f"  Lỗi khi xử lý thành viên '{member_html_filename}' cho {family_folder_path}: {e}")
-                    else:
-                        print(f"  File '{member_output_json_file}' đã tồn tại. Bỏ qua.")
-        else:
-            print(f"  Không tìm thấy thư mục 'members' tại {members_raw_html_dir}. Bỏ qua trích xuất thành viên.")
-        
-        processed_count += 1
-        print("-" * 50) # Separator for better readability
+    if store_conn is not None:
+        store_conn.close()
+    profiling.finish_and_report()
+    tracing.finish_and_write()
+    deferred = [entry_name for entry_name in requested_families
+                if "extract" in (budget.load_deferred(entry_name, output_base_path) or {})]
+    if deferred:
+        print(f"Tạm hoãn {len(deferred)} gia đình vượt ngân sách: {', '.join(deferred)}")
+        sys.exit(1) # Let main_pipeline's subprocess mode see the deferral
 
 if __name__ == "__main__":
     main()
@@ -3,67 +3,268 @@ import sys
 import logging
 import argparse
 import time
-from .api_ingestion_pipeline import run_script
-# Cấu hình logging cho pipeline chính
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-def main_pipeline(family_id: str, force: bool = False):
-    logging.info(f"--- Bắt đầu pipeline chính cho Family ID: {family_id} (Force: {force}) ---")
-    crawl_module_path = "vietnamgiapha.pipelines.crawl_pipeline"
-    extract_rulebase_module_path = "vietnamgiapha.pipelines.extract_pipeline_rulebase"
-    api_ingestion_module_path = "vietnamgiapha.pipelines.api_ingestion_pipeline"
-    # Bước 1: Chạy pipeline thu thập dữ liệu (crawling)
-    logging.info(f"Bắt đầu Bước 1: Thu thập dữ liệu cho Family ID: {family_id}")
-    crawl_args = [family_id]
-    if force:
-        crawl_args.append("--force")
-    if not run_script(crawl_module_path, crawl_args):
-        logging.error(f"Pipeline chính thất bại trong quá trình thu thập dữ liệu cho Family ID: {family_id}")
-        return False
-    # Bước 2: Chạy pipeline trích xuất dữ liệu dựa trên quy tắc
-    logging.info(f"Bắt đầu Bước 2: Trích xuất dữ liệu dựa trên quy tắc cho Family ID: {family_id}")
-    extract_rulebase_args = ["--output_base_dir", "output", "--family_id", family_id, "--force"] # Added --force as per README example
-    if not run_script(extract_rulebase_module_path, extract_rulebase_args):
-        logging.error(f"Pipeline chính thất bại trong quá trình trích xuất dữ liệu dựa trên quy tắc cho Family ID: {family_id}")
-        return False
-    # Bước 3: Chạy pipeline nhập liệu API
-    logging.info(f"Bắt đầu Bước 3: Nhập liệu API cho Family ID: {family_id}")
-    api_ingestion_args = ["--folder", family_id]
-    if not run_script(api_ingestion_module_path, api_ingestion_args):
-        logging.error(f"Pipeline chính thất bại trong quá trình nhập liệu API cho Family ID: {family_id}")
-        return False
+import queue
+import asyncio
+import threading
+import os
+from .api_ingestion_pipeline import run_script, run_in_process, ingest_family, ISOLATION_MODES
+from .api_ingestion_pipeline import add_member_concurrency_argument, setup_member_concurrency
+from ..utils import profiling
+from ..utils import scheduling
+from ..utils import budget
+from ..utils import tracing
+from ..utils import log_setup
+from ..utils import run_status
+from ..run_journal import RunJournal, DEFAULT_JOURNAL_PATH, fingerprint_paths, extractor_code_fingerprint
+CRAWL_MODULE = "vietnamgiapha.pipelines.crawl_pipeline"
+EXTRACT_RULEBASE_MODULE = "vietnamgiapha.pipelines.extract_pipeline_rulebase"
+API_INGESTION_MODULE = "vietnamgiapha.pipelines.api_ingestion_pipeline"
+def run_crawl_stage(family_id: str, force: bool = False, isolation: str = "inprocess") -> bool:
+    """Bước 1: thu thập HTML của gia đình."""
+    if isolation == "subprocess":
+        crawl_args = [family_id]
+        if force:
+            crawl_args.append("--force")
+        return run_script(CRAWL_MODULE, crawl_args)
+    from .crawl_pipeline import crawl_pipeline # Chỉ nạp aiohttp/bs4 khi thật sự thu thập trong tiến trình này
+    return run_in_process("crawl", lambda: asyncio.run(crawl_pipeline(family_id, force)))
+def run_extract_stage(family_id: str, force: bool = False, isolation: str = "inprocess") -> bool:
+    """Bước 2: trích xuất dữ liệu dựa trên quy tắc."""
+    # Khi đã chạy tới bước này thì HTML (hoặc bộ trích xuất) đã đổi, nên luôn ghi đè (--force) để dữ liệu
+    # khớp với HTML; các gia đình không đổi được nhật ký chạy bỏ qua trước đó.
+    if isolation == "subprocess":
+        return run_script(EXTRACT_RULEBASE_MODULE, ["--output_base_dir", "output", "--family_id", family_id, "--force"])
+    from .extract_pipeline_rulebase import extract_family_folder
+    return run_in_process("extract", extract_family_folder, family_id, "output", True)
+def run_ingest_stage(family_id: str, force: bool = False, isolation: str = "inprocess") -> bool:
+    """Bước 3: tạo thành viên và cập nhật mối quan hệ qua API."""
+    if isolation == "subprocess":
+        return run_script(API_INGESTION_MODULE, ["--folder", family_id, "--isolation", "subprocess"])
+    return run_in_process("ingest", ingest_family, family_id)
+# (tên bước trong profiling, mô tả, hàm chạy bước)
+STAGES = [
+    ("main.crawl", "Thu thập dữ liệu", run_crawl_stage),
+    ("main.extract", "Trích xuất dữ liệu dựa trên quy tắc", run_extract_stage),
+    ("main.ingest", "Nhập liệu API", run_ingest_stage),
+]
+STAGE_KEYS = [stage_name.split(".")[-1] for stage_name, _, _ in STAGES]
+def stage_fingerprints(stage_key: str, family_id: str) -> tuple:
+    """
+    (dấu vân tay đầu vào, dấu vân tay đầu ra) của một bước, dùng để quyết định có chạy lại bước hay không.
+    data/members_processed do bước nhập liệu ghi nên không tính vào đầu ra của bước trích xuất.
+    """
+    raw_html_dir = os.path.join("output", family_id, "raw_html")
+    data_dir = os.path.join("output", family_id, "data")
+    if stage_key == "crawl":
+        return None, fingerprint_paths([raw_html_dir])
+    if stage_key == "extract":
+        raw_fingerprint = fingerprint_paths([raw_html_dir])
+        input_fingerprint = f"{raw_fingerprint}:{extractor_code_fingerprint()}" if raw_fingerprint else None
+        return input_fingerprint, fingerprint_paths([data_dir], exclude_dirs=["members_processed"])
+    return fingerprint_paths([data_dir], exclude_dirs=["members_processed"]), None
+def run_journaled_stage(stage_index: int, family_id: str, force: bool = False, isolation: str = "inprocess",
+                        journal: RunJournal = None, rerun: tuple = ()) -> bool:
+    """
+    Chạy một bước cho một gia đình. Có nhật ký chạy thì bỏ qua bước khi lần chạy trước đã thành công với cùng
+    đầu vào và đầu ra vẫn còn nguyên (trừ khi --force hoặc bước nằm trong `rerun`), và ghi lại kết quả.
+    """
+    stage_name, description, run_stage = STAGES[stage_index]
+    stage_key = STAGE_KEYS[stage_index]
+    if journal is not None:
+        input_fingerprint, output_fingerprint = stage_fingerprints(stage_key, family_id)
+        if not force and stage_key not in rerun and journal.is_current(family_id, stage_key, input_fingerprint, output_fingerprint):
+            tracing.instant(f"{stage_name} skipped", family_id=family_id)
+            logging.info(f"Bỏ qua Bước {stage_index + 1}: {description} cho Family ID: {family_id} (đã cập nhật theo nhật ký chạy)")
+            return True
+        journal.start(family_id, stage_key, input_fingerprint)
+    logging.info(f"Bắt đầu Bước {stage_index + 1}: {description} cho Family ID: {family_id}")
+    stage_ok, error = False, None
+    try:
+        # Với subprocess, tiến trình con tự ghi profile của nó; ở đây chỉ đo thời gian chờ.
+        with profiling.get_profiler().stage(stage_name, family_id, profile_functions=isolation == "inprocess"), \
+                tracing.span(stage_name, family_id=family_id, isolation=isolation) as span:
+            stage_ok = run_stage(family_id, force, isolation)
+            span["ok"] = stage_ok
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        if journal is not None:
+            output_fingerprint = stage_fingerprints(stage_key, family_id)[1] if stage_ok else None
+            journal.finish(family_id, stage_key, stage_ok, output_fingerprint, error)
+    return stage_ok
+def main_pipeline(family_id: str, force: bool = False, isolation: str = "inprocess", journal: RunJournal = None, rerun: tuple = ()):
+    """
+    Chạy lần lượt các bước cho một gia đình. Mặc định mọi bước chạy ngay trong tiến trình này
+    (không khởi động lại Python và nạp lại thư viện cho mỗi bước); isolation="subprocess" chạy
+    mỗi bước bằng "python -m" như trước, với output được in ra ngay khi có. Với `journal`, các bước
+    đã cập nhật từ lần chạy trước được bỏ qua.
+    """
+    logging.info(f"--- Bắt đầu pipeline chính cho Family ID: {family_id} (Force: {force}, Isolation: {isolation}) ---")
+    for stage_index, (_, description, _) in enumerate(STAGES):
+        if not run_journaled_stage(stage_index, family_id, force, isolation, journal, rerun):
+            logging.error(f"Pipeline chính thất bại ở Bước {stage_index + 1} ({description}) cho Family ID: {family_id}")
+            return False
     logging.info(f"--- Pipeline chính hoàn tất thành công cho Family ID: {family_id} ---")
     return True
-def run_pipeline_for_range(start_id: int, end_id: int, force: bool = False, delay: int = 0):
-    failed_ids = []
-    for i in range(start_id, end_id + 1):
-        family_id = str(i)
-        logging.info(f"--- Đang xử lý Family ID: {family_id} (Force: {force}) ---")
+# Báo cho worker của một bước rằng không còn gia đình nào nữa.
+_STAGE_DONE = object()
+def _stage_worker(stage_index: int, in_queue: queue.Queue, out_queue, force: bool, isolation: str,
+                  failures: list, busy_seconds: list, lock: threading.Lock, journal: RunJournal = None, rerun: tuple = (),
+                  status: run_status.RunStatus = None):
+    """
+    Lấy Family ID từ `in_queue`, chạy bước `stage_index` rồi chuyển sang `out_queue` (chặn khi hàng đợi
+    của bước sau đã đầy). Gia đình lỗi được ghi vào `failures` và không đi tiếp; các gia đình khác vẫn chạy.
+    Gia đình được tính là xong trong `status` khi thất bại ở một bước hoặc qua bước cuối cùng.
+    """
+    description = STAGES[stage_index][1]
+    while True:
+        family_id = in_queue.get()
+        if family_id is _STAGE_DONE:
+            return
+        if stage_index == 0 and status is not None:
+            status.family_started(family_id)
+        start = time.perf_counter()
         try:
-            success = main_pipeline(family_id, force) # Call synchronous main_pipeline
-            if not success:
-                failed_ids.append(family_id)
-                logging.warning(f"Failed to process Family ID: {family_id}.")
+            stage_ok = run_journaled_stage(stage_index, family_id, force, isolation, journal, rerun)
         except Exception as e:
-            failed_ids.append(family_id)
-            logging.error(f"An error occurred while processing Family ID: {family_id}: {e}.")
-        logging.info(f"--- Đã hoàn tất xử lý Family ID: {family_id} ---\n")
-        if i < end_id and delay > 0:
-            logging.info(f"Chờ {delay} giây trước khi xử lý Family ID tiếp theo...")
-            time.sleep(delay)
+            logging.exception(f"Lỗi không xác định ở Bước {stage_index + 1} cho Family ID: {family_id}: {e}")
+            stage_ok = False
+        with lock:
+            busy_seconds[stage_index] += time.perf_counter() - start
+            if not stage_ok:
+                failures.append((family_id, description))
+        if not stage_ok:
+            logging.error(f"Pipeline chính thất bại ở Bước {stage_index + 1} ({description}) cho Family ID: {family_id}")
+        elif out_queue is not None:
+            out_queue.put(family_id)
+        else:
+            logging.info(f"--- Pipeline chính hoàn tất thành công cho Family ID: {family_id} ---")
+        if status is not None and (not stage_ok or out_queue is None):
+            status.family_finished(family_id, stage_ok)
+def run_pipeline_staged(family_ids: list, force: bool = False, delay: int = 0, isolation: str = "inprocess",
+                        workers: list = None, queue_size: int = 2, journal: RunJournal = None, rerun: tuple = (),
+                        status: run_status.RunStatus = None) -> list:
+    """
+    Chạy các bước theo kiểu dây chuyền: mỗi bước có `workers[i]` luồng riêng, nối với bước sau bằng hàng đợi
+    giới hạn `queue_size`. Gia đình N+1 được thu thập trong khi N đang trích xuất và N-1 đang nhập liệu API,
+    nên tổng thời gian tiến gần thời gian của bước chậm nhất thay vì tổng ba bước. Khi bước sau chậm hơn,
+    hàng đợi đầy và bước trước tự dừng chờ (backpressure). Khi có bước chạy nhiều worker, gia đình lớn (ước lượng
+    từ file đã có) được đưa vào trước, để gia đình lớn nhất không chạy một mình ở cuối; mỗi bước một worker thì giữ
+    thứ tự ID. Trả về danh sách (Family ID, bước thất bại).
+    """
+    workers = workers or [1] * len(STAGES)
+    if any(stage_workers > 1 for stage_workers in workers):
+        family_ids = scheduling.order_largest_first(family_ids)
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in STAGES]
+    failures, busy_seconds, lock = [], [0.0] * len(STAGES), threading.Lock()
+    threads = []
+    for index in range(len(STAGES)):
+        out_queue = queues[index + 1] if index + 1 < len(STAGES) else None
+        threads.append([threading.Thread(target=_stage_worker, name=f"{STAGES[index][0]}-{n}", daemon=True,
+                                         args=(index, queues[index], out_queue, force, isolation, failures, busy_seconds, lock, journal, rerun, status))
+                        for n in range(max(1, workers[index]))])
+        for thread in threads[-1]:
+            thread.start()
+    start = time.perf_counter()
+    for position, family_id in enumerate(family_ids):
+        if position > 0 and delay > 0:
+            time.sleep(delay) # Giãn cách giữa các lần bắt đầu thu thập, như --delay ở chế độ tuần tự
+        queues[0].put(family_id)
+    # Đóng từng bước theo thứ tự: khi mọi worker của bước trước đã dừng, bước sau không còn việc mới.
+    for index, stage_threads in enumerate(threads):
+        for _ in stage_threads:
+            queues[index].put(_STAGE_DONE)
+        for thread in stage_threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    busy = ", ".join(f"{description}: {busy_seconds[i]:.1f}s/{len(threads[i])} luồng"
+                     for i, (_, description, _) in enumerate(STAGES))
+    logging.info(f"Chế độ dây chuyền: {len(family_ids)} gia đình trong {elapsed:.1f}s (thời gian bận từng bước: {busy})")
+    return failures
+def run_pipeline_for_range(start_id: int, end_id: int, force: bool = False, delay: int = 0, isolation: str = "inprocess",
+                           staged: bool = False, workers: list = None, queue_size: int = 2, journal: RunJournal = None,
+                           rerun: tuple = (), only_deferred: bool = False, status_path: str = None, progress_bar: bool = False):
+    failed_ids = []
+    family_ids = [str(i) for i in range(start_id, end_id + 1)]
+    if only_deferred:
+        # Chạy tiếp các gia đình đã bị tạm hoãn vì vượt ngân sách (phần đã làm được vẫn còn trên đĩa).
+        deferred = set(budget.deferred_families())
+        family_ids = [family_id for family_id in family_ids if family_id in deferred]
+        logging.info(f"Chạy lại {len(family_ids)} gia đình đang tạm hoãn trong dải {start_id}-{end_id}.")
+    with run_status.RunStatus("run", family_ids, status_path, progress_bar) as status:
+        if staged:
+            failures = run_pipeline_staged(family_ids, force, delay, isolation, workers, queue_size, journal, rerun, status)
+            for family_id, description in failures:
+                logging.warning(f"Failed to process Family ID: {family_id} ({description}).")
+            failed_ids = sorted((family_id for family_id, _ in failures), key=int)
+        else:
+            for position, family_id in enumerate(family_ids):
+                logging.info(f"--- Đang xử lý Family ID: {family_id} (Force: {force}) ---")
+                status.family_started(family_id)
+                success = False
+                try:
+                    success = main_pipeline(family_id, force, isolation, journal, rerun) # Call synchronous main_pipeline
+                    if not success:
+                        failed_ids.append(family_id)
+                        logging.warning(f"Failed to process Family ID: {family_id}.")
+                except Exception as e:
+                    failed_ids.append(family_id)
+                    logging.error(f"An error occurred while processing Family ID: {family_id}: {e}.")
+                status.family_finished(family_id, success)
+                logging.info(f"--- Đã hoàn tất xử lý Family ID: {family_id} ---\n")
+                if position < len(family_ids) - 1 and delay > 0:
+                    logging.info(f"Chờ {delay} giây trước khi xử lý Family ID tiếp theo...")
+                    time.sleep(delay)
+    deferred_ids = [family_id for family_id in failed_ids if budget.load_deferred(family_id)]
+    failed_ids = [family_id for family_id in failed_ids if family_id not in deferred_ids]
+    if deferred_ids:
+        logging.warning(f"\n--- Tạm hoãn {len(deferred_ids)} Family ID vượt ngân sách: {', '.join(deferred_ids)} ---")
+        logging.warning("Chạy tiếp các gia đình này sau bằng --deferred (có thể kèm ngân sách lớn hơn).")
     if failed_ids:
         logging.error(f"\n--- Tóm tắt: Thất bại khi xử lý {len(failed_ids)} Family ID ---")
         logging.error(f"Các ID thất bại: {', '.join(failed_ids)}")
-    else:
+    elif not deferred_ids:
         logging.info("\n--- Tóm tắt: Tất cả Family ID đã được xử lý thành công ---")
+    if journal is not None:
+        logging.info(f"Nhật ký chạy ({journal.db_path}): {journal.summary()}")
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Điều phối toàn bộ quy trình (thu thập, trích xuất, nhập liệu API).")
     parser.add_argument("family_id_or_start_id", type=str, help="ID của gia đình hoặc ID bắt đầu cho dải.")
     parser.add_argument("end_id", nargs='?', type=int, help="ID kết thúc cho dải ID gia đình (nếu cung cấp start_id).")
     parser.add_argument("--force", action="store_true", help="Buộc thu thập/trích xuất/nhập liệu lại dữ liệu ngay cả khi file đã tồn tại.")
     parser.add_argument("--delay", type=int, default=0, help="Thời gian chờ (giây) giữa các lần xử lý Family ID khi chạy theo dải.")
+    parser.add_argument("--isolation", choices=ISOLATION_MODES, default="inprocess",
+                        help="inprocess: chạy các bước ngay trong tiến trình này (mặc định); subprocess: mỗi bước một tiến trình Python riêng.")
+    parser.add_argument("--staged", action="store_true",
+                        help="Khi chạy theo dải: chạy các bước song song kiểu dây chuyền (thu thập gia đình sau trong khi trích xuất/nhập liệu gia đình trước).")
+    parser.add_argument("--crawl_workers", type=int, default=1, help="Số luồng thu thập khi dùng --staged.")
+    parser.add_argument("--extract_workers", type=int, default=1, help="Số luồng trích xuất khi dùng --staged.")
+    parser.add_argument("--ingest_workers", type=int, default=1, help="Số luồng nhập liệu API khi dùng --staged.")
+    add_member_concurrency_argument(parser)
+    parser.add_argument("--queue_size", type=int, default=2, help="Số gia đình tối đa chờ giữa hai bước khi dùng --staged.")
+    parser.add_argument("--journal", type=str, default=DEFAULT_JOURNAL_PATH,
+                        help=f"File SQLite ghi trạng thái từng bước của từng gia đình, để chạy lại thì bỏ qua phần đã xong (mặc định: {DEFAULT_JOURNAL_PATH}).")
+    parser.add_argument("--no_journal", action="store_true", help="Không dùng nhật ký chạy: chạy lại mọi bước như trước đây.")
+    parser.add_argument("--rerun", action="append", choices=STAGE_KEYS, default=[],
+                        help="Chạy lại bước này dù nhật ký cho biết đã cập nhật (có thể lặp lại, ví dụ --rerun ingest).")
+    parser.add_argument("--deferred", action="store_true",
+                        help="Chỉ chạy các gia đình đang bị tạm hoãn (vượt ngân sách) trong dải.")
+    profiling.add_profile_arguments(parser)
+    tracing.add_trace_arguments(parser)
+    budget.add_budget_arguments(parser)
+    log_setup.add_logging_arguments(parser)
+    run_status.add_status_arguments(parser)
     args = parser.parse_args()
+    log_setup.setup_from_args(args)
+    profiling.setup_from_args(args)
+    tracing.setup_from_args(args)
+    budget.setup_from_args(args)
+    setup_member_concurrency(args)
+    journal = None if args.no_journal else RunJournal(args.journal)
+    rerun = tuple(args.rerun)
     if args.end_id is None: # Single family ID
-        main_pipeline(args.family_id_or_start_id, args.force)
+        main_pipeline(args.family_id_or_start_id, args.force, args.isolation, journal, rerun)
     else: # Range of family IDs
         try:
             start_id = int(args.family_id_or_start_id)
@@ -71,9 +272,15 @@ if __name__ == "__main__":
             if start_id > end_id:
                 logging.error("Lỗi: start_id không thể lớn hơn end_id.")
                 sys.exit(1)
-            run_pipeline_for_range(start_id, end_id, args.force, args.delay)
+            run_pipeline_for_range(start_id, end_id, args.force, args.delay, args.isolation, args.staged,
+                                   [args.crawl_workers, args.extract_workers, args.ingest_workers], args.queue_size,
+                                   journal, rerun, args.deferred, run_status.status_path_from_args(args, "run"), args.progress_bar)
         except ValueError:
             logging.error("Lỗi: start_id và end_id phải là số nguyên.")
             logging.error("Cách dùng: python main_pipeline.py <family_id> [--force]")
             logging.error("       python main_pipeline.py <start_id> <end_id> [--force]")
             sys.exit(1)
+    if journal is not None:
+        journal.close()
+    profiling.finish_and_report()
+    tracing.finish_and_write()
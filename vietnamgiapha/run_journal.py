@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL_PATH = os.path.join("output", "run_journal.sqlite")
+
+# Mỗi (gia đình, bước) có một dòng: trạng thái lần chạy gần nhất, thời gian và dấu vân tay (fingerprint)
+# của đầu vào/đầu ra. Bước được coi là "còn mới" khi lần chạy trước thành công, đầu vào không đổi và
+# đầu ra trên đĩa vẫn đúng như lúc ghi.
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS stage_runs (
+    family_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    input_fingerprint TEXT,
+    output_fingerprint TEXT,
+    started_at REAL,
+    finished_at REAL,
+    seconds REAL,
+    error TEXT,
+    PRIMARY KEY (family_id, stage)
+);
+"""
+
+STATUS_RUNNING = "running"
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+# Mã nguồn của bộ trích xuất theo luật: sửa code thì các gia đình được trích xuất lại.
+_EXTRACTOR_SOURCES = [
+    os.path.join(os.path.dirname(__file__), "extraction", "rule_based"),
+    os.path.join(os.path.dirname(__file__), "pipelines", "extract_pipeline_rulebase.py"),
+]
+_code_fingerprint = None
+
+
+def fingerprint_paths(paths: Iterable[str], exclude_dirs: Iterable[str] = ()) -> Optional[str]:
+    """
+    Dấu vân tay rẻ của các file trong `paths` (đường dẫn tương đối, kích thước, mtime), không đọc nội dung.
+    Trả về None khi không có file nào.
+    """
+    exclude = set(exclude_dirs)
+    entries = []
+    for root in paths:
+        if os.path.isfile(root):
+            stat = os.stat(root)
+            entries.append(f"{os.path.basename(root)}:{stat.st_size}:{stat.st_mtime_ns}")
+            continue
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in exclude:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            entries.append(f"{os.path.relpath(entry.path, root)}:{stat.st_size}:{stat.st_mtime_ns}")
+            except FileNotFoundError:
+                continue
+    if not entries:
+        return None
+    entries.sort()
+    return hashlib.sha1("\n".join(entries).encode("utf-8")).hexdigest()
+
+
+def extractor_code_fingerprint() -> str:
+    """Băm nội dung mã nguồn bộ trích xuất theo luật (tính một lần cho mỗi tiến trình)."""
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        digest = hashlib.sha1()
+        for source in _EXTRACTOR_SOURCES:
+            files = [source] if os.path.isfile(source) else sorted(
+                os.path.join(source, name) for name in os.listdir(source) if name.endswith(".py"))
+            for path in files:
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        _code_fingerprint = digest.hexdigest()
+    return _code_fingerprint
+
+
+class RunJournal:
+    """
+    Nhật ký chạy bền vững (SQLite) cho main_pipeline. Dùng chung được giữa các luồng của chế độ --staged.
+
+        journal = RunJournal()
+        if not journal.is_current(family_id, "extract", input_fp, output_fp):
+            journal.start(family_id, "extract", input_fp)
+            ...
+            journal.finish(family_id, "extract", ok, output_fp)
+    """
+
+    def __init__(self, db_path: str = DEFAULT_JOURNAL_PATH):
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA_SQL)
+
+    def get(self, family_id: str, stage: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute("SELECT * FROM stage_runs WHERE family_id = ? AND stage = ?",
+                                      (family_id, stage)).fetchone()
+
+    def is_current(self, family_id: str, stage: str, input_fingerprint: Optional[str],
+                   output_fingerprint: Optional[str]) -> bool:
+        """True nếu lần chạy trước của bước này thành công với cùng đầu vào và đầu ra chưa bị thay đổi."""
+        row = self.get(family_id, stage)
+        return (row is not None and row["status"] == STATUS_OK
+                and row["input_fingerprint"] == input_fingerprint
+                and row["output_fingerprint"] == output_fingerprint)
+
+    def start(self, family_id: str, stage: str, input_fingerprint: Optional[str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stage_runs (family_id, stage, status, input_fingerprint, started_at) VALUES (?, ?, ?, ?, ?)",
+                (family_id, stage, STATUS_RUNNING, input_fingerprint, time.time()))
+
+    def finish(self, family_id: str, stage: str, ok: bool, output_fingerprint: Optional[str] = None, error: str = None):
+        finished_at = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE stage_runs SET status = ?, output_fingerprint = ?, finished_at = ?, seconds = ? - started_at, error = ? "
+                "WHERE family_id = ? AND stage = ?",
+                (STATUS_OK if ok else STATUS_FAILED, output_fingerprint, finished_at, finished_at, error, family_id, stage))
+
+    def summary(self) -> dict:
+        """Số (gia đình, bước) theo từng trạng thái, ví dụ {"crawl": {"ok": 120, "failed": 3}}."""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, status, COUNT(*) AS n FROM stage_runs GROUP BY stage, status").fetchall()
+        result = {}
+        for row in rows:
+            result.setdefault(row["stage"], {})[row["status"]] = row["n"]
+        return result
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Ngân sách tài nguyên cho mỗi gia đình ở từng bước (thu thập, trích xuất, nhập liệu API): thời gian chạy,
+# số request và số thành viên tối đa. Gia đình vượt ngân sách bị tạm hoãn: phần đã làm được giữ nguyên trên
+# đĩa, một file đánh dấu output/<id>/deferred.json được ghi lại, và pipeline chuyển sang gia đình tiếp theo.
+# Giống profiling, cấu hình được truyền xuống tiến trình con qua biến môi trường.
+MAX_SECONDS_ENV = "VGP_FAMILY_MAX_SECONDS"
+MAX_REQUESTS_ENV = "VGP_FAMILY_MAX_REQUESTS"
+MAX_MEMBERS_ENV = "VGP_FAMILY_MAX_MEMBERS"
+
+DEFERRED_FILENAME = "deferred.json"
+
+# Ngân sách đang áp dụng cho luồng / task asyncio hiện tại (None: không giới hạn).
+_current_tracker = ContextVar("family_budget_tracker", default=None)
+
+
+class BudgetExceeded(BaseException):
+    """
+    Raised inside a stage when a family goes over its budget. Derives from BaseException (like
+    asyncio.CancelledError) so the many `except Exception` handlers along the way do not swallow it;
+    enforce() turns it into a parked family.
+    """
+
+    def __init__(self, reason: str, detail: str):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
+        self.detail = detail
+
+
+class FamilyBudget:
+    """Giới hạn cho một gia đình ở một bước; None nghĩa là không giới hạn."""
+
+    def __init__(self, max_seconds: float = None, max_requests: int = None, max_members: int = None):
+        self.max_seconds = max_seconds
+        self.max_requests = max_requests
+        self.max_members = max_members
+
+    @property
+    def enabled(self) -> bool:
+        return any(limit is not None for limit in (self.max_seconds, self.max_requests, self.max_members))
+
+    @classmethod
+    def from_env(cls) -> "FamilyBudget":
+        def read(name, cast):
+            value = os.getenv(name)
+            return cast(value) if value else None
+        return cls(read(MAX_SECONDS_ENV, float), read(MAX_REQUESTS_ENV, int), read(MAX_MEMBERS_ENV, int))
+
+    def export_to_env(self):
+        """Cho các tiến trình con (isolation=subprocess) dùng cùng ngân sách."""
+        for name, value in ((MAX_SECONDS_ENV, self.max_seconds), (MAX_REQUESTS_ENV, self.max_requests),
+                            (MAX_MEMBERS_ENV, self.max_members)):
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = str(value)
+
+
+class BudgetTracker:
+    """Đếm thời gian và số request của một gia đình trong một bước; vượt giới hạn thì ném BudgetExceeded."""
+
+    def __init__(self, budget: FamilyBudget, family_id: str, stage: str):
+        self.budget = budget
+        self.family_id = family_id
+        self.stage = stage
+        self.requests = 0
+        self.exceeded = None # BudgetExceeded khi gia đình đã bị tạm hoãn
+        self._start = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def check_time(self):
+        if self.budget.max_seconds is not None and self.elapsed() > self.budget.max_seconds:
+            raise BudgetExceeded("max_seconds", f"{self.elapsed():.1f}s > {self.budget.max_seconds:g}s")
+
+    def charge_request(self, count: int = 1):
+        self.requests += count
+        if self.budget.max_requests is not None and self.requests > self.budget.max_requests:
+            raise BudgetExceeded("max_requests", f"{self.requests} > {self.budget.max_requests}")
+        self.check_time()
+
+    def check_members(self, count: int):
+        if self.budget.max_members is not None and count > self.budget.max_members:
+            raise BudgetExceeded("max_members", f"{count} > {self.budget.max_members}")
+
+
+def charge_request(count: int = 1):
+    """Tính `count` request vào ngân sách hiện tại (nếu có). Gọi trước mỗi request mạng."""
+    tracker = _current_tracker.get()
+    if tracker is not None:
+        tracker.charge_request(count)
+
+
+def check_time():
+    tracker = _current_tracker.get()
+    if tracker is not None:
+        tracker.check_time()
+
+
+def check_members(count: int):
+    tracker = _current_tracker.get()
+    if tracker is not None:
+        tracker.check_members(count)
+
+
+def deferred_path(family_id: str, output_base_dir: str = "output") -> str:
+    return os.path.join(output_base_dir, str(family_id), DEFERRED_FILENAME)
+
+
+def load_deferred(family_id: str, output_base_dir: str = "output"):
+    """Thông tin tạm hoãn của gia đình ({stage: {...}}), hoặc None nếu gia đình không bị tạm hoãn."""
+    try:
+        with open(deferred_path(family_id, output_base_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_deferred(family_id: str, output_base_dir: str, deferred: dict):
+    path = deferred_path(family_id, output_base_dir)
+    if not deferred:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(deferred, f, ensure_ascii=False, indent=2)
+
+
+def deferred_families(output_base_dir: str = "output") -> list:
+    """Các Family ID đang bị tạm hoãn (có file deferred.json), theo thứ tự số."""
+    try:
+        entries = os.listdir(output_base_dir)
+    except FileNotFoundError:
+        return []
+    family_ids = [entry for entry in entries if entry.isdigit() and os.path.exists(deferred_path(entry, output_base_dir))]
+    return sorted(family_ids, key=int)
+
+
+@contextmanager
+def track(family_id: str, stage: str, budget: FamilyBudget = None):
+    """
+    Như enforce() nhưng không đọc hay ghi deferred.json: BudgetExceeded được chặn và gán vào `tracker.exceeded`.
+    Dùng cho một phần việc của gia đình (chunk trong process pool); tiến trình cha gộp kết quả các phần rồi mới
+    gọi defer() hoặc clear_deferred() cho cả gia đình.
+    """
+    budget = budget or FamilyBudget.from_env()
+    tracker = BudgetTracker(budget, family_id, stage)
+    token = _current_tracker.set(tracker if budget.enabled else None)
+    try:
+        yield tracker
+    except BudgetExceeded as e:
+        tracker.exceeded = e
+    finally:
+        _current_tracker.reset(token)
+
+
+def defer(family_id: str, stage: str, exceeded: BudgetExceeded, requests: int, seconds: float,
+          output_base_dir: str = "output"):
+    """Ghi gia đình vào deferred.json cho bước `stage` (các bước khác giữ nguyên)."""
+    deferred = load_deferred(family_id, output_base_dir) or {}
+    deferred[stage] = {"reason": exceeded.reason, "detail": exceeded.detail, "requests": requests,
+                       "seconds": round(seconds, 1), "deferred_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+    _write_deferred(family_id, output_base_dir, deferred)
+    print(f"Family ID {family_id} vượt ngân sách ở bước '{stage}' ({exceeded}); tạm hoãn, phần đã làm được giữ lại.")
+
+
+def clear_deferred(family_id: str, stage: str, output_base_dir: str = "output"):
+    """Xoá đánh dấu tạm hoãn cũ của bước `stage` sau khi bước chạy xong trong ngân sách."""
+    deferred = load_deferred(family_id, output_base_dir)
+    if deferred and stage in deferred:
+        del deferred[stage]
+        _write_deferred(family_id, output_base_dir, deferred)
+
+
+@contextmanager
+def enforce(family_id: str, stage: str, budget: FamilyBudget = None, output_base_dir: str = "output"):
+    """
+    Áp dụng ngân sách (mặc định: đọc từ biến môi trường) cho khối lệnh của một bước. Khi vượt ngân sách,
+    BudgetExceeded bị chặn tại đây, gia đình được ghi vào deferred.json và `tracker.exceeded` được đặt;
+    bước chạy xong bình thường thì xoá đánh dấu tạm hoãn cũ của bước này.
+
+        with budget.enforce(family_id, "crawl") as tracker:
+            ...
+        if tracker.exceeded:
+            return False
+    """
+    with track(family_id, stage, budget) as tracker:
+        yield tracker
+    if tracker.exceeded:
+        defer(family_id, stage, tracker.exceeded, tracker.requests, tracker.elapsed(), output_base_dir)
+    else:
+        clear_deferred(family_id, stage, output_base_dir)
+
+
+def add_budget_arguments(parser):
+    """Adds the shared per-family budget options to an argparse parser."""
+    parser.add_argument("--max_family_seconds", type=float,
+                        help="Thời gian tối đa (giây) cho mỗi bước của một gia đình; vượt quá thì tạm hoãn gia đình.")
+    parser.add_argument("--max_family_requests", type=int,
+                        help="Số request mạng tối đa cho mỗi bước của một gia đình.")
+    parser.add_argument("--max_family_members", type=int,
+                        help="Số thành viên tối đa của một gia đình; gia đình lớn hơn bị tạm hoãn.")
+
+
+def setup_from_args(args) -> FamilyBudget:
+    """Dùng ngân sách từ dòng lệnh nếu có (và truyền xuống tiến trình con), nếu không thì từ biến môi trường."""
+    budget = FamilyBudget(args.max_family_seconds, args.max_family_requests, args.max_family_members)
+    if budget.enabled:
+        budget.export_to_env()
+        return budget
+    return FamilyBudget.from_env()
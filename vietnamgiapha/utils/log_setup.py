@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+
+# Logging dùng chung cho các pipeline. Bản ghi log chỉ được đưa vào một hàng đợi; một luồng riêng
+# (QueueListener) mới định dạng (msg % args, thời gian) và ghi ra stderr, nên các vòng lặp nóng (thu thập,
+# trích xuất, gọi API) không phải chờ terminal hay pipe của tiến trình cha. Chi tiết theo từng thành viên /
+# từng request ở mức DEBUG; ở mức INFO chỉ có các dòng tiến độ gộp định kỳ (ProgressLog). Giống profiling,
+# mức log được truyền xuống tiến trình con qua biến môi trường.
+LOG_LEVEL_ENV = "VGP_LOG_LEVEL"
+PROGRESS_INTERVAL_ENV = "VGP_LOG_PROGRESS_SECONDS"
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+DEFAULT_PROGRESS_INTERVAL = 5.0
+# Số cảnh báo theo từng mục được ghi đầy đủ cho mỗi ProgressLog; các cảnh báo sau chỉ được đếm (nội dung ở DEBUG).
+MAX_ITEM_WARNINGS = 10
+
+_listener = None
+_listener_pid = None
+_lock = threading.Lock()
+
+
+class _QueueHandler(logging.Handler):
+    """
+    Puts records on the listener's queue as they are. Unlike logging.handlers.QueueHandler it does not
+    format them first, so `logger.debug("...: %s", LazyJson(data))` costs nothing but the queue put.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__()
+        self.queue = log_queue
+
+    def emit(self, record):
+        self.queue.put_nowait(record)
+
+
+class LazyJson:
+    """Defers json.dumps(obj, indent=2) until a record is actually written: logger.debug("...: %s", LazyJson(data))."""
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return json.dumps(self.obj, ensure_ascii=False, indent=2)
+
+
+def setup_logging(level: str = None):
+    """
+    Cài handler hàng đợi cho root logger, một lần cho mỗi tiến trình; gọi lại chỉ đổi mức log. `level`: DEBUG,
+    INFO, ... hoặc None để lấy từ VGP_LOG_LEVEL (mặc định INFO). Tiến trình con tạo bằng fork (worker của
+    ProcessPoolExecutor) thừa hưởng handler nhưng không có luồng ghi log, nên ở đó handler được cài lại.
+    """
+    global _listener, _listener_pid
+    from logging.handlers import QueueListener # kéo theo socket/pickle: chỉ nạp khi thật sự chạy
+    level = (level or os.getenv(LOG_LEVEL_ENV) or "INFO").upper()
+    root = logging.getLogger()
+    root.setLevel(level)
+    with _lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, stream_handler)
+        _listener.start()
+        _listener_pid = os.getpid()
+        root.addHandler(_QueueHandler(log_queue))
+        atexit.register(_listener.stop) # stop() ghi nốt các bản ghi còn trong hàng đợi
+
+
+def flush():
+    """Chờ luồng ghi log ghi hết hàng đợi (worker của process pool thoát mà không chạy atexit)."""
+    with _lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+            _listener.start()
+
+
+class ProgressLog:
+    """
+    Tiến độ gộp cho một vòng lặp nóng, thay cho một dòng log mỗi mục. Gọi add(kết quả) sau mỗi mục; tối đa
+    mỗi `interval` giây (VGP_LOG_PROGRESS_SECONDS, mặc định 5) có một dòng INFO
+    "label: 120/1500 (35.2/s; saved 100, skipped 20)", và finish() ghi dòng tổng kết. warning() ghi đầy đủ
+    MAX_ITEM_WARNINGS cảnh báo đầu tiên, các cảnh báo sau chỉ được đếm. Dùng trong một luồng / một event loop.
+    """
+
+    def __init__(self, logger: logging.Logger, label: str, total: int = None, interval: float = None):
+        self.logger = logger
+        self.label = label
+        self.total = total
+        if interval is None:
+            interval = float(os.getenv(PROGRESS_INTERVAL_ENV) or DEFAULT_PROGRESS_INTERVAL)
+        self.interval = interval
+        self.done = 0
+        self.counts = {}
+        self.warnings = 0
+        self._start = self._last = time.monotonic()
+
+    def add(self, outcome: str = "ok", count: int = 1):
+        self.done += count
+        self.counts[outcome] = self.counts.get(outcome, 0) + count
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._emit(now)
+
+    def warning(self, msg: str, *args):
+        """Cảnh báo cho một mục, có giới hạn: sau MAX_ITEM_WARNINGS cảnh báo, nội dung chỉ còn ở mức DEBUG."""
+        self.warnings += 1
+        if self.warnings <= MAX_ITEM_WARNINGS:
+            self.logger.warning(msg, *args)
+            if self.warnings == MAX_ITEM_WARNINGS:
+                self.logger.warning("%s: đã có %d cảnh báo, các cảnh báo tiếp theo chỉ được đếm (xem --log_level DEBUG).",
+                                    self.label, MAX_ITEM_WARNINGS)
+        else:
+            self.logger.debug(msg, *args)
+
+    def _emit(self, now: float, finished: bool = False):
+        elapsed = now - self._start
+        position = str(self.done) if self.total is None else f"{self.done}/{self.total}"
+        details = [f"{outcome} {count}" for outcome, count in self.counts.items()]
+        if self.warnings:
+            details.append(f"{self.warnings} cảnh báo")
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        self.logger.info("%s: %s%s (%.1f/s%s%s)", self.label, "xong " if finished else "", position, rate,
+                         f", {elapsed:.1f}s" if finished else "", "; " + ", ".join(details) if details else "")
+
+    def finish(self):
+        """Dòng tổng kết, luôn được ghi (kể cả khi vòng lặp ngắn hơn `interval`)."""
+        self._emit(time.monotonic(), finished=True)
+
+
+def add_logging_arguments(parser):
+    """Adds the shared --log_level option to an argparse parser."""
+    parser.add_argument("--log_level", type=str.upper, choices=LOG_LEVELS,
+                        help="Mức log (mặc định: VGP_LOG_LEVEL hoặc INFO). DEBUG ghi chi tiết từng thành viên và từng request.")
+
+
+def setup_from_args(args):
+    """Dùng --log_level nếu có (và truyền xuống tiến trình con), nếu không thì mức từ biến môi trường."""
+    level = getattr(args, "log_level", None)
+    if level:
+        os.environ[LOG_LEVEL_ENV] = level
+    setup_logging(level)
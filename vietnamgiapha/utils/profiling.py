@@ -0,0 +1,241 @@
+import os
+import io
+import json
+import time
+import atexit
+import random
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Environment variables used to hand the profiling setup down to child processes
+# (run_script / run_command), so their timings land in the same report.
+PROFILE_DIR_ENV = "VGP_PROFILE_DIR"
+PROFILE_SAMPLE_RATE_ENV = "VGP_PROFILE_SAMPLE_RATE"
+PROFILE_NESTED_ENV = "VGP_PROFILE_NESTED"
+
+DEFAULT_PROFILE_ROOT = "profiles"
+
+# Stage nesting depth of the current thread or asyncio task: concurrent tasks on one event loop (crawl --workers)
+# and stage threads (main_pipeline --staged) each start at depth 0.
+_stage_depth = ContextVar("profiler_stage_depth", default=0)
+
+
+class StageProfiler:
+    """
+    Records wall time per (stage, family) and, for sampled families, a cProfile of the
+    outermost stage. Disabled profilers turn every call into a cheap no-op.
+    """
+
+    def __init__(self, enabled: bool = False, output_dir: str = None, sample_rate: float = 1.0, nested: bool = False):
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.nested = nested # True in child processes: their spans are already covered by the parent's
+        self.records = []
+        self._profile_lock = threading.Lock()
+        self._profile = None # At most one cProfile runs at a time, in whichever thread started it
+        self._sampled_families = {}
+
+    def _is_sampled(self, family_id) -> bool:
+        if family_id is None:
+            return False
+        if family_id not in self._sampled_families:
+            # Seeded per family so parent and child processes agree on the sample.
+            self._sampled_families[family_id] = random.Random(str(family_id)).random() < self.sample_rate
+        return self._sampled_families[family_id]
+
+    @contextmanager
+    def stage(self, stage: str, family_id: str = None, profile_functions: bool = True):
+        """
+        Times the enclosed block as `stage` for `family_id`. Pass profile_functions=False
+        for stages that only wait on a child process, whose own profile is more useful, and for
+        families that run as concurrent asyncio tasks: cProfile sees the whole thread, so the
+        sampled family's profile would also absorb every other task's work.
+        """
+        if not self.enabled:
+            yield
+            return
+        depth = _stage_depth.get()
+        top_level = depth == 0 and not self.nested
+        start_profile = False
+        if profile_functions and self._is_sampled(family_id):
+            with self._profile_lock:
+                if self._profile is None:
+                    self._profile = cProfile.Profile()
+                    start_profile = True
+        if start_profile:
+            self._profile.enable()
+        token = _stage_depth.set(depth + 1)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _stage_depth.reset(token)
+            if start_profile:
+                self._profile.disable()
+                self._save_profile(self._profile, stage, family_id)
+                with self._profile_lock:
+                    self._profile = None
+            self.records.append({"stage": stage, "family_id": family_id, "seconds": elapsed, "top_level": top_level})
+
+    def record(self, stage: str, seconds: float, family_id: str = None):
+        """Adds an externally measured duration (e.g. one API round trip)."""
+        if self.enabled:
+            self.records.append({"stage": stage, "family_id": family_id, "seconds": seconds, "top_level": False})
+
+    def _save_profile(self, profile: cProfile.Profile, stage: str, family_id):
+        safe_stage = stage.replace(" ", "_").replace("/", "_")
+        path = os.path.join(self.output_dir, f"{os.getpid()}-{safe_stage}-{family_id}-{time.time_ns()}.prof")
+        profile.dump_stats(path)
+
+    def save(self):
+        """Writes this process's timings next to the .prof files."""
+        if not self.enabled or not self.records:
+            return
+        path = os.path.join(self.output_dir, f"timings-{os.getpid()}-{time.time_ns()}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.records, f)
+        self.records = []
+
+
+_profiler = StageProfiler()
+
+
+def get_profiler() -> StageProfiler:
+    """Returns the process-wide profiler (disabled unless configured)."""
+    return _profiler
+
+
+def enable_profiling(output_dir: str = None, sample_rate: float = 1.0) -> StageProfiler:
+    """
+    Enables profiling for this process (the root of a run) and exports the setup
+    to the environment so child processes started afterwards record into the same directory.
+    """
+    global _profiler
+    if output_dir is None:
+        output_dir = os.path.join(DEFAULT_PROFILE_ROOT, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(output_dir, exist_ok=True)
+    output_dir = os.path.abspath(output_dir)
+    _profiler = StageProfiler(enabled=True, output_dir=output_dir, sample_rate=sample_rate)
+    os.environ[PROFILE_DIR_ENV] = output_dir
+    os.environ[PROFILE_SAMPLE_RATE_ENV] = str(sample_rate)
+    os.environ[PROFILE_NESTED_ENV] = "1"
+    atexit.register(_profiler.save)
+    return _profiler
+
+
+def configure_from_env() -> StageProfiler:
+    """Enables profiling in a child process if its parent exported a profile directory."""
+    global _profiler
+    output_dir = os.getenv(PROFILE_DIR_ENV)
+    if output_dir and not _profiler.enabled:
+        sample_rate = float(os.getenv(PROFILE_SAMPLE_RATE_ENV, "1.0"))
+        _profiler = StageProfiler(enabled=True, output_dir=output_dir, sample_rate=sample_rate,
+                                  nested=os.getenv(PROFILE_NESTED_ENV) == "1")
+        atexit.register(_profiler.save)
+    return _profiler
+
+
+def configure_worker() -> StageProfiler:
+    """
+    Initializer for process-pool workers: replaces the profiler inherited through fork (and its records)
+    with an empty one writing into the run's profile directory. Workers call save() after each task,
+    since pool processes exit without running atexit handlers.
+    """
+    global _profiler
+    output_dir = os.getenv(PROFILE_DIR_ENV)
+    _profiler = StageProfiler(enabled=bool(output_dir), output_dir=output_dir,
+                              sample_rate=float(os.getenv(PROFILE_SAMPLE_RATE_ENV, "1.0")))
+    return _profiler
+
+
+def add_profile_arguments(parser):
+    """Adds the shared --profile options to an argparse parser."""
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile each stage (cProfile/pstats) and print a timing report at the end.")
+    parser.add_argument("--profile_dir", type=str,
+                        help=f"Directory for .prof and timing files (default: {DEFAULT_PROFILE_ROOT}/<timestamp>).")
+    parser.add_argument("--profile_sample_rate", type=float, default=1.0,
+                        help="Fraction of families to run under cProfile (stage timings are always recorded).")
+
+
+def setup_from_args(args) -> StageProfiler:
+    """Enables profiling when --profile was given, otherwise inherits it from a parent process."""
+    if getattr(args, "profile", False):
+        return enable_profiling(args.profile_dir, args.profile_sample_rate)
+    return configure_from_env()
+
+
+def _load_records(output_dir: str) -> list:
+    records = []
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.startswith("timings-") and filename.endswith(".json"):
+            with open(os.path.join(output_dir, filename), "r", encoding="utf-8") as f:
+                records.extend(json.load(f))
+    return records
+
+
+def build_report(output_dir: str, top_families: int = 10, top_functions: int = 25) -> str:
+    """Merges every timing and .prof file in `output_dir` into a text report, slowest first."""
+    records = _load_records(output_dir)
+    lines = []
+
+    stage_totals = {}
+    for record in records:
+        totals = stage_totals.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "max": 0.0})
+        totals["calls"] += 1
+        totals["seconds"] += record["seconds"]
+        totals["max"] = max(totals["max"], record["seconds"])
+    lines.append("=== Stage timings (slowest first) ===")
+    lines.append(f"{'stage':<28} {'calls':>8} {'total (s)':>11} {'mean (ms)':>11} {'max (s)':>9}")
+    for stage, totals in sorted(stage_totals.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        mean_ms = totals["seconds"] / totals["calls"] * 1000
+        lines.append(f"{stage:<28} {totals['calls']:>8} {totals['seconds']:>11.2f} {mean_ms:>11.1f} {totals['max']:>9.2f}")
+
+    family_totals = {}
+    for record in records:
+        if record["family_id"] is None:
+            continue
+        breakdown = family_totals.setdefault(str(record["family_id"]), {"total": 0.0, "stages": {}})
+        if record["top_level"]:
+            breakdown["total"] += record["seconds"]
+        breakdown["stages"][record["stage"]] = breakdown["stages"].get(record["stage"], 0.0) + record["seconds"]
+    if family_totals:
+        lines.append("")
+        lines.append(f"=== Slowest families (top {top_families}) ===")
+        ranked = sorted(family_totals.items(), key=lambda item: item[1]["total"], reverse=True)[:top_families]
+        for family_id, breakdown in ranked:
+            stages = ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in
+                               sorted(breakdown["stages"].items(), key=lambda item: item[1], reverse=True))
+            lines.append(f"{family_id:<10} {breakdown['total']:>9.2f}s  ({stages})")
+
+    prof_files = [os.path.join(output_dir, filename) for filename in sorted(os.listdir(output_dir)) if filename.endswith(".prof")]
+    if prof_files:
+        stream = io.StringIO()
+        stats = pstats.Stats(prof_files[0], stream=stream)
+        for prof_file in prof_files[1:]:
+            stats.add(prof_file)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(top_functions)
+        lines.append("")
+        lines.append(f"=== Top functions by cumulative time ({len(prof_files)} profiled stages) ===")
+        lines.append(stream.getvalue().strip())
+
+    return "\n".join(lines)
+
+
+def finish_and_report(profiler: StageProfiler = None):
+    """Saves pending timings and, for the root process, prints and stores the merged report."""
+    profiler = profiler or _profiler
+    if not profiler.enabled or profiler.nested:
+        return
+    profiler.save()
+    report = build_report(profiler.output_dir)
+    report_path = os.path.join(profiler.output_dir, "report.txt")
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    print(report)
+    print(f"\nProfile report written to: {report_path}")
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+
+from . import budget
+from . import scheduling
+
+# Trạng thái của một lần chạy theo dải (crawl / extract / ingest / run): số gia đình và thành viên đã xong, tốc
+# độ hiện tại (trang/giây, thành viên/giây, lời gọi API/giây), số lỗi và thời gian dự kiến còn lại. Trạng thái được
+# ghi lại định kỳ vào một file JSON (ghi file tạm rồi os.replace, nên người đọc không bao giờ thấy file dở dang),
+# và có thể hiện thêm một thanh tiến độ trên terminal. Dùng để quyết định thêm worker hay giảm tải cho job dài ngày.
+
+DEFAULT_INTERVAL = 2.0
+# Tốc độ "hiện tại" được tính trên cửa sổ trượt này (giây).
+RATE_WINDOW_SECONDS = 120.0
+BAR_WIDTH = 30
+
+# Bộ đếm dùng chung trong tiến trình, tăng ở các điểm nóng: "pages" (trang thành viên đã tải), "api_calls"
+# (request tới backend), "errors" (trang hoặc request lỗi). Tiến trình con (--isolation subprocess) và worker
+# của process pool có bộ đếm riêng, không được cộng vào đây; số gia đình và thành viên thì vẫn đầy đủ.
+_counters = {"pages": 0, "members": 0, "api_calls": 0, "errors": 0}
+_counters_lock = threading.Lock()
+
+
+def count(name: str, amount: int = 1):
+    with _counters_lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def counters() -> dict:
+    with _counters_lock:
+        return dict(_counters)
+
+
+def format_duration(seconds: float) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f"{seconds // 86400}d{seconds % 86400 // 3600:02d}h"
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+class RunStatus:
+    """
+    Theo dõi một lần chạy theo dải. Vòng lặp gọi family_started() / family_finished() cho mỗi gia đình; một luồng
+    nền ghi lại file trạng thái (và thanh tiến độ) mỗi `interval` giây, kể cả khi một gia đình lớn đang chạy lâu.
+
+        with run_status.RunStatus("crawl", family_ids, status_path) as status:
+            status.family_started(family_id)
+            ...
+            status.family_finished(family_id, ok)
+
+    Số thành viên của một gia đình được đếm khi gia đình xong (ước lượng từ file trên đĩa, như scheduling), trừ khi
+    vòng lặp truyền `members`. ETA: số thành viên còn lại / tốc độ thành viên khi biết kích thước mọi gia đình còn
+    lại, nếu không thì số gia đình còn lại / tốc độ gia đình.
+    """
+
+    def __init__(self, command: str, family_ids: list, status_path: str = None, bar: bool = False,
+                 interval: float = DEFAULT_INTERVAL, sizes: dict = None, output_base_dir: str = "output"):
+        self.command = command
+        self.family_ids = [str(family_id) for family_id in family_ids]
+        self.status_path = status_path
+        self.bar = bar and sys.stderr.isatty()
+        self.interval = interval
+        self.output_base_dir = output_base_dir
+        if sizes is None:
+            sizes = {family_id: scheduling.estimate_family_size(family_id, output_base_dir) for family_id in self.family_ids}
+        self.sizes = sizes
+        self.outcomes = {} # family_id -> "done" | "failed" | "deferred"
+        self.running = {} # family_id -> thời điểm bắt đầu
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock() # luồng nền và vòng lặp cùng có thể ghi file
+        self._start = time.monotonic()
+        self._started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self._base_counters = counters()
+        self._samples = deque() # (thời điểm, số gia đình đã xong, bộ đếm) cho cửa sổ trượt
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        self.refresh()
+        self._thread = threading.Thread(target=self._refresh_loop, name="run-status", daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def family_started(self, family_id: str):
+        with self._lock:
+            self.running[str(family_id)] = time.monotonic()
+
+    def family_finished(self, family_id: str, ok: bool, members: int = None):
+        """Ghi nhận một gia đình đã xong: thất bại vì vượt ngân sách (có deferred.json) được tính là "deferred"."""
+        family_id = str(family_id)
+        if ok:
+            outcome = "done"
+            if members is None:
+                members = scheduling.estimate_family_size(family_id, self.output_base_dir)
+            count("members", members)
+        else:
+            outcome = "deferred" if budget.load_deferred(family_id, self.output_base_dir) else "failed"
+        with self._lock:
+            self.running.pop(family_id, None)
+            self.outcomes[family_id] = outcome
+        self.refresh()
+
+    def _rates(self, now: float, finished: int, current: dict):
+        """Tốc độ trên cửa sổ trượt (mẫu cũ nhất còn trong cửa sổ -> bây giờ) và số gia đình xong trong cửa sổ."""
+        self._samples.append((now, finished, current))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= RATE_WINDOW_SECONDS:
+            self._samples.popleft()
+        then, finished_then, counters_then = self._samples[0]
+        window = now - then
+        rates = {}
+        for name in ("pages", "members", "api_calls"):
+            rates[f"{name}_per_sec"] = round((current[name] - counters_then[name]) / window, 2) if window > 0 else 0.0
+        families_window = finished - finished_then
+        rates["families_per_min"] = round(families_window / window * 60, 2) if window > 0 else 0.0
+        return rates, families_window
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        base = self._base_counters
+        current = {name: value - base.get(name, 0) for name, value in counters().items()}
+        with self._lock:
+            outcomes = dict(self.outcomes)
+            running = sorted(self.running, key=self.running.get)
+            finished = len(outcomes)
+            rates, families_window = self._rates(now, finished, current)
+        elapsed = now - self._start
+        remaining = [family_id for family_id in self.family_ids if family_id not in outcomes]
+        remaining_members = [self.sizes.get(family_id, 0) for family_id in remaining]
+        eta = None
+        if remaining and all(remaining_members) and current["members"] > 0:
+            # Gia đình lớn được xếp trước, nên tính theo thành viên chính xác hơn theo số gia đình.
+            member_rate = rates["members_per_sec"] or current["members"] / elapsed
+            eta = sum(remaining_members) / member_rate if member_rate > 0 else None
+        elif remaining and finished:
+            family_rate = rates["families_per_min"] / 60 if families_window else finished / elapsed
+            eta = len(remaining) / family_rate if family_rate > 0 else None
+        elif not remaining:
+            eta = 0
+        tally = {outcome: sum(1 for value in outcomes.values() if value == outcome) for outcome in ("done", "failed", "deferred")}
+        return {
+            "command": self.command,
+            "pid": os.getpid(),
+            "started_at": self._started_at,
+            "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "elapsed_seconds": round(elapsed, 1),
+            "finished": self._stop.is_set(),
+            "families": {"total": len(self.family_ids), "finished": finished, **tally, "running": running},
+            "members": {"done": current["members"], "estimated_total": sum(self.sizes.get(f, 0) for f in self.family_ids)},
+            "rates": rates,
+            "totals": {"pages": current["pages"], "api_calls": current["api_calls"]},
+            "errors": {"families_failed": tally["failed"], "requests": current["errors"]},
+            "eta_seconds": None if eta is None else round(eta),
+            "eta_at": None if eta is None else time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + eta)),
+        }
+
+    def refresh(self):
+        status = self.snapshot()
+        with self._write_lock:
+            if self.status_path:
+                try:
+                    self._write(status)
+                except OSError as e: # Ổ đĩa đầy, thư mục bị xoá...: không làm hỏng lần chạy
+                    print(f"Không thể ghi file trạng thái '{self.status_path}': {e}", file=sys.stderr)
+            if self.bar:
+                sys.stderr.write("\r\x1b[K" + self.format_line(status))
+                sys.stderr.flush()
+
+    def _write(self, status: dict):
+        directory = os.path.dirname(os.path.abspath(self.status_path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(status, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.status_path)
+
+    @staticmethod
+    def format_line(status: dict) -> str:
+        families = status["families"]
+        total = families["total"] or 1
+        filled = int(BAR_WIDTH * families["finished"] / total)
+        rates = status["rates"]
+        problems = families["failed"] + families["deferred"]
+        return (f"[{'#' * filled}{'.' * (BAR_WIDTH - filled)}] {families['finished']}/{families['total']} gia đình"
+                f"{f' ({problems} lỗi/tạm hoãn)' if problems else ''} | {status['members']['done']} thành viên | "
+                f"{rates['members_per_sec']:.1f} tv/s, {rates['pages_per_sec']:.1f} trang/s, {rates['api_calls_per_sec']:.1f} API/s"
+                f" | lỗi request {status['errors']['requests']} | ETA {format_duration(status['eta_seconds'])}")
+
+    def close(self):
+        """Dừng luồng nền và ghi trạng thái cuối cùng ("finished": true)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.refresh()
+        if self.bar:
+            sys.stderr.write("\n")
+        if len(self.family_ids) < 2:
+            return # Một gia đình: các dòng log của nó đã đủ
+        status = self.snapshot()
+        print(f"Trạng thái {self.command}: {self.format_line(status)}" + (f" (file: {self.status_path})" if self.status_path else ""))
+
+
+def default_status_path(command: str, output_base_dir: str = "output") -> str:
+    return os.path.join(output_base_dir, f"{command}_status.json")
+
+
+def add_status_arguments(parser):
+    """Adds the shared status-file / progress-bar options to an argparse parser (used by range runs)."""
+    parser.add_argument("--status_file", type=str,
+                        help="File JSON trạng thái của lần chạy theo dải, ghi lại định kỳ (mặc định: output/<lệnh>_status.json).")
+    parser.add_argument("--no_status_file", action="store_true", help="Không ghi file trạng thái.")
+    parser.add_argument("--progress_bar", action="store_true", help="Hiện thanh tiến độ trên terminal (stderr).")
+
+
+def status_path_from_args(args, command: str, output_base_dir: str = "output") -> str:
+    """Đường dẫn file trạng thái theo --status_file / --no_status_file (None: không ghi file)."""
+    if getattr(args, "no_status_file", False):
+        return None
+    return getattr(args, "status_file", None) or default_status_path(command, output_base_dir)
@@ -0,0 +1,52 @@
+import os
+import re
+
+# Thứ tự xử lý cho các lần chạy theo dải: gia đình lớn trước (largest-first), để khi chạy song song
+# một gia đình rất lớn không bị xếp cuối và kéo dài thời gian chạy của cả dải.
+
+# Liên kết tới trang thành viên trong pha_he.html (giống crawl_member_details).
+MEMBER_LINK_PATTERN = re.compile(r"javascript:o\(\d+,\d+\)")
+
+
+def _count_files(directory: str, suffix: str) -> int:
+    try:
+        with os.scandir(directory) as it:
+            return sum(1 for entry in it if entry.name.endswith(suffix))
+    except FileNotFoundError:
+        return 0
+
+
+def estimate_family_size(family_id: str, output_base_dir: str = "output") -> int:
+    """
+    Ước lượng số thành viên của một gia đình từ các file đã có trên đĩa, theo thứ tự rẻ nhất:
+    số file data/members/*.json, số file raw_html/members/*.html, rồi số liên kết thành viên trong
+    raw_html/pha_he.html. Trả về 0 khi chưa có gì (gia đình chưa được thu thập).
+    """
+    family_dir = os.path.join(output_base_dir, str(family_id))
+    count = _count_files(os.path.join(family_dir, "data", "members"), ".json")
+    if not count:
+        count = _count_files(os.path.join(family_dir, "raw_html", "members"), ".html")
+    if not count:
+        try:
+            with open(os.path.join(family_dir, "raw_html", "pha_he.html"), "r", encoding="utf-8", errors="replace") as f:
+                count = len(MEMBER_LINK_PATTERN.findall(f.read()))
+        except FileNotFoundError:
+            pass
+    return count
+
+
+def order_largest_first(family_ids: list, output_base_dir: str = "output", sizes: dict = None) -> list:
+    """
+    Sắp xếp `family_ids` theo kích thước ước lượng giảm dần. Các gia đình cùng kích thước (kể cả các gia
+    đình chưa biết kích thước, xếp cuối) giữ nguyên thứ tự ban đầu.
+    """
+    if sizes is None:
+        sizes = {family_id: estimate_family_size(family_id, output_base_dir) for family_id in family_ids}
+    return sorted(family_ids, key=lambda family_id: -sizes.get(family_id, 0))
+
+
+def split_into_chunks(items: list, chunk_size: int) -> list:
+    """Chia `items` thành các phần liên tiếp có tối đa `chunk_size` phần tử (chunk_size <= 0: không chia)."""
+    if chunk_size <= 0 or len(items) <= chunk_size:
+        return [items]
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import heapq
+import atexit
+import threading
+from contextlib import contextmanager
+
+# Span tracing in the Chrome trace event format (chrome://tracing, https://ui.perfetto.dev): one timeline
+# per run showing where each family's time goes (HTTP waits, parsing, JSON writes, API calls, subprocess
+# start-up) and how much actually runs concurrently. Like profiling, the setup is handed down to child
+# processes through the environment; every process writes its own part files and the root process merges
+# them into <trace_dir>/trace.json at the end.
+TRACE_DIR_ENV = "VGP_TRACE_DIR"
+TRACE_NESTED_ENV = "VGP_TRACE_NESTED"
+# Set by spawn_env() for a child process: when its parent started it, so the child can show its start-up.
+TRACE_SPAWN_ENV = "VGP_TRACE_SPAWN_US"
+
+DEFAULT_TRACE_ROOT = "traces"
+TRACE_FILENAME = "trace.json"
+# Events kept in memory before they are written to a part file.
+FLUSH_EVERY = 20000
+# Spans of asyncio tasks are drawn on their own rows ("async N"), numbered above any real thread id.
+ASYNC_LANE_BASE = 100000000
+
+
+class Tracer:
+    """
+    Collects complete ("X") events for spans. Spans of one thread or one asyncio task nest on the same row;
+    concurrent tasks get separate rows, which are reused once a task's outermost span has ended.
+    Disabled tracers turn every span into a cheap no-op.
+    """
+
+    def __init__(self, enabled: bool = False, output_dir: str = None, nested: bool = False, process_name: str = None):
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.nested = nested # True in child processes: the root process merges the part files
+        self.events = []
+        self._pid = os.getpid()
+        # Wall-clock anchor so that events of different processes line up; perf_counter for the durations.
+        self._anchor_us = time.time_ns() / 1000
+        self._anchor_perf_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._task_lanes = {} # asyncio task -> [lane, open spans]
+        self._free_lanes = []
+        self._lane_count = 0
+        self._named_threads = set()
+        self._parts = 0
+        if enabled:
+            name = process_name or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+            self._metadata("process_name", 0, f"{name} ({self._pid})")
+
+    def now_us(self) -> float:
+        return self._anchor_us + (time.perf_counter_ns() - self._anchor_perf_ns) / 1000
+
+    def _metadata(self, kind: str, tid: int, name: str):
+        self.events.append({"name": kind, "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}})
+
+    def _enter_lane(self):
+        """Row for a span starting now: the asyncio task's lane, or the thread id outside of tasks."""
+        # asyncio is not imported here (it is slow to import): without it there can be no running task.
+        asyncio = sys.modules.get("asyncio")
+        try:
+            task = asyncio.current_task() if asyncio is not None else None
+        except RuntimeError: # No running event loop in this thread
+            task = None
+        if task is None:
+            tid = threading.get_native_id()
+            if tid not in self._named_threads:
+                with self._lock:
+                    self._named_threads.add(tid)
+                    self._metadata("thread_name", tid, threading.current_thread().name)
+            return tid, None
+        with self._lock:
+            entry = self._task_lanes.get(task)
+            if entry is None:
+                if self._free_lanes:
+                    lane = heapq.heappop(self._free_lanes)
+                else:
+                    self._lane_count += 1
+                    lane = ASYNC_LANE_BASE + self._lane_count
+                    self._metadata("thread_name", lane, f"async {self._lane_count}")
+                entry = self._task_lanes[task] = [lane, 0]
+            entry[1] += 1
+        return entry[0], task
+
+    def _exit_lane(self, task):
+        if task is None:
+            return
+        with self._lock:
+            entry = self._task_lanes[task]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._task_lanes[task]
+                heapq.heappush(self._free_lanes, entry[0])
+
+    @contextmanager
+    def span(self, name: str, cat: str = "pipeline", **attrs):
+        """
+        Records the enclosed block as one span. Yields the span's attribute dict, so results known only at
+        the end (HTTP status, counts) can be added: `with tracer.span("GET", url=url) as attrs: attrs["status"] = ...`.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        tid, task = self._enter_lane()
+        start = self.now_us()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            end = self.now_us()
+            self._exit_lane(task)
+            self.add_event(name, start, end - start, tid, cat, attrs)
+
+    def add_event(self, name: str, start_us: float, duration_us: float = None, tid: int = None, cat: str = "pipeline",
+                  attrs: dict = None):
+        """Adds a span measured elsewhere (e.g. a child process's start-up), or an instant event without duration."""
+        if not self.enabled:
+            return
+        event = {"name": name, "cat": cat, "ts": round(start_us, 1), "pid": self._pid,
+                 "tid": threading.get_native_id() if tid is None else tid}
+        if duration_us is None:
+            event.update(ph="i", s="t")
+        else:
+            event.update(ph="X", dur=round(duration_us, 1))
+        if attrs:
+            event["args"] = {key: value if isinstance(value, (int, float, bool)) or value is None else str(value)
+                             for key, value in attrs.items()}
+        with self._lock:
+            self.events.append(event)
+            full = len(self.events) >= FLUSH_EVERY
+        if full:
+            self.save()
+
+    def save(self):
+        """Writes the pending events of this process to a part file in the trace directory."""
+        if not self.enabled:
+            return
+        with self._lock:
+            events, self.events = self.events, []
+            self._parts += 1
+            part = self._parts
+        if not events:
+            return
+        path = os.path.join(self.output_dir, f"part-{self._pid}-{time.time_ns()}-{part}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(events, f, ensure_ascii=False)
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """Returns the process-wide tracer (disabled unless configured)."""
+    return _tracer
+
+
+def span(name: str, cat: str = "pipeline", **attrs):
+    """Shortcut for get_tracer().span(...)."""
+    return _tracer.span(name, cat, **attrs)
+
+
+def instant(name: str, cat: str = "pipeline", **attrs):
+    """Marks a point in time on the current thread's row (e.g. a stage skipped by the run journal)."""
+    if _tracer.enabled:
+        _tracer.add_event(name, _tracer.now_us(), cat=cat, attrs=attrs)
+
+
+def spawn_env(env: dict = None):
+    """
+    Environment for a child process started now: records the spawn time so the child's trace shows its
+    interpreter start-up and imports. Returns `env` unchanged (None: inherit) when tracing is off.
+    """
+    if not _tracer.enabled:
+        return env
+    env = dict(os.environ if env is None else env)
+    env[TRACE_SPAWN_ENV] = str(int(_tracer.now_us()))
+    return env
+
+
+def enable_tracing(output_dir: str = None) -> Tracer:
+    """
+    Enables tracing for this process (the root of a run) and exports the setup to the environment so
+    child processes started afterwards trace into the same directory.
+    """
+    global _tracer
+    if output_dir is None:
+        output_dir = os.path.join(DEFAULT_TRACE_ROOT, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(output_dir, exist_ok=True)
+    output_dir = os.path.abspath(output_dir)
+    _tracer = Tracer(enabled=True, output_dir=output_dir)
+    os.environ[TRACE_DIR_ENV] = output_dir
+    os.environ[TRACE_NESTED_ENV] = "1"
+    atexit.register(_tracer.save)
+    return _tracer
+
+
+def configure_from_env() -> Tracer:
+    """Enables tracing in a child process if its parent exported a trace directory."""
+    global _tracer
+    output_dir = os.getenv(TRACE_DIR_ENV)
+    if output_dir and not _tracer.enabled:
+        _tracer = Tracer(enabled=True, output_dir=output_dir, nested=os.getenv(TRACE_NESTED_ENV) == "1")
+        spawned_us = os.environ.pop(TRACE_SPAWN_ENV, None)
+        if spawned_us:
+            # From the parent's spawn call until here: interpreter start-up and module imports.
+            _tracer.add_event("process start-up", float(spawned_us), _tracer.now_us() - float(spawned_us), cat="process")
+        atexit.register(_tracer.save)
+    return _tracer
+
+
+def configure_worker() -> Tracer:
+    """
+    Initializer for process-pool workers: replaces the tracer inherited through fork (and its events) with
+    an empty one writing into the run's trace directory. Workers call save() after each task, since pool
+    processes exit without running atexit handlers.
+    """
+    global _tracer
+    output_dir = os.getenv(TRACE_DIR_ENV)
+    _tracer = Tracer(enabled=bool(output_dir), output_dir=output_dir, nested=True, process_name="worker")
+    return _tracer
+
+
+def add_trace_arguments(parser):
+    """Adds the shared --trace options to an argparse parser."""
+    parser.add_argument("--trace", action="store_true",
+                        help="Ghi timeline các span (định dạng Chrome trace, mở bằng chrome://tracing hoặc ui.perfetto.dev).")
+    parser.add_argument("--trace_dir", type=str,
+                        help=f"Thư mục chứa trace của lần chạy (mặc định: {DEFAULT_TRACE_ROOT}/<thời điểm>).")
+
+
+def setup_from_args(args) -> Tracer:
+    """Enables tracing when --trace was given, otherwise inherits it from a parent process."""
+    if getattr(args, "trace", False):
+        return enable_tracing(args.trace_dir)
+    return configure_from_env()
+
+
+def merge_parts(output_dir: str) -> str:
+    """Merges every part file in `output_dir` into trace.json (one part in memory at a time)."""
+    part_files = sorted(name for name in os.listdir(output_dir) if name.startswith("part-") and name.endswith(".json"))
+    trace_path = os.path.join(output_dir, TRACE_FILENAME)
+    count = 0
+    with open(trace_path, "w", encoding="utf-8") as out:
+        out.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+        for name in part_files:
+            with open(os.path.join(output_dir, name), "r", encoding="utf-8") as f:
+                events = json.load(f)
+            for event in events:
+                out.write((",\n" if count else "") + json.dumps(event, ensure_ascii=False))
+                count += 1
+        out.write("\n]}\n")
+    return trace_path
+
+
+def finish_and_write(tracer: Tracer = None):
+    """Saves pending events and, for the root process, writes the merged trace.json."""
+    tracer = tracer or _tracer
+    if not tracer.enabled or tracer.nested:
+        return
+    tracer.save()
+    trace_path = merge_parts(tracer.output_dir)
+    print(f"\nTrace written to: {trace_path} (open in chrome://tracing or https://ui.perfetto.dev)")
@@ -2,19 +2,22 @@ import os
 import subprocess
 import sys
 import asyncio
-from bs4 import BeautifulSoup
+from . import tracing
 
 async def run_command(command_parts: list, description: str):
     """Executes a shell command asynchronously and prints its output."""
     print(f"\n--- {description} ---")
     try:
-        process = await asyncio.create_subprocess_exec(
-            *command_parts,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        with tracing.span("subprocess", "process", command=" ".join(command_parts[1:4])) as span:
+            process = await asyncio.create_subprocess_exec(
+                *command_parts,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=tracing.spawn_env()
+            )
 
-        stdout, stderr = await process.communicate()
+            stdout, stderr = await process.communicate()
+            span["returncode"] = process.returncode
 
         if stdout:
             print(stdout.decode().strip())
@@ -46,11 +49,16 @@ def check_directory_not_empty(dirpath: str, description: str):
         return True
     return False
 
+def _parse_html(html_content: str):
+    """Parses HTML with BeautifulSoup/lxml, imported here so run_command/check_file_exists callers don't pay for it."""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html_content, 'lxml')
+
 def remove_html_tag_attributes(html_content: str) -> str:
     """
     Removes all attributes from HTML tags in the given HTML content.
     """
-    soup = BeautifulSoup(html_content, 'lxml')
+    soup = _parse_html(html_content)
     for tag in soup.find_all(True): # find_all(True) gets all tags
         tag.attrs = {} # Remove all attributes
     return str(soup)
@@ -59,14 +67,14 @@ def remove_html_tags(html_content: str) -> str:
     """
     Removes all HTML tags from the given HTML content, returning only the text.
     """
-    soup = BeautifulSoup(html_content, 'lxml')
+    soup = _parse_html(html_content)
     return soup.get_text(separator=' ', strip=True)
 
 def remove_specific_html_tags(html_content: str, tags_to_unwrap: list) -> str:
     """
     Removes specified HTML tags from the given HTML content while keeping their text content.
     """
-    soup = BeautifulSoup(html_content, 'lxml')
+    soup = _parse_html(html_content)
     for tag_name in tags_to_unwrap:
         for tag in soup.find_all(tag_name):
             tag.unwrap()